@@ -0,0 +1,226 @@
+"""
+Бенчмарк горячих запросов до и после архивации 90% сессий
+
+Заполняет пустую базу завершёнными сессиями с ответами и результатами
+(90% из них старше --age-days) и незавершёнными тестами, замеряет запросы
+/test и /results (get_active_session_with_answer, get_latest_completed_result),
+переносит старые сессии в архив через services.archive и повторяет замер
+на тех же пользователях.
+
+База и каталог архива задаются аргументами и подменяют DATABASE_URL и
+ARCHIVE_DIR — рабочую базу бота скрипт не трогает.
+
+Запуск:
+    python bench/archive_hot_path.py
+    python bench/archive_hot_path.py --sessions 200000 --lookups 5000
+    python bench/archive_hot_path.py --cache-kb 2048   # горячие таблицы не помещаются в кэш
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_SEED_CHUNK = 20_000
+_DISTINCT_REPORTS = 200
+# Доля незавершённых тестов относительно завершённых сессий
+_IN_PROGRESS_SHARE = 0.05
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Горячие запросы до и после архивации")
+    parser.add_argument("--url", default="sqlite+aiosqlite:///./bench_archive.db", help="пустая база для бенчмарка")
+    parser.add_argument("--archive-dir", default="./bench_archive", help="каталог сегментов архива")
+    parser.add_argument("--sessions", type=int, default=1_000_000, help="завершённых сессий")
+    parser.add_argument("--archived-share", type=float, default=0.9, help="доля старых сессий")
+    parser.add_argument("--age-days", type=int, default=90, help="возраст, после которого сессия уходит в архив")
+    parser.add_argument("--lookups", type=int, default=10_000, help="сколько пользователей опросить в каждом замере")
+    parser.add_argument("--batch-size", type=int, default=1000, help="сессий за одну транзакцию архивации")
+    parser.add_argument("--cache-kb", type=int, help="кэш страниц SQLite (меньше базы — как на сервере с малой памятью)")
+    return parser.parse_args()
+
+
+async def seed(sessions: int, archived_share: float, age_days: int) -> int:
+    """Заполнение пустой базы; возвращает число пользователей"""
+    from sqlalchemy import func, insert, select, text
+
+    from db.database import engine
+    from db.models import Answer, Result, ReportBlob, Session as DBSession, SessionStatus
+    from services.answer_codec import ANSWER_CHOICES, encode_answers
+    from services.report_store import build_report_blob
+
+    async with engine.begin() as conn:
+        existing = (await conn.execute(select(func.count()).select_from(DBSession))).scalar_one()
+    if existing:
+        raise SystemExit(f"В базе уже {existing} сессий — бенчмарку нужна пустая база")
+
+    rng = random.Random(1)
+    users = sessions
+    blobs = [build_report_blob(f"Отчёт #{number}\n" + "Текст отчёта о совместимости. " * 150)
+             for number in range(_DISTINCT_REPORTS)]
+    async with engine.begin() as conn:
+        await conn.execute(insert(ReportBlob), [
+            {"hash": blob.hash, "data": blob.data, "preview": blob.preview, "size": blob.size} for blob in blobs
+        ])
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    old_cutoff = now - timedelta(days=age_days)
+    in_progress = int(sessions * _IN_PROGRESS_SHARE)
+    total = sessions + in_progress
+    started = time.perf_counter()
+    for offset in range(0, total, _SEED_CHUNK):
+        numbers = range(offset, min(offset + _SEED_CHUNK, total))
+        session_rows, answer_rows, result_rows = [], [], []
+        for number in numbers:
+            completed = number < sessions
+            if completed and rng.random() < archived_share:
+                created_at = old_cutoff - timedelta(days=rng.randrange(1, 700), seconds=number)
+            else:
+                created_at = old_cutoff + timedelta(days=rng.randrange(1, age_days), seconds=number % 86400)
+            partner1 = rng.randrange(users)
+            partner2 = (partner1 + 1 + rng.randrange(users - 1)) % users
+            session_id = number + 1
+            session_rows.append({
+                "id": session_id,
+                "created_at": created_at,
+                "status": SessionStatus.COMPLETED if completed else SessionStatus.IN_PROGRESS,
+                "partner1_user_id": partner1,
+                "partner2_user_id": partner2,
+                "is_quick_check": False,
+            })
+            for role, user_id in (("partner1", partner1), ("partner2", partner2)):
+                if not completed and role == "partner2":
+                    break
+                answer_rows.append({
+                    "session_id": session_id,
+                    "user_id": user_id,
+                    "user_role": role,
+                    "answers_packed": encode_answers(rng.choices(ANSWER_CHOICES, k=5)),
+                    "completed_at": created_at,
+                })
+            if completed:
+                result_rows.append({
+                    "session_id": session_id,
+                    "compatibility_score": rng.randrange(101),
+                    "report_hash": rng.choice(blobs).hash,
+                    "created_at": created_at,
+                })
+        async with engine.begin() as conn:
+            await conn.execute(insert(DBSession), session_rows)
+            await conn.execute(insert(Answer), answer_rows)
+            if result_rows:
+                await conn.execute(insert(Result), result_rows)
+        print(f"\rЗаполнено {min(offset + _SEED_CHUNK, total)}/{total}", end="", flush=True)
+    print(f"\nЗаполнение: {time.perf_counter() - started:.1f} с")
+
+    if engine.dialect.name == "sqlite":
+        async with engine.begin() as conn:
+            await conn.execute(text("ANALYZE"))
+    return users
+
+
+async def measure(user_ids: list[int]) -> dict[str, list[float]]:
+    """Задержки горячих запросов (мс) для заданных пользователей"""
+    from db.database import async_session_maker
+    from db.repository import get_active_session_with_answer, get_latest_completed_result
+
+    queries = {
+        "/test  get_active_session_with_answer": get_active_session_with_answer,
+        "/results get_latest_completed_result": get_latest_completed_result,
+    }
+    latencies = {name: [] for name in queries}
+    async with async_session_maker() as session:
+        for name, query in queries.items():
+            for user_id in user_ids[:200]:
+                await query(session, user_id)
+            for user_id in user_ids:
+                started = time.perf_counter()
+                await query(session, user_id)
+                latencies[name].append((time.perf_counter() - started) * 1000)
+            # Не копим объекты в identity map между запросами
+            session.expunge_all()
+    return latencies
+
+
+async def table_sizes() -> str:
+    from sqlalchemy import func, select
+
+    from db.database import async_session_maker
+    from db.models import Answer, Result, Session as DBSession
+
+    parts = []
+    async with async_session_maker() as session:
+        for model in (DBSession, Answer, Result):
+            count = (await session.execute(select(func.count()).select_from(model))).scalar_one()
+            parts.append(f"{model.__tablename__}={count}")
+    return ", ".join(parts)
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def report(title: str, latencies: dict[str, list[float]]):
+    print(title)
+    for name, values in latencies.items():
+        print(
+            f"  {name}: среднее {statistics.mean(values):.3f} мс, "
+            f"p50 {percentile(values, 0.5):.3f}, p99 {percentile(values, 0.99):.3f}"
+        )
+
+
+async def run(args: argparse.Namespace):
+    from sqlalchemy import text
+
+    from db.database import engine, init_db
+    from services.archive import archive_completed_sessions
+
+    await init_db()
+    try:
+        users = await seed(args.sessions, args.archived_share, args.age_days)
+        user_ids = random.Random(2).sample(range(users), min(args.lookups, users))
+
+        print("Таблицы:", await table_sizes())
+        before = await measure(user_ids)
+        report("До архивации:", before)
+
+        started = time.perf_counter()
+        archived = await archive_completed_sessions(max_age_days=args.age_days, batch_size=args.batch_size)
+        print(f"Заархивировано сессий: {archived} за {time.perf_counter() - started:.1f} с")
+        if engine.dialect.name == "sqlite":
+            # Освобождённые страницы возвращаются файлу, иначе горячие таблицы остаются «дырявыми»
+            async with engine.connect() as conn:
+                await conn.execute(text("VACUUM"))
+                await conn.execute(text("ANALYZE"))
+
+        print("Таблицы:", await table_sizes())
+        after = await measure(user_ids)
+        report("После архивации:", after)
+
+        for name in before:
+            speedup = statistics.mean(before[name]) / statistics.mean(after[name])
+            print(f"  {name}: ускорение x{speedup:.2f}")
+    finally:
+        await engine.dispose()
+
+
+def main():
+    args = parse_args()
+    # config.py читает окружение при импорте — подменяем до импорта модулей бота
+    os.environ["DATABASE_URL"] = args.url
+    os.environ["ARCHIVE_DIR"] = args.archive_dir
+    if args.cache_kb is not None:
+        os.environ["SQLITE_CACHE_SIZE_KB"] = str(args.cache_kb)
+        os.environ["SQLITE_MMAP_SIZE"] = "0"
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
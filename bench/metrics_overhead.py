@@ -0,0 +1,141 @@
+"""
+Микробенчмарк накладных расходов метрик на один апдейт
+
+Замеряет сырую запись в Histogram/Counter и то, сколько добавляют к вызову
+HandlerTimingMiddleware (на каждый обработанный апдейт) и
+TelegramTimingMiddleware (на каждый запрос к Bot API) по сравнению с прямым
+вызовом пустого обработчика. Сеть и БД не участвуют: обработчик и make_request —
+пустые корутины, поэтому разница целиком приходится на метрики.
+
+Для каждого случая берётся лучший из --repeat прогонов по --iterations вызовов.
+
+Запуск:
+    python bench/metrics_overhead.py
+    python bench/metrics_overhead.py --iterations 1000000 --repeat 7
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.methods import SendMessage  # noqa: E402
+
+from middlewares.metrics import HandlerTimingMiddleware, TelegramTimingMiddleware  # noqa: E402
+from services.metrics import Counter, Histogram  # noqa: E402
+
+
+def best_of(repeat: int, iterations: int, run) -> float:
+    """Лучшее время одного вызова (мкс) из repeat прогонов"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(iterations)
+        best = min(best, time.perf_counter() - started)
+    return best / iterations * 1_000_000
+
+
+def best_of_async(repeat: int, iterations: int, run) -> float:
+    """То же для корутины: весь прогон выполняется в одном event loop"""
+    async def measure() -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await run(iterations)
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    return asyncio.run(measure()) / iterations * 1_000_000
+
+
+def bench_primitives(args: argparse.Namespace) -> dict[str, float]:
+    histogram = Histogram("bench_seconds", "Бенчмарк", ["handler"])
+    counter = Counter("bench_total", "Бенчмарк", ["handler"])
+
+    def observe(iterations: int):
+        for _ in range(iterations):
+            histogram.observe(0.012, "process_answer_callback")
+
+    def inc(iterations: int):
+        for _ in range(iterations):
+            counter.inc("process_answer_callback")
+
+    def empty(iterations: int):
+        for _ in range(iterations):
+            pass
+
+    loop_cost = best_of(args.repeat, args.iterations, empty)
+    return {
+        "Histogram.observe": best_of(args.repeat, args.iterations, observe) - loop_cost,
+        "Counter.inc": best_of(args.repeat, args.iterations, inc) - loop_cost,
+    }
+
+
+def bench_handler_middleware(args: argparse.Namespace) -> tuple[float, float]:
+    async def process_answer_callback(event, data):
+        return None
+
+    middleware = HandlerTimingMiddleware()
+    event = object()
+    data = {"handler": SimpleNamespace(callback=process_answer_callback)}
+
+    async def direct(iterations: int):
+        for _ in range(iterations):
+            await process_answer_callback(event, data)
+
+    async def wrapped(iterations: int):
+        for _ in range(iterations):
+            await middleware(process_answer_callback, event, data)
+
+    return (
+        best_of_async(args.repeat, args.iterations, direct),
+        best_of_async(args.repeat, args.iterations, wrapped),
+    )
+
+
+def bench_telegram_middleware(args: argparse.Namespace) -> tuple[float, float]:
+    async def make_request(bot, method):
+        return None
+
+    middleware = TelegramTimingMiddleware()
+    bot = object()
+    method = SendMessage(chat_id=1, text="бенчмарк")
+
+    async def direct(iterations: int):
+        for _ in range(iterations):
+            await make_request(bot, method)
+
+    async def wrapped(iterations: int):
+        for _ in range(iterations):
+            await middleware(make_request, bot, method)
+
+    return (
+        best_of_async(args.repeat, args.iterations, direct),
+        best_of_async(args.repeat, args.iterations, wrapped),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Накладные расходы метрик на апдейт и запрос к Bot API")
+    parser.add_argument("--iterations", type=int, default=200_000, help="вызовов в одном прогоне")
+    parser.add_argument("--repeat", type=int, default=5, help="прогонов, берётся лучший")
+    args = parser.parse_args()
+
+    print(f"Python {sys.version.split()[0]}, {args.iterations} вызовов, лучший из {args.repeat}")
+    for name, cost in bench_primitives(args).items():
+        print(f"  {name}: {cost:.3f} мкс")
+
+    for name, (direct, wrapped) in (
+        ("HandlerTimingMiddleware", bench_handler_middleware(args)),
+        ("TelegramTimingMiddleware", bench_telegram_middleware(args)),
+    ):
+        print(f"  {name}: {wrapped:.3f} мкс против {direct:.3f} мкс без middleware, "
+              f"накладные расходы {wrapped - direct:.3f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Нагрузочный бенчмарк webhook-режима
+
+Поднимает build_webhook_app на локальном порту с диспетчером, в котором один
+обработчик-заглушка (имитирует работу через asyncio.sleep, в Telegram ничего
+не отправляет), и шлёт в него синтетические Update через HTTP. Считает
+пропускную способность (обработанных апдейтов в секунду), задержку от отправки
+POST до завершения обработчика (p50/p99) и ответы 503 при переполнении очереди.
+
+Запуск:
+    python bench/webhook_load.py
+    python bench/webhook_load.py --updates 50000 --concurrency 200 --handler-ms 20
+    python bench/webhook_load.py --workers 16 --queue-size 100   # проверить backpressure
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher, Router, types  # noqa: E402
+from aiohttp import ClientSession, TCPConnector, web  # noqa: E402
+
+from services.webhook import SECRET_HEADER, UpdateExecutor, build_webhook_app  # noqa: E402
+
+_PATH = "/webhook"
+_SECRET = "bench-secret"
+
+
+def synthetic_update(update_id: int, users: int) -> dict:
+    """Апдейт с текстовым сообщением от случайного пользователя"""
+    user_id = random.randrange(1, users + 1)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            "text": random.choice("ABCDE"),
+        },
+    }
+
+
+def build_dispatcher(handler_seconds: float, sent_at: dict, latencies: list) -> Dispatcher:
+    """Диспетчер с обработчиком-заглушкой, который записывает задержку каждого апдейта"""
+    router = Router()
+
+    @router.message()
+    async def handle(message: types.Message):
+        if handler_seconds:
+            await asyncio.sleep(handler_seconds)
+        latencies.append(time.perf_counter() - sent_at.pop(message.message_id))
+
+    dispatcher = Dispatcher()
+    dispatcher.include_router(router)
+    return dispatcher
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def run(args: argparse.Namespace):
+    sent_at: dict[int, float] = {}
+    latencies: list[float] = []
+
+    bot = Bot("123456:bench-token")
+
+    async def set_webhook(*_args, **_kwargs):
+        # Заглушка: бенчмарк не регистрирует webhook в Telegram
+        return True
+
+    bot.set_webhook = set_webhook
+
+    dispatcher = build_dispatcher(args.handler_ms / 1000, sent_at, latencies)
+    executor = UpdateExecutor(dispatcher, bot, workers=args.workers, queue_size=args.queue_size)
+    app = build_webhook_app(dispatcher, bot, executor, path=_PATH, secret=_SECRET)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    url = f"http://127.0.0.1:{args.port}{_PATH}"
+
+    statuses: dict[int, int] = {}
+    rejected = 0
+    next_id = iter(range(1, args.updates + 1))
+
+    async def client(session: ClientSession):
+        nonlocal rejected
+        for update_id in next_id:
+            payload = synthetic_update(update_id, args.users)
+            sent_at[update_id] = time.perf_counter()
+            async with session.post(url, json=payload, headers={SECRET_HEADER: _SECRET}) as response:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                if response.status != 200:
+                    # Telegram повторил бы доставку позже; в бенчмарке просто считаем отказ
+                    sent_at.pop(update_id, None)
+                    rejected += 1
+
+    started = time.perf_counter()
+    try:
+        async with ClientSession(connector=TCPConnector(limit=args.concurrency)) as session:
+            await asyncio.gather(*(client(session) for _ in range(args.concurrency)))
+        posted = time.perf_counter() - started
+        # Дожидаемся обработки всего принятого
+        while len(latencies) < args.updates - rejected:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
+    handled = len(latencies)
+    print(f"Апдейтов: {args.updates}, клиентов: {args.concurrency}, воркеров: {args.workers}, "
+          f"очередь: {args.queue_size}, обработчик: {args.handler_ms} мс")
+    print(f"Ответы HTTP: {dict(sorted(statuses.items()))}")
+    print(f"Отправка: {posted:.2f} с, всего до конца обработки: {elapsed:.2f} с")
+    print(f"Пропускная способность: {handled / elapsed:.0f} апдейтов/с")
+    if latencies:
+        values = [latency * 1000 for latency in latencies]
+        print(f"Задержка до конца обработчика: среднее {statistics.mean(values):.2f} мс, "
+              f"p50 {percentile(values, 0.5):.2f}, p99 {percentile(values, 0.99):.2f}, "
+              f"max {max(values):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузка на webhook: апдейты/с и p99 задержки")
+    parser.add_argument("--updates", type=int, default=20_000, help="сколько апдейтов отправить")
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременных HTTP-запросов")
+    parser.add_argument("--users", type=int, default=5_000, help="разных отправителей")
+    parser.add_argument("--handler-ms", type=float, default=5, help="время работы обработчика-заглушки")
+    parser.add_argument("--workers", type=int, default=64, help="воркеров UpdateExecutor (WEBHOOK_WORKERS)")
+    parser.add_argument("--queue-size", type=int, default=1000, help="очередь апдейтов (WEBHOOK_QUEUE_SIZE)")
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
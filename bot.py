@@ -7,18 +7,83 @@ import logging
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import BOT_TOKEN
+from config import BOT_TOKEN, BOT_MODE, ARCHIVE_AFTER_DAYS, FSM_STORAGE
 from db.database import init_db
+from db.fsm_storage import SQLStorage
 from handlers import start, test, results
+from middlewares.antiflood import AntiFloodMiddleware
+from middlewares.logging_context import LogContextMiddleware
+from middlewares.metrics import HandlerTimingMiddleware, TelegramTimingMiddleware
+from middlewares.tracing import TracingMiddleware, TracingRequestMiddleware
+from services.analysis_jobs import analysis_workers
+from services.archive import run_archiver
+from services.campaigns import campaign_sender, run_campaign_scheduler
+from services.llm_client import llm
+from services.logging_setup import logging_stats, setup_logging
+from services.metrics import register_collector, start_metrics_server
+from services.tracing import exporter_stats, run_trace_exporter
+from services.reaper import run_session_reaper
+from services.regenerator import run_report_regenerator
+from services.report_cache import report_cache
+from services.sender import sender
+from services.webhook import run_webhook
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Настройка логирования: запись в stdout идёт в отдельном потоке, event loop не блокируется
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
+def create_bot() -> Bot:
+    """Создание бота"""
+    bot = Bot(token=BOT_TOKEN)
+    bot.session.middleware(TelegramTimingMiddleware())
+    bot.session.middleware(TracingRequestMiddleware())
+    return bot
+
+
+def create_dispatcher() -> Dispatcher:
+    """Создание диспетчера с хранилищем FSM и всеми роутерами"""
+    storage = SQLStorage() if FSM_STORAGE == "sql" else MemoryStorage()
+    dp = Dispatcher(storage=storage)
+
+    # Антифлуд: по одному апдейту на пользователя, без двойных нажатий и спама
+    # Контекст логов и трассировка — первыми, чтобы в них попало и ожидание антифлуда
+    dp.update.outer_middleware(LogContextMiddleware())
+    dp.update.outer_middleware(TracingMiddleware())
+    antiflood = AntiFloodMiddleware()
+    dp.update.outer_middleware(antiflood)
+
+    # Подключение роутеров (с замером времени обработчиков)
+    for router in (start.router, test.router, results.router):
+        router.message.middleware(HandlerTimingMiddleware())
+        router.callback_query.middleware(HandlerTimingMiddleware())
+        dp.include_router(router)
+
+    register_collector("lovebot_antiflood", antiflood.stats)
+    register_collector("lovebot_sender", sender.stats)
+    register_collector("lovebot_campaign_sender", campaign_sender.stats)
+    register_collector("lovebot_traces", exporter_stats)
+    register_collector("lovebot_logs", logging_stats)
+    register_collector("lovebot_report_cache", report_cache.stats)
+    register_collector("lovebot_openai", llm.stats)
+    register_collector("lovebot_analysis_jobs", analysis_workers.stats)
+    return dp
+
+
+def start_background_tasks(bot: Bot) -> list[asyncio.Task]:
+    """Фоновые задачи: воркеры анализа, очистка сессий, архивация, рассылка мини-тестов, перегенерация отчётов и выгрузка трасс"""
+    background_tasks = [
+        *analysis_workers.start(bot),
+        asyncio.create_task(run_session_reaper()),
+        asyncio.create_task(run_campaign_scheduler(bot)),
+        asyncio.create_task(run_report_regenerator(bot)),
+        asyncio.create_task(run_trace_exporter()),
+    ]
+    if ARCHIVE_AFTER_DAYS > 0:
+        background_tasks.append(asyncio.create_task(run_archiver()))
+    return background_tasks
+
+
 async def main():
     """Основная функция запуска бота"""
     # Инициализация базы данных
@@ -27,21 +92,26 @@ async def main():
     logger.info("База данных инициализирована ✓")
 
     # Создание бота и диспетчера
-    bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+    bot = create_bot()
+    dp = create_dispatcher()
 
-    # Подключение роутеров
-    dp.include_router(start.router)
-    dp.include_router(test.router)
-    dp.include_router(results.router)
+    background_tasks = start_background_tasks(bot)
+    metrics_runner = await start_metrics_server()
 
     logger.info("Бот запущен ✓")
 
-    # Запуск polling
+    # Webhook в продакшене, polling для локальной разработки
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        for task in background_tasks:
+            task.cancel()
+        await sender.drain()
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await bot.session.close()
 
 
@@ -12,13 +12,132 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "your-telegram-token")
 
 # OpenAI API Key
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "your-openai-key")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None  # другой endpoint (прокси, локальный сервер); по умолчанию api.openai.com
+
+# Устойчивость запросов к OpenAI (services/llm_client.py)
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))  # одновременных запросов, остальные ждут
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "90"))  # дедлайн одной попытки (включая чтение потока)
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))  # повторы при 429/5xx/таймауте
+OPENAI_BREAKER_THRESHOLD = int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5"))  # неудачных вызовов подряд до размыкания
+OPENAI_BREAKER_COOLDOWN = float(os.getenv("OPENAI_BREAKER_COOLDOWN", "60"))  # секунд без запросов после размыкания
+REGENERATE_INTERVAL_SECONDS = int(os.getenv("REGENERATE_INTERVAL_SECONDS", "300"))  # как часто перегенерировать базовые отчёты
+REGENERATE_BATCH_SIZE = int(os.getenv("REGENERATE_BATCH_SIZE", "20"))
+
+# Очередь задач анализа (services/analysis_jobs.py)
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))  # одновременно выполняемых анализов
+ANALYSIS_LEASE_SECONDS = int(os.getenv("ANALYSIS_LEASE_SECONDS", "120"))  # аренда задачи; после падения её заберёт другой воркер
+ANALYSIS_POLL_SECONDS = float(os.getenv("ANALYSIS_POLL_SECONDS", "1"))  # как часто проверять очередь без уведомления
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "5"))  # после стольких ошибок партнёры получают базовый отчёт
+
+# Режим получения апдейтов: "polling" (локальная разработка) или "webhook" (продакшен)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")  # публичный https-адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # сверяется с X-Telegram-Bot-Api-Secret-Token; обязателен для webhook
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "64"))  # апдейтов, обрабатываемых одновременно
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))  # очередь до ответа 503
+WEBHOOK_QUEUE_TIMEOUT = float(os.getenv("WEBHOOK_QUEUE_TIMEOUT", "1.0"))  # ожидание места в очереди
+
+# Многопроцессный режим (supervisor.py): апдейты шардируются по Telegram ID пользователя
+SUPERVISOR_WORKERS = int(os.getenv("SUPERVISOR_WORKERS", str(os.cpu_count() or 1)))
+SUPERVISOR_QUEUE_SIZE = int(os.getenv("SUPERVISOR_QUEUE_SIZE", "1000"))  # апдейтов в очереди воркера
+SUPERVISOR_HEARTBEAT_SECONDS = float(os.getenv("SUPERVISOR_HEARTBEAT_SECONDS", "5"))
+SUPERVISOR_HEARTBEAT_TIMEOUT = float(os.getenv("SUPERVISOR_HEARTBEAT_TIMEOUT", "30"))  # после — перезапуск
+SUPERVISOR_SHUTDOWN_TIMEOUT = float(os.getenv("SUPERVISOR_SHUTDOWN_TIMEOUT", "30"))  # на дообработку очереди
+
+# Очередь исходящих сообщений (services/sender.py)
+SENDER_GLOBAL_RATE = float(os.getenv("SENDER_GLOBAL_RATE", "20"))  # сообщений/с; вместе с CAMPAIGN_SEND_RATE ≤ 30
+SENDER_CHAT_RATE = float(os.getenv("SENDER_CHAT_RATE", "1"))  # сообщений/с в один чат
+SENDER_CHAT_BURST = float(os.getenv("SENDER_CHAT_BURST", "3"))  # допустимая пачка в один чат
+SENDER_CONCURRENCY = int(os.getenv("SENDER_CONCURRENCY", "30"))  # одновременных запросов к Bot API
+SENDER_MAX_RETRIES = int(os.getenv("SENDER_MAX_RETRIES", "3"))
+
+# Еженедельные мини-тесты для подписчиков LoveBot+ (services/campaigns.py)
+CAMPAIGN_INTERVAL_DAYS = int(os.getenv("CAMPAIGN_INTERVAL_DAYS", "7"))
+CAMPAIGN_SEND_RATE = float(os.getenv("CAMPAIGN_SEND_RATE", "10"))  # сообщений/с, отдельно от интерактивных
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", "500"))  # подписчиков за одну выборку
+CAMPAIGN_POLL_SECONDS = int(os.getenv("CAMPAIGN_POLL_SECONDS", "60"))
+CAMPAIGN_RESUME_AFTER_SECONDS = int(os.getenv("CAMPAIGN_RESUME_AFTER_SECONDS", "600"))  # повтор зависших доставок
+CAMPAIGN_CHECKPOINT_RETENTION_DAYS = int(os.getenv("CAMPAIGN_CHECKPOINT_RETENTION_DAYS", "30"))
+
+# Антифлуд (middlewares/antiflood.py)
+ANTIFLOOD_RATE = float(os.getenv("ANTIFLOOD_RATE", "3"))  # апдейтов/с от одного пользователя
+ANTIFLOOD_BURST = float(os.getenv("ANTIFLOOD_BURST", "5"))
+ANTIFLOOD_MAX_DELAY = float(os.getenv("ANTIFLOOD_MAX_DELAY", "1.0"))  # дольше — апдейт отбрасывается
+ANTIFLOOD_DUPLICATE_WINDOW = float(os.getenv("ANTIFLOOD_DUPLICATE_WINDOW", "10"))  # секунд
+ANTIFLOOD_IDLE_SECONDS = float(os.getenv("ANTIFLOOD_IDLE_SECONDS", "300"))  # удаление неактивных корзин
+
+# Метрики Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (0 — выключено)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Логирование (services/logging_setup.py): json — структурированные логи, text — для локальной разработки
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # записей в очереди; при переполнении отбрасываются
+
+# Трассировка (services/tracing.py): none, file (JSONL) или otlp (OTLP/HTTP JSON)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))  # доля записываемых апдейтов
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+TRACE_FLUSH_SECONDS = float(os.getenv("TRACE_FLUSH_SECONDS", "5"))
+TRACE_MAX_QUEUE = int(os.getenv("TRACE_MAX_QUEUE", "10000"))  # спанов в памяти до выгрузки
 
 # Database URL (SQLite для MVP, легко заменить на PostgreSQL)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./lovebot.db")
 
+# Движок БД
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"  # логировать каждый SQL-запрос (только для отладки)
+DB_SLOW_QUERY_MS = int(os.getenv("DB_SLOW_QUERY_MS", "0"))  # 0 — лог медленных запросов выключен
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # секунд ожидания свободного соединения
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # пересоздавать соединения старше N секунд
+
+# Настройки SQLite (PRAGMA для каждого нового соединения)
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Хранилище состояний FSM: "sql" — в той же БД (переживает рестарт, общее для процессов),
+# "memory" — в памяти процесса (для локальной разработки)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sql")
+FSM_STATE_TTL_SECONDS = int(os.getenv("FSM_STATE_TTL_SECONDS", str(24 * 3600)))  # брошенный тест живёт сутки
+FSM_FLUSH_INTERVAL_SECONDS = float(os.getenv("FSM_FLUSH_INTERVAL_SECONDS", "0.2"))  # пачечная запись
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))  # ключей в локальном кэше чтения
+FSM_CACHE_TTL_SECONDS = float(os.getenv("FSM_CACHE_TTL_SECONDS", "30"))
+
+# Stateless-режим теста: ответы и ID сессии едут в подписанном callback_data кнопок,
+# хранилище FSM трогается только при завершении теста
+STATELESS_QUIZ = os.getenv("STATELESS_QUIZ", "0") == "1"
+QUIZ_CALLBACK_SECRET = os.getenv("QUIZ_CALLBACK_SECRET", BOT_TOKEN)
+
 # Настройки бота
 MAX_SESSION_LIFETIME_HOURS = 24
+REAPER_INTERVAL_SECONDS = int(os.getenv("REAPER_INTERVAL_SECONDS", "600"))  # как часто чистить истёкшие сессии
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "500"))  # сессий за одну транзакцию
+REAPER_BATCH_PAUSE_SECONDS = float(os.getenv("REAPER_BATCH_PAUSE_SECONDS", "0.5"))  # пауза между пачками
+
+# Архив завершённых сессий (сжатые append-only сегменты на диске)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))  # 0 — архивация выключена
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+ARCHIVE_SEGMENT_MAX_BYTES = int(os.getenv("ARCHIVE_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))
 FREE_REPORT_LIMIT = 500  # количество символов в бесплатном отчёте
+REPORT_COMPRESSION_LEVEL = 9  # уровень zlib для хранимых отчётов (пишутся один раз, читаются редко)
+
+# Потоковая генерация отчёта: превью дописывается в сообщении «Анализирую...» по мере ответа OpenAI
+STREAM_REPORTS = os.getenv("STREAM_REPORTS", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))  # секунд между правками сообщения
+
+# Кэш отчётов по паре ответов (services/report_cache.py)
+REPORT_CACHE_VARIANTS = int(os.getenv("REPORT_CACHE_VARIANTS", "1"))  # вариантов отчёта на пару, 0 — без кэша
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "2048"))  # пар в памяти процесса
 
 # ID создателей (для тестовых функций)
 ADMIN_IDS = [7490061524]  # Твой Telegram ID
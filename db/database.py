@@ -2,19 +2,126 @@
 Подключение к базе данных
 """
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
-from sqlalchemy.pool import NullPool
-from .models import Base
-from config import DATABASE_URL
+import logging
+import time
 
-# Создание асинхронного движка
-engine = create_async_engine(
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+from .models import Base
+from services.metrics import DB_QUERY_SECONDS
+from services.tracing import SPAN_KIND_CLIENT, begin_span
+from .migrations import run_migrations
+from config import (
     DATABASE_URL,
-    echo=True,
-    future=True,
-    poolclass=NullPool  # для SQLite
+    DB_SLOW_QUERY_MS,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_CACHE_SIZE_KB,
+    SQLITE_MMAP_SIZE,
 )
 
+logger = logging.getLogger(__name__)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Настройка каждого нового SQLite-соединения (WAL и тюнинг кэша)"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    # Отрицательное значение cache_size задаёт размер в килобайтах, а не в страницах
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+    conn.info.setdefault("query_span", []).append(
+        begin_span("db.query", SPAN_KIND_CLIENT, root=False, statement=statement)
+    )
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_span"].pop().end()
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    # Метка — только тип запроса (SELECT, INSERT, ...), чтобы не плодить серии
+    DB_QUERY_SECONDS.observe(elapsed, statement.split(None, 1)[0].upper())
+    if DB_SLOW_QUERY_MS > 0 and elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        logger.warning("Медленный запрос (%.1f мс): %s", elapsed * 1000, statement)
+
+
+def _handle_db_error(context):
+    """Запрос упал: after_cursor_execute не будет, закрываем замер здесь"""
+    conn = context.connection
+    if conn is None or not conn.info.get("query_span"):
+        return
+    span = conn.info["query_span"].pop()
+    span.record_error(context.original_exception)
+    span.end()
+    conn.info["query_start_time"].pop()
+
+
+def build_engine(url: str = DATABASE_URL) -> AsyncEngine:
+    """
+    Создание асинхронного движка с профилем под конкретную СУБД
+
+    Args:
+        url: строка подключения SQLAlchemy
+
+    Returns:
+        AsyncEngine: настроенный движок
+    """
+    db_url = make_url(url)
+    options = {
+        "pool_pre_ping": True,
+    }
+
+    if db_url.get_backend_name() == "sqlite":
+        if db_url.database in (None, "", ":memory:"):
+            # In-memory база живёт только внутри одного соединения
+            options["poolclass"] = StaticPool
+        else:
+            # aiosqlite по умолчанию использует NullPool — открывает файл на каждый запрос
+            options.update(
+                poolclass=AsyncAdaptedQueuePool,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+            )
+    else:
+        # PostgreSQL (asyncpg) и другие серверные СУБД
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+
+    new_engine = create_async_engine(db_url, **options)
+
+    if db_url.get_backend_name() == "sqlite":
+        event.listen(new_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+    # Время запросов: гистограмма для /metrics, спаны трассировки и лог медленных запросов
+    event.listen(new_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(new_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(new_engine.sync_engine, "handle_error", _handle_db_error)
+
+    return new_engine
+
+
+# Создание асинхронного движка
+engine = build_engine()
+
 # Фабрика сессий
 async_session_maker = async_sessionmaker(
     engine,
@@ -24,9 +131,10 @@ async_session_maker = async_sessionmaker(
 
 
 async def init_db():
-    """Инициализация базы данных (создание таблиц)"""
+    """Инициализация базы данных (создание таблиц и миграции)"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
 
 
 async def get_session() -> AsyncSession:
@@ -0,0 +1,188 @@
+"""
+Хранилище FSM в базе данных (замена MemoryStorage)
+
+Состояние теста переживает рестарт бота и доступно из нескольких процессов.
+Записи копятся в памяти и сбрасываются в БД одной транзакцией раз
+в FSM_FLUSH_INTERVAL_SECONDS, а чтения обслуживаются небольшим локальным
+кэшем. Кэш согласован, пока апдейты одного пользователя обрабатывает один
+процесс.
+"""
+
+import asyncio
+import contextlib
+import copy
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from config import (
+    FSM_STATE_TTL_SECONDS,
+    FSM_FLUSH_INTERVAL_SECONDS,
+    FSM_CACHE_SIZE,
+    FSM_CACHE_TTL_SECONDS,
+)
+from .database import async_session_maker
+from .models import FSMRecord
+from .queries import dialect_insert
+
+logger = logging.getLogger(__name__)
+
+# Удалять просроченные записи не чаще, чем раз в минуту
+_PURGE_INTERVAL_SECONDS = 60
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class SQLStorage(BaseStorage):
+    """FSM-хранилище поверх таблицы fsm_states"""
+
+    def __init__(
+        self,
+        session_maker: async_sessionmaker = async_session_maker,
+        key_builder: Optional[KeyBuilder] = None,
+        state_ttl: int = FSM_STATE_TTL_SECONDS,
+        flush_interval: float = FSM_FLUSH_INTERVAL_SECONDS,
+        cache_size: int = FSM_CACHE_SIZE,
+        cache_ttl: float = FSM_CACHE_TTL_SECONDS,
+    ):
+        self.session_maker = session_maker
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.state_ttl = state_ttl
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+
+        # ключ → (state, data, момент кэширования)
+        self._cache: OrderedDict[str, tuple[Optional[str], Dict[str, Any], float]] = OrderedDict()
+        # ключ → (state, data), ещё не записанные в БД
+        self._pending: Dict[str, tuple[Optional[str], Dict[str, Any]]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        _, data = await self._read(storage_key)
+        self._write(storage_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._read(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        state, _ = await self._read(storage_key)
+        self._write(storage_key, state, copy.deepcopy(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._read(self.key_builder.build(key))
+        return copy.deepcopy(data)
+
+    async def close(self) -> None:
+        flusher, self._flusher = self._flusher, None
+        if flusher:
+            # Прерванный сброс возвращает свою пачку в _pending — дожидаемся этого
+            flusher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await flusher
+        await self.flush()
+
+    async def _read(self, storage_key: str) -> tuple[Optional[str], Dict[str, Any]]:
+        """Чтение: несброшенные записи → локальный кэш → БД"""
+        if storage_key in self._pending:
+            return self._pending[storage_key]
+
+        cached = self._cache.get(storage_key)
+        if cached and time.monotonic() - cached[2] < self.cache_ttl:
+            self._cache.move_to_end(storage_key)
+            return cached[0], cached[1]
+
+        async with self.session_maker() as session:
+            result = await session.execute(
+                select(FSMRecord.state, FSMRecord.data).where(
+                    FSMRecord.key == storage_key,
+                    FSMRecord.expires_at > _utcnow()
+                )
+            )
+            row = result.first()
+
+        state, data = (row.state, json.loads(row.data) if row.data else {}) if row else (None, {})
+        self._remember(storage_key, state, data)
+        return state, data
+
+    def _write(self, storage_key: str, state: Optional[str], data: Dict[str, Any]):
+        """Запись в кэш и очередь на сброс в БД"""
+        self._pending[storage_key] = (state, data)
+        self._remember(storage_key, state, data)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    def _remember(self, storage_key: str, state: Optional[str], data: Dict[str, Any]):
+        self._cache[storage_key] = (state, data, time.monotonic())
+        self._cache.move_to_end(storage_key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _flush_loop(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Не удалось записать состояния FSM, повторю позже")
+
+    async def flush(self):
+        """Сброс накопленных записей в БД одной транзакцией"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+
+        expires_at = _utcnow() + timedelta(seconds=self.state_ttl)
+        rows = []
+        empty_keys = []
+        for storage_key, (state, data) in batch.items():
+            if state is None and not data:
+                empty_keys.append(storage_key)
+            else:
+                rows.append({
+                    "key": storage_key,
+                    "state": state,
+                    "data": json.dumps(data, ensure_ascii=False),
+                    "expires_at": expires_at,
+                })
+
+        try:
+            async with self.session_maker() as session:
+                if rows:
+                    insert_stmt = dialect_insert(session, FSMRecord).values(rows)
+                    await session.execute(
+                        insert_stmt.on_conflict_do_update(
+                            index_elements=["key"],
+                            set_={
+                                "state": insert_stmt.excluded.state,
+                                "data": insert_stmt.excluded.data,
+                                "expires_at": insert_stmt.excluded.expires_at,
+                            },
+                        )
+                    )
+                if empty_keys:
+                    await session.execute(delete(FSMRecord).where(FSMRecord.key.in_(empty_keys)))
+                if time.monotonic() - self._last_purge > _PURGE_INTERVAL_SECONDS:
+                    await session.execute(delete(FSMRecord).where(FSMRecord.expires_at <= _utcnow()))
+                    self._last_purge = time.monotonic()
+                await session.commit()
+        except BaseException:
+            # Возвращаем несохранённое в очередь (в т.ч. при отмене на остановке бота),
+            # не затирая более свежие записи
+            for storage_key, value in batch.items():
+                self._pending.setdefault(storage_key, value)
+            raise
@@ -0,0 +1,189 @@
+"""
+Миграции схемы для уже существующих баз данных
+
+create_all создаёт только отсутствующие таблицы, поэтому изменения
+в существующих таблицах применяются здесь. Каждый шаг идемпотентен.
+"""
+
+import json
+import logging
+
+from sqlalchemy import String, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+
+from .models import Base, SessionStatus, ReportBlob
+from services.answer_codec import encode_answers
+from services.report_store import build_report_blob
+
+logger = logging.getLogger(__name__)
+
+# Старые строковые статусы сессий → SMALLINT
+_STATUS_NAMES = ", ".join(f"'{status.name.lower()}'" for status in SessionStatus)
+_STATUS_CASE = "CASE status " + " ".join(
+    f"WHEN '{status.name.lower()}' THEN {int(status)}" for status in SessionStatus
+) + " END"
+
+
+def _add_missing_column(conn: Connection, table: str, column: str, ddl: str) -> bool:
+    """ALTER TABLE ... ADD COLUMN, если колонки ещё нет; True — если колонка добавлена"""
+    columns = {existing["name"] for existing in inspect(conn).get_columns(table)}
+    if column in columns:
+        return False
+
+    logger.info("Миграция: добавляю %s.%s", table, column)
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def _migrate_session_status(conn: Connection):
+    """Перевод sessions.status со строк на SessionStatus"""
+    columns = {column["name"]: column for column in inspect(conn).get_columns("sessions")}
+    if not isinstance(columns["status"]["type"], String):
+        return
+
+    if conn.dialect.name == "postgresql":
+        logger.info("Миграция: sessions.status → SMALLINT")
+        conn.execute(text("ALTER TABLE sessions ALTER COLUMN status DROP DEFAULT"))
+        conn.execute(text(
+            f"ALTER TABLE sessions ALTER COLUMN status TYPE SMALLINT USING ({_STATUS_CASE})"
+        ))
+    else:
+        # SQLite не умеет менять тип колонки — переписываем значения на месте
+        result = conn.execute(text(
+            f"UPDATE sessions SET status = {_STATUS_CASE} WHERE status IN ({_STATUS_NAMES})"
+        ))
+        if result.rowcount:
+            logger.info("Миграция: sessions.status → SMALLINT (%d строк)", result.rowcount)
+
+
+def _migrate_packed_answers(conn: Connection):
+    """Перевод answers.answers (JSON-список) в answers.answers_packed (BIGINT)"""
+    columns = {column["name"] for column in inspect(conn).get_columns("answers")}
+    if "answers" not in columns:
+        return
+
+    logger.info("Миграция: answers.answers → answers_packed")
+    if "answers_packed" not in columns:
+        conn.execute(text("ALTER TABLE answers ADD COLUMN answers_packed BIGINT"))
+
+    rows = conn.execute(text("SELECT id, answers FROM answers WHERE answers_packed IS NULL")).all()
+    for row_id, raw_answers in rows:
+        answers = json.loads(raw_answers) if isinstance(raw_answers, str) else raw_answers
+        conn.execute(
+            text("UPDATE answers SET answers_packed = :packed WHERE id = :id"),
+            {"packed": encode_answers(answers), "id": row_id},
+        )
+
+    conn.execute(text("ALTER TABLE answers DROP COLUMN answers"))
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ALTER TABLE answers ALTER COLUMN answers_packed SET NOT NULL"))
+
+
+def _migrate_report_blobs(conn: Connection):
+    """Перенос results.report (полный текст) в report_blobs со ссылкой results.report_hash"""
+    columns = {column["name"] for column in inspect(conn).get_columns("results")}
+    if "report" not in columns:
+        return
+
+    logger.info("Миграция: results.report → report_blobs")
+    if "report_hash" not in columns:
+        conn.execute(text("ALTER TABLE results ADD COLUMN report_hash VARCHAR(64)"))
+
+    dialect = postgresql if conn.dialect.name == "postgresql" else sqlite
+    rows = conn.execute(text("SELECT id, report FROM results WHERE report_hash IS NULL")).all()
+    for row_id, report in rows:
+        blob = build_report_blob(report)
+        conn.execute(
+            dialect.insert(ReportBlob)
+            .values(hash=blob.hash, data=blob.data, preview=blob.preview, size=blob.size)
+            .on_conflict_do_nothing(index_elements=["hash"])
+        )
+        conn.execute(
+            text("UPDATE results SET report_hash = :hash WHERE id = :id"),
+            {"hash": blob.hash, "id": row_id},
+        )
+
+    conn.execute(text("ALTER TABLE results DROP COLUMN report"))
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ALTER TABLE results ALTER COLUMN report_hash SET NOT NULL"))
+        conn.execute(text(
+            "ALTER TABLE results ADD FOREIGN KEY (report_hash) REFERENCES report_blobs (hash)"
+        ))
+
+
+def _dedupe_results(conn: Connection):
+    """Удаление дублей results (до уникального индекса по session_id остаётся самый ранний)"""
+    existing = {index["name"] for index in inspect(conn).get_indexes("results")}
+    if "uq_results_session" in existing:
+        return
+
+    result = conn.execute(text(
+        "DELETE FROM results WHERE id NOT IN (SELECT MIN(id) FROM results GROUP BY session_id)"
+    ))
+    if result.rowcount:
+        logger.info("Миграция: удалено дублей results: %d", result.rowcount)
+
+
+def _migrate_user_profiles(conn: Connection):
+    """Колонки для быстрой проверки и заполнение user_profiles последними ответами"""
+    if _add_missing_column(conn, "sessions", "is_quick_check", "BOOLEAN NOT NULL DEFAULT FALSE"):
+        conn.execute(text(
+            f"UPDATE sessions SET is_quick_check = TRUE WHERE status = {int(SessionStatus.QUICK_CHECK)}"
+        ))
+    _add_missing_column(conn, "results", "answers1_packed", "BIGINT")
+    _add_missing_column(conn, "results", "answers2_packed", "BIGINT")
+
+    if conn.execute(text("SELECT 1 FROM user_profiles LIMIT 1")).first():
+        return
+    result = conn.execute(text(
+        "INSERT INTO user_profiles (user_id, answers_packed, updated_at) "
+        "SELECT a.user_id, a.answers_packed, a.completed_at FROM answers a "
+        "WHERE a.id = ("
+        "  SELECT latest.id FROM answers latest WHERE latest.user_id = a.user_id "
+        "  ORDER BY latest.completed_at DESC, latest.id DESC LIMIT 1"
+        ")"
+    ))
+    if result.rowcount:
+        logger.info("Миграция: заполнено user_profiles: %d", result.rowcount)
+
+
+def _migrate_provisional_results(conn: Connection):
+    """Флаг results.is_provisional для базовых отчётов, которые нужно перегенерировать"""
+    _add_missing_column(conn, "results", "is_provisional", "BOOLEAN NOT NULL DEFAULT FALSE")
+
+
+def _migrate_analysis_job_trace(conn: Connection):
+    """Контекст трассы в analysis_jobs: анализ продолжает трассу апдейта"""
+    _add_missing_column(conn, "analysis_jobs", "trace_id", "VARCHAR(32)")
+    _add_missing_column(conn, "analysis_jobs", "parent_span_id", "VARCHAR(16)")
+    _add_missing_column(conn, "analysis_jobs", "trace_sampled", "BOOLEAN")
+
+
+def _create_missing_indexes(conn: Connection):
+    """Создание индексов, добавленных в модели после создания таблиц"""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info("Миграция: создаю индекс %s", index.name)
+                index.create(conn)
+
+
+MIGRATIONS = [
+    _migrate_session_status,
+    _migrate_packed_answers,
+    _migrate_report_blobs,
+    _dedupe_results,
+    _migrate_user_profiles,
+    _migrate_provisional_results,
+    _migrate_analysis_job_trace,
+    _create_missing_indexes,
+]
+
+
+def run_migrations(conn: Connection):
+    """Применение всех миграций (вызывается из init_db через run_sync)"""
+    for migration in MIGRATIONS:
+        migration(conn)
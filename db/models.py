@@ -2,21 +2,74 @@
 SQLAlchemy модели для базы данных
 """
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, func, UniqueConstraint, Index
-from sqlalchemy.orm import declarative_base, relationship
+import enum
+
+from sqlalchemy import BigInteger, Boolean, Column, Integer, SmallInteger, String, LargeBinary, DateTime, ForeignKey, func, text, UniqueConstraint, Index
+from sqlalchemy.orm import declarative_base, deferred, relationship
+from sqlalchemy.types import TypeDecorator
+
+from services.answer_codec import encode_answers, decode_answers
 
 Base = declarative_base()
 
 
+class SessionStatus(enum.IntEnum):
+    """Статус сессии (хранится в БД как SMALLINT)"""
+    PENDING = 0
+    IN_PROGRESS = 1
+    COMPLETED = 2
+    QUICK_CHECK = 3
+    ANALYZING = 4  # оба ответа получены, анализ уже запущен одним из обработчиков
+
+
+class SessionStatusType(TypeDecorator):
+    """Колонка статуса: SMALLINT в БД, SessionStatus в Python"""
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else int(value)
+
+    def process_literal_param(self, value, dialect):
+        return str(int(value))
+
+    def process_result_value(self, value, dialect):
+        # int() — на случай старых SQLite-файлов, где колонка осталась с TEXT-аффинностью
+        return None if value is None else SessionStatus(int(value))
+
+
+def _partner_status_index(partner_column: str, status: SessionStatus) -> Index:
+    """Частичный индекс (partnerN_user_id, created_at) только для строк с нужным статусом"""
+    condition = f"status = {int(status)}"
+    return Index(
+        f"idx_sessions_{partner_column}_{status.name.lower()}",
+        partner_column,
+        "created_at",
+        sqlite_where=text(condition),
+        postgresql_where=text(condition),
+    )
+
+
 class Session(Base):
     """Сессия тестирования пары"""
     __tablename__ = "sessions"
+    __table_args__ = (
+        # Горячие запросы: «последняя сессия пользователя в статусе X» по каждому из партнёров
+        _partner_status_index("partner1_user_id", SessionStatus.IN_PROGRESS),
+        _partner_status_index("partner2_user_id", SessionStatus.IN_PROGRESS),
+        _partner_status_index("partner1_user_id", SessionStatus.COMPLETED),
+        _partner_status_index("partner2_user_id", SessionStatus.COMPLETED),
+        # Поиск истёкших сессий фоновой очисткой (services/reaper.py)
+        Index("idx_sessions_status_created", "status", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     created_at = Column(DateTime, default=func.now())
-    status = Column(String, default="pending")  # pending, in_progress, completed, quick_check
+    status = Column(SessionStatusType, default=SessionStatus.PENDING, nullable=False)
     partner1_user_id = Column(Integer, nullable=True)  # Telegram user ID первого партнёра
     partner2_user_id = Column(Integer, nullable=True)  # Telegram user ID второго партнёра
+    # Быстрая проверка: ответы первого партнёра берутся из user_profiles, а не из answers
+    is_quick_check = Column(Boolean, default=False, nullable=False)
 
     answers = relationship("Answer", back_populates="session", cascade="all, delete-orphan")
     result = relationship("Result", back_populates="session", uselist=False, cascade="all, delete-orphan")
@@ -34,20 +87,182 @@ class Answer(Base):
     session_id = Column(Integer, ForeignKey("sessions.id"), nullable=False)
     user_id = Column(Integer, nullable=False)  # Telegram user ID
     user_role = Column(String, nullable=False)  # partner1 или partner2
-    answers = Column(JSON, nullable=False)  # список ответов
+    answers_packed = Column(BigInteger, nullable=False)  # ответы, упакованные services.answer_codec
     completed_at = Column(DateTime, default=func.now())
 
     session = relationship("Session", back_populates="answers")
 
+    @property
+    def answers(self) -> list:
+        """Список ответов (распакованный answers_packed)"""
+        return decode_answers(self.answers_packed)
+
+    @answers.setter
+    def answers(self, value: list):
+        self.answers_packed = encode_answers(value)
+
 
 class Result(Base):
     """Результаты анализа совместимости"""
     __tablename__ = "results"
+    __table_args__ = (
+        # Один результат на сессию — страховка на уровне БД от двойного анализа
+        Index("uq_results_session", "session_id", unique=True),
+        # Базовые отчёты, ожидающие перегенерации (services/regenerator.py)
+        Index(
+            "idx_results_provisional",
+            "created_at",
+            sqlite_where=text("is_provisional = 1"),
+            postgresql_where=text("is_provisional"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("sessions.id"), nullable=False)
     compatibility_score = Column(Integer, nullable=False)  # 0-100
-    report = Column(String, nullable=False)  # полный отчёт от AI
+    report_hash = Column(String(64), ForeignKey("report_blobs.hash"), nullable=False)  # полный отчёт от AI
+    answers1_packed = Column(BigInteger, nullable=True)  # ответы партнёров, по которым сделан анализ
+    answers2_packed = Column(BigInteger, nullable=True)
+    # Базовый отчёт (OpenAI был недоступен) — будет заменён полным
+    is_provisional = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime, default=func.now())
 
     session = relationship("Session", back_populates="result")
+    # Превью подгружается вместе с результатом, сжатый текст — только по запросу
+    report_blob = relationship("ReportBlob", lazy="joined")
+
+
+class ReportBlob(Base):
+    """Отчёт AI, сохранённый один раз по хэшу содержимого (services/report_store.py)"""
+    __tablename__ = "report_blobs"
+
+    hash = Column(String(64), primary_key=True)  # sha256 от текста отчёта
+    data = deferred(Column(LargeBinary, nullable=False))  # текст, сжатый zlib
+    preview = Column(String, nullable=False)  # первые FREE_REPORT_LIMIT символов
+    size = Column(Integer, nullable=False)  # длина полного отчёта в символах
+    created_at = Column(DateTime, default=func.now())
+
+
+class ReportCacheEntry(Base):
+    """Готовый отчёт для пары векторов ответов (services/report_cache.py)"""
+    __tablename__ = "report_cache"
+
+    prompt_version = Column(String(16), primary_key=True)  # analyzer.PROMPT_VERSION
+    answers_low = Column(BigInteger, primary_key=True, autoincrement=False)  # меньший из двух векторов
+    answers_high = Column(BigInteger, primary_key=True, autoincrement=False)
+    variant = Column(SmallInteger, primary_key=True, autoincrement=False)  # 0..REPORT_CACHE_VARIANTS-1
+    report_hash = Column(String(64), ForeignKey("report_blobs.hash"), nullable=False)
+    created_at = Column(DateTime, default=func.now())
+
+
+class UserProfile(Base):
+    """Последние ответы пользователя (для быстрой проверки без повторного теста)"""
+    __tablename__ = "user_profiles"
+
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)  # Telegram user ID
+    answers_packed = Column(BigInteger, nullable=False)  # ответы, упакованные services.answer_codec
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+
+class ArchivedSession(Base):
+    """Индекс архива: где в сегментах лежит завершённая сессия (services/archive.py)"""
+    __tablename__ = "archived_sessions"
+    __table_args__ = (
+        Index("idx_archived_partner1_created", "partner1_user_id", "created_at"),
+        Index("idx_archived_partner2_created", "partner2_user_id", "created_at"),
+    )
+
+    session_id = Column(Integer, primary_key=True, autoincrement=False)
+    partner1_user_id = Column(BigInteger, nullable=True)
+    partner2_user_id = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime, nullable=True)  # дата создания исходной сессии
+    segment = Column(String, nullable=False)  # имя файла сегмента
+    offset = Column(BigInteger, nullable=False)  # смещение записи в сегменте
+    length = Column(Integer, nullable=False)  # длина сжатой записи
+
+
+class FSMRecord(Base):
+    """Состояние и данные FSM одного пользователя (db/fsm_storage.py)"""
+    __tablename__ = "fsm_states"
+
+    key = Column(String, primary_key=True)  # StorageKey, собранный DefaultKeyBuilder
+    state = Column(String, nullable=True)
+    data = Column(String, nullable=True)  # JSON
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class DeliveryStatus(enum.IntEnum):
+    """Статус доставки сообщения кампании одному получателю"""
+    PENDING = 0  # получатель выбран, сообщение ещё не подтверждено
+    SENT = 1
+    FAILED = 2  # Telegram отказал окончательно (бот заблокирован и т.п.)
+
+
+class Subscription(Base):
+    """Подписка LoveBot+ и расписание еженедельных мини-тестов"""
+    __tablename__ = "subscriptions"
+    __table_args__ = (
+        # Планировщик выбирает активные подписки по next_due_at (services/campaigns.py)
+        Index(
+            "idx_subscriptions_due",
+            "next_due_at",
+            sqlite_where=text("is_active = 1"),
+            postgresql_where=text("is_active"),
+        ),
+    )
+
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)  # Telegram user ID
+    is_active = Column(Boolean, default=True, nullable=False)
+    started_at = Column(DateTime, default=func.now())
+    next_due_at = Column(DateTime, nullable=False)  # когда отправить следующий мини-тест
+    tests_sent = Column(Integer, default=0, nullable=False)  # сколько мини-тестов уже разослано
+
+
+class CampaignDelivery(Base):
+    """Чекпоинт рассылки: кампания × получатель (для продолжения после падения)"""
+    __tablename__ = "campaign_deliveries"
+    __table_args__ = (
+        # Поиск незавершённых доставок и очистка старых чекпоинтов
+        Index("idx_campaign_deliveries_status_updated", "status", "updated_at"),
+    )
+
+    campaign = Column(String(32), primary_key=True)  # например weekly-3
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    mini_test = Column(Integer, nullable=False)  # номер мини-теста
+    status = Column(SmallInteger, default=DeliveryStatus.PENDING, nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+
+class JobStatus(enum.IntEnum):
+    """Статус задачи анализа (выполненные задачи удаляются вместе с записью результата)"""
+    QUEUED = 0
+    RUNNING = 1
+    FAILED = 3  # попытки исчерпаны
+
+
+class AnalysisJob(Base):
+    """Задача AI-анализа сессии (очередь для services/analysis_jobs.py)"""
+    __tablename__ = "analysis_jobs"
+    __table_args__ = (
+        # Воркеры выбирают задачи без аренды или с истёкшей арендой
+        Index("idx_analysis_jobs_status_lease", "status", "lease_until"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=False, unique=True)
+    user1_id = Column(BigInteger, nullable=False)
+    answers1_packed = Column(BigInteger, nullable=False)
+    user2_id = Column(BigInteger, nullable=False)
+    answers2_packed = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=True)  # чат сообщения «Анализирую...»
+    message_id = Column(Integer, nullable=True)  # само сообщение (привязывается после отправки)
+    status = Column(SmallInteger, default=JobStatus.QUEUED, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    # Для queued — не раньше этого времени, для running — когда истекает аренда воркера
+    lease_until = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    # Контекст трассы обработчика, поставившего задачу (services.tracing.trace_parent)
+    trace_id = Column(String(32), nullable=True)
+    parent_span_id = Column(String(16), nullable=True)
+    trace_sampled = Column(Boolean, nullable=True)
+    created_at = Column(DateTime, default=func.now())
@@ -0,0 +1,79 @@
+"""
+Часто используемые запросы к базе данных
+"""
+
+from sqlalchemy import Insert, Select, false, literal_column, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Session as DBSession, SessionStatus
+
+
+def select_latest_user_session_ids(user_id: int, status: SessionStatus, skip_own_quick_checks: bool = False):
+    """
+    ID кандидатов в «самую свежую сессию пользователя в заданном статусе»
+
+    Условие «partner1 = X OR partner2 = X» разбито на две ветки UNION ALL,
+    каждая из которых читает свой частичный индекс и отдаёт не больше одной строки.
+    Статус подставляется литералом — иначе SQLite не сможет выбрать частичный индекс.
+
+    Args:
+        user_id: Telegram ID пользователя
+        status: статус сессии
+        skip_own_quick_checks: не учитывать быстрые проверки, созданные пользователем
+            (его ответы там берутся из профиля, проходить тест ему не нужно)
+
+    Returns:
+        ScalarSelect: подзапрос для DBSession.id.in_(...) — не больше двух ID
+    """
+    status_literal = literal_column(str(int(status)))
+
+    branches = []
+    for partner_column in (DBSession.partner1_user_id, DBSession.partner2_user_id):
+        conditions = [partner_column == user_id, DBSession.status == status_literal]
+        if skip_own_quick_checks and partner_column is DBSession.partner1_user_id:
+            conditions.append(DBSession.is_quick_check == false())
+        branches.append(
+            select(DBSession.id, DBSession.created_at)
+            .where(*conditions)
+            .order_by(DBSession.created_at.desc())
+            .limit(1)
+            .subquery()
+        )
+    return union_all(*(select(branch.c.id) for branch in branches)).scalar_subquery()
+
+
+def select_latest_user_session(user_id: int, status: SessionStatus, skip_own_quick_checks: bool = False) -> Select:
+    """
+    Запрос самой свежей сессии пользователя в заданном статусе
+
+    Args:
+        user_id: Telegram ID пользователя
+        status: статус сессии
+        skip_own_quick_checks: см. select_latest_user_session_ids
+
+    Returns:
+        Select: запрос, возвращающий DBSession или ничего
+    """
+    return (
+        select(DBSession)
+        .where(DBSession.id.in_(select_latest_user_session_ids(user_id, status, skip_own_quick_checks)))
+        .order_by(DBSession.created_at.desc())
+        .limit(1)
+    )
+
+
+def dialect_insert(session: AsyncSession, model) -> Insert:
+    """
+    INSERT с поддержкой ON CONFLICT для текущей СУБД
+
+    Args:
+        session: сессия БД
+        model: модель или таблица
+
+    Returns:
+        Insert: insert() диалекта PostgreSQL или SQLite
+    """
+    if session.bind.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
@@ -0,0 +1,208 @@
+"""
+Репозиторий: загрузка агрегатов для обработчиков за один запрос к БД
+"""
+
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, joinedload
+
+from .models import Session as DBSession, SessionStatus, Answer, Result, ReportBlob, UserProfile
+from .queries import dialect_insert, select_latest_user_session, select_latest_user_session_ids
+
+# Результат вместе с сессией и полным (сжатым) текстом отчёта — для PDF и премиум-отчёта
+_RESULT_WITH_FULL_REPORT = (
+    joinedload(Result.session),
+    joinedload(Result.report_blob).undefer(ReportBlob.data),
+)
+
+
+async def get_active_session_with_answer(
+    session: AsyncSession,
+    user_id: int
+) -> tuple[DBSession | None, Answer | None]:
+    """
+    Активная сессия пользователя и его ответы в ней (если уже есть)
+
+    Быстрые проверки, созданные самим пользователем, не учитываются: тест в них
+    проходит только второй партнёр.
+
+    Args:
+        session: сессия БД
+        user_id: Telegram ID пользователя
+
+    Returns:
+        tuple: (сессия или None, ответ пользователя в этой сессии или None)
+    """
+    result = await session.execute(
+        select_latest_user_session(user_id, SessionStatus.IN_PROGRESS, skip_own_quick_checks=True)
+        .add_columns(Answer)
+        .outerjoin(Answer, and_(Answer.session_id == DBSession.id, Answer.user_id == user_id))
+    )
+    row = result.first()
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+async def get_latest_completed_result(session: AsyncSession, user_id: int) -> Result | None:
+    """
+    Результат последней завершённой сессии пользователя
+
+    Загружается вместе с сессией и превью отчёта; сжатый текст не читается.
+
+    Args:
+        session: сессия БД
+        user_id: Telegram ID пользователя
+
+    Returns:
+        Result | None: результат (result.session заполнен) или None
+    """
+    result = await session.execute(
+        select(Result)
+        .join(Result.session)
+        .options(contains_eager(Result.session))
+        .where(DBSession.id.in_(select_latest_user_session_ids(user_id, SessionStatus.COMPLETED)))
+        .order_by(DBSession.created_at.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+async def get_result_with_session(session: AsyncSession, session_id: int) -> Result | None:
+    """
+    Результат сессии вместе с партнёрами и полным текстом отчёта
+
+    Args:
+        session: сессия БД
+        session_id: ID сессии
+
+    Returns:
+        Result | None: результат (result.session и result.report_blob.data заполнены) или None
+    """
+    result = await session.execute(
+        select(Result)
+        .options(*_RESULT_WITH_FULL_REPORT)
+        .where(Result.session_id == session_id)
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+async def claim_partner2_slot(
+    session: AsyncSession,
+    session_id: int,
+    user_id: int,
+    expected_status: SessionStatus,
+    partner1_user_id: int | None = None
+) -> int | None:
+    """
+    Атомарное присоединение второго партнёра к сессии
+
+    Один условный UPDATE ... RETURNING: место занимает только первый запрос,
+    остальные не находят строку с partner2_user_id IS NULL и получают None.
+    Коммит остаётся за вызывающим кодом.
+
+    Args:
+        session: сессия БД
+        session_id: ID сессии
+        user_id: Telegram ID присоединяющегося пользователя
+        expected_status: статус, в котором сессия должна находиться
+        partner1_user_id: если задан — сессия должна принадлежать этому пользователю
+
+    Returns:
+        int | None: Telegram ID первого партнёра, если место занято этим вызовом, иначе None
+    """
+    conditions = [
+        DBSession.id == session_id,
+        DBSession.partner2_user_id.is_(None),
+        DBSession.status == expected_status,
+    ]
+    if partner1_user_id is not None:
+        conditions.append(DBSession.partner1_user_id == partner1_user_id)
+
+    result = await session.execute(
+        update(DBSession)
+        .where(*conditions)
+        .values(partner2_user_id=user_id, status=SessionStatus.IN_PROGRESS)
+        .returning(DBSession.partner1_user_id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalar_one_or_none()
+
+
+async def claim_analysis(session: AsyncSession, session_id: int) -> bool:
+    """
+    Захват права запустить анализ сессии
+
+    Атомарный переход in_progress → analyzing: если оба партнёра завершили тест
+    одновременно, UPDATE затронет строку только у одного из них.
+    Коммит остаётся за вызывающим кодом.
+
+    Args:
+        session: сессия БД
+        session_id: ID сессии
+
+    Returns:
+        bool: True, если анализ должен запустить именно этот вызов
+    """
+    result = await session.execute(
+        update(DBSession)
+        .where(DBSession.id == session_id, DBSession.status == SessionStatus.IN_PROGRESS)
+        .values(status=SessionStatus.ANALYZING)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+async def add_answer(
+    session: AsyncSession,
+    session_id: int,
+    user_id: int,
+    user_role: str,
+    answers_packed: int
+) -> bool:
+    """
+    Запись ответов пользователя в сессии, если их там ещё нет
+
+    INSERT ... ON CONFLICT DO NOTHING по uq_session_user: повторное нажатие
+    последней кнопки теста не падает с IntegrityError.
+    Коммит остаётся за вызывающим кодом.
+
+    Args:
+        session: сессия БД
+        session_id: ID сессии
+        user_id: Telegram ID пользователя
+        user_role: partner1 или partner2
+        answers_packed: упакованные ответы
+
+    Returns:
+        bool: True, если ответы записаны этим вызовом
+    """
+    result = await session.execute(
+        dialect_insert(session, Answer)
+        .values(session_id=session_id, user_id=user_id, user_role=user_role, answers_packed=answers_packed)
+        .on_conflict_do_nothing(index_elements=["session_id", "user_id"])
+        .returning(Answer.id)
+    )
+    return result.scalar_one_or_none() is not None
+
+
+async def upsert_user_profile(session: AsyncSession, user_id: int, answers_packed: int):
+    """
+    Запись последних ответов пользователя в user_profiles
+
+    Args:
+        session: сессия БД (коммит остаётся за вызывающим кодом)
+        user_id: Telegram ID пользователя
+        answers_packed: упакованные ответы
+    """
+    insert_stmt = dialect_insert(session, UserProfile).values(
+        user_id=user_id,
+        answers_packed=answers_packed,
+    )
+    await session.execute(
+        insert_stmt.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={"answers_packed": insert_stmt.excluded.answers_packed, "updated_at": func.now()},
+        )
+    )
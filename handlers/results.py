@@ -10,8 +10,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 import os
 
 from db.database import async_session_maker
-from db.models import Session as DBSession, Result
+from db.repository import get_latest_completed_result, get_result_with_session
+from services.archive import load_archived_result
+from services.campaigns import MINI_TEST_CALLBACK_PREFIX, get_mini_test, subscribe
+from services.logging_setup import bind_log_context
 from services.pdf_generator import generate_pdf_report
+from services.report_store import decompress_report
 from config import ADMIN_IDS
 
 router = Router()
@@ -21,44 +25,35 @@ router = Router()
 async def show_results(message: types.Message):
     """Показать результаты последней сессии"""
     async with async_session_maker() as session:
-        # Находим завершённую сессию пользователя (самую свежую)
-        result = await session.execute(
-            select(DBSession).where(
-                and_(
-                    (DBSession.partner1_user_id == message.from_user.id) |
-                    (DBSession.partner2_user_id == message.from_user.id),
-                    DBSession.status == "completed"
-                )
-            ).order_by(DBSession.created_at.desc()).limit(1)
-        )
-        db_session = result.scalar_one_or_none()
-
-        if not db_session:
-            await message.answer(
-                "❌ У тебя нет завершённых сессий.\n\n"
-                "Пройди тест командой /test"
-            )
-            return
+        # Находим результат завершённой сессии пользователя (самой свежей)
+        test_result = await get_latest_completed_result(session, message.from_user.id)
 
-        # Получаем результаты
-        result = await session.execute(
-            select(Result).where(Result.session_id == db_session.id)
-        )
-        test_result = result.scalar_one_or_none()
+        from config import FREE_REPORT_LIMIT
+        if test_result:
+            # Показываем бесплатную версию (превью сохранено вместе с отчётом)
+            score = test_result.compatibility_score
+            free_report = test_result.report_blob.preview
+            has_full_report = test_result.report_blob.size > FREE_REPORT_LIMIT
+        else:
+            # Старые сессии переносятся в архив — ищем там
+            archived_result = await load_archived_result(session, message.from_user.id)
+            if not archived_result:
+                await message.answer(
+                    "❌ У тебя нет завершённых сессий.\n\n"
+                    "Пройди тест командой /test"
+                )
+                return
 
-        if not test_result:
-            await message.answer("❌ Результаты не найдены.")
-            return
+            score = archived_result["compatibility_score"]
+            free_report = archived_result["report"][:FREE_REPORT_LIMIT]
+            has_full_report = len(archived_result["report"]) > FREE_REPORT_LIMIT
 
-        # Показываем бесплатную версию
-        from config import FREE_REPORT_LIMIT
-        free_report = test_result.report[:FREE_REPORT_LIMIT]
-        if len(test_result.report) > FREE_REPORT_LIMIT:
+        if has_full_report:
             free_report += "\n\n...\n\n💎 **Полный отчёт доступен в платной версии**"
 
         await message.answer(
             f"📊 **Твои результаты**\n\n"
-            f"💕 **Индекс совместимости: {test_result.compatibility_score}%**\n\n"
+            f"💕 **Индекс совместимости: {score}%**\n\n"
             f"{free_report}\n\n"
             f"Для получения полного отчёта используйте /premium",
             parse_mode="Markdown"
@@ -102,27 +97,22 @@ async def show_premium_offer(callback: types.CallbackQuery):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("buy_"))
+@router.callback_query(F.data.regexp(r"^buy_\d+$"))
 async def process_payment(callback: types.CallbackQuery):
     """Обработка покупки (здесь должна быть интеграция с платёжной системой)"""
     session_id = int(callback.data.split("_")[1])
+    bind_log_context(session_id=session_id)
 
     async with async_session_maker() as session:
-        # Получаем результаты и информацию о сессии
-        result = await session.execute(
-            select(Result).where(Result.session_id == session_id).limit(1)
-        )
-        test_result = result.scalar_one_or_none()
+        # Получаем результаты, информацию о партнёрах и полный отчёт одним запросом
+        test_result = await get_result_with_session(session, session_id)
 
         if not test_result:
             await callback.answer("❌ Результаты не найдены.", show_alert=True)
             return
 
-        # Получаем информацию о партнёрах
-        db_session_result = await session.execute(
-            select(DBSession).where(DBSession.id == session_id).limit(1)
-        )
-        db_session = db_session_result.scalar_one_or_none()
+        db_session = test_result.session
+        report = decompress_report(test_result.report_blob.data)
 
         # В реальности здесь должна быть оплата через Telegram Payments или YooKassa
         # Пока показываем полный отчёт сразу
@@ -156,7 +146,7 @@ async def process_payment(callback: types.CallbackQuery):
 
             pdf_path = generate_pdf_report(
                 compatibility_score=test_result.compatibility_score,
-                report=test_result.report,
+                report=report,
                 partner1_name=partner1_name,
                 partner2_name=partner2_name
             )
@@ -200,7 +190,7 @@ async def process_payment(callback: types.CallbackQuery):
                 parse_mode="Markdown"
             )
             # Отчёт может быть длинным, разбиваем его
-            report_parts = [test_result.report[i:i+4000] for i in range(0, len(test_result.report), 4000)]
+            report_parts = [report[i:i+4000] for i in range(0, len(report), 4000)]
             for part in report_parts:
                 await callback.message.answer(part, parse_mode="Markdown")
 
@@ -218,21 +208,15 @@ async def test_pdf_generation(callback: types.CallbackQuery):
     session_id = int(callback.data.split("_")[2])
 
     async with async_session_maker() as session:
-        # Получаем результаты и информацию о сессии
-        result = await session.execute(
-            select(Result).where(Result.session_id == session_id).limit(1)
-        )
-        test_result = result.scalar_one_or_none()
+        # Получаем результаты, информацию о партнёрах и полный отчёт одним запросом
+        test_result = await get_result_with_session(session, session_id)
 
         if not test_result:
             await callback.answer("❌ Результаты не найдены.", show_alert=True)
             return
 
-        # Получаем информацию о партнёрах
-        db_session_result = await session.execute(
-            select(DBSession).where(DBSession.id == session_id).limit(1)
-        )
-        db_session = db_session_result.scalar_one_or_none()
+        db_session = test_result.session
+        report = decompress_report(test_result.report_blob.data)
 
         # Уведомление о генерации PDF
         await callback.message.edit_text(
@@ -263,7 +247,7 @@ async def test_pdf_generation(callback: types.CallbackQuery):
 
             pdf_path = generate_pdf_report(
                 compatibility_score=test_result.compatibility_score,
-                report=test_result.report,
+                report=report,
                 partner1_name=partner1_name,
                 partner2_name=partner2_name
             )
@@ -337,6 +321,10 @@ async def show_subscription(callback: types.CallbackQuery):
 async def buy_subscription(callback: types.CallbackQuery):
     """Покупка подписки"""
     # В реальности здесь должна быть интеграция с платёжной системой
+    async with async_session_maker() as session:
+        await subscribe(session, callback.from_user.id)
+        await session.commit()
+
     await callback.message.edit_text(
         "✅ **Подписка активирована!**\n\n"
         "Спасибо! Теперь ты получаешь полный доступ к LoveBot+\n\n"
@@ -346,6 +334,23 @@ async def buy_subscription(callback: types.CallbackQuery):
     await callback.answer("✅ Подписка оформлена!", show_alert=True)
 
 
+@router.callback_query(F.data.startswith(MINI_TEST_CALLBACK_PREFIX))
+async def answer_mini_test(callback: types.CallbackQuery):
+    """Ответ на еженедельный мини-тест: совет по выбранному варианту"""
+    number, option = map(int, callback.data[len(MINI_TEST_CALLBACK_PREFIX):].split("_"))
+    mini_test = get_mini_test(number)
+    option_text, tip = mini_test["options"][option]
+
+    await callback.message.edit_text(
+        f"📅 **Мини-тест #{number}**\n\n"
+        f"{mini_test['question']}\n"
+        f"Твой ответ: {option_text}\n\n"
+        f"💡 {tip}",
+        parse_mode="Markdown"
+    )
+    await callback.answer()
+
+
 @router.callback_query(F.data == "cancel_subscription")
 async def cancel_subscription(callback: types.CallbackQuery):
     """Отказ от подписки"""
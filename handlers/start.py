@@ -9,7 +9,10 @@ from sqlalchemy import select, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.database import async_session_maker
-from db.models import Session as DBSession, Answer
+from db.models import Session as DBSession, SessionStatus, UserProfile
+from db.repository import claim_partner2_slot
+from services.logging_setup import bind_log_context
+from services.sender import sender
 from services.utils import generate_join_link
 
 router = Router()
@@ -53,7 +56,7 @@ async def create_session_callback(callback: types.CallbackQuery):
         # Создаём новую сессию
         new_session = DBSession(
             partner1_user_id=callback.from_user.id,
-            status="pending"
+            status=SessionStatus.PENDING
         )
         session.add(new_session)
         await session.commit()
@@ -92,66 +95,57 @@ async def join_session_deep_link(message: types.Message, args: str):
         parts = args.split("_")
         session_id = int(parts[1])
         role = parts[2]
+        bind_log_context(session_id=session_id)
+
+        if role != "partner2":
+            await message.answer("❌ Неверная роль в ссылке.")
+            return
 
         async with async_session_maker() as session:
-            # Находим сессию
-            result = await session.execute(
-                select(DBSession).where(DBSession.id == session_id)
+            # Занимаем место второго партнёра одним условным UPDATE (защита от race condition)
+            partner1_user_id = await claim_partner2_slot(
+                session, session_id, message.from_user.id, SessionStatus.PENDING
             )
-            db_session = result.scalar_one_or_none()
-
-            if not db_session:
-                await message.answer("❌ Сессия не найдена. Проверьте правильность ссылки.")
-                return
-
-            if db_session.status != "pending":
-                await message.answer("❌ Эта сессия уже началась или завершена.")
-                return
+            await session.commit()
 
-            # Проверяем, что второй партнёр ещё не присоединился (защита от race condition)
-            if db_session.partner2_user_id is not None:
-                await message.answer("❌ К этой сессии уже присоединился другой пользователь.")
+            if partner1_user_id is None:
+                # Место не досталось — выясняем причину, чтобы показать понятную ошибку
+                db_session = await session.get(DBSession, session_id)
+                if not db_session:
+                    await message.answer("❌ Сессия не найдена. Проверьте правильность ссылки.")
+                elif db_session.partner2_user_id is not None:
+                    await message.answer("❌ К этой сессии уже присоединился другой пользователь.")
+                else:
+                    await message.answer("❌ Эта сессия уже началась или завершена.")
                 return
 
-            # Обновляем сессию
-            if role == "partner2":
-                db_session.partner2_user_id = message.from_user.id
-                db_session.status = "in_progress"
-                await session.commit()
-
-                # Кнопка для старта теста
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="🎯 Начать тест", callback_data="start_test")]
-                ])
+        # Кнопка для старта теста
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🎯 Начать тест", callback_data="start_test")]
+        ])
 
-                # Уведомляем второго партнёра
-                await message.answer(
-                    "✅ **Ты успешно присоединился к сессии!**\n\n"
-                    "Теперь вы оба можете пройти тест.\n"
-                    "Нажми кнопку ниже, чтобы начать 👇",
-                    parse_mode="Markdown",
-                    reply_markup=keyboard
-                )
+        # Уведомляем второго партнёра
+        await message.answer(
+            "✅ **Ты успешно присоединился к сессии!**\n\n"
+            "Теперь вы оба можете пройти тест.\n"
+            "Нажми кнопку ниже, чтобы начать 👇",
+            parse_mode="Markdown",
+            reply_markup=keyboard
+        )
 
-                # Уведомляем первого партнёра
-                if db_session.partner1_user_id:
-                    try:
-                        keyboard_p1 = InlineKeyboardMarkup(inline_keyboard=[
-                            [InlineKeyboardButton(text="🎯 Начать тест", callback_data="start_test")]
-                        ])
-                        await message.bot.send_message(
-                            db_session.partner1_user_id,
-                            "✅ **Твой партнёр присоединился!**\n\n"
-                            "Теперь вы оба можете пройти тест.\n"
-                            "Нажми кнопку ниже, чтобы начать 👇",
-                            parse_mode="Markdown",
-                            reply_markup=keyboard_p1
-                        )
-                    except Exception:
-                        pass
-
-            else:
-                await message.answer("❌ Неверная роль в ссылке.")
+        # Уведомляем первого партнёра (через очередь отправки, не дожидаясь доставки)
+        keyboard_p1 = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🎯 Начать тест", callback_data="start_test")]
+        ])
+        sender.send_message(
+            message.bot,
+            partner1_user_id,
+            "✅ **Твой партнёр присоединился!**\n\n"
+            "Теперь вы оба можете пройти тест.\n"
+            "Нажми кнопку ниже, чтобы начать 👇",
+            parse_mode="Markdown",
+            reply_markup=keyboard_p1
+        )
 
     except (IndexError, ValueError):
         await message.answer("❌ Неверный формат ссылки для присоединения.")
@@ -162,14 +156,9 @@ async def quick_check_command(message: types.Message):
     """Быстрая проверка совместимости для тех, кто уже проходил тест"""
     async with async_session_maker() as session:
         # Проверяем, есть ли у пользователя хотя бы один пройденный тест
-        result = await session.execute(
-            select(Answer).where(Answer.user_id == message.from_user.id)
-            .order_by(Answer.completed_at.desc())
-            .limit(1)
-        )
-        last_answer = result.scalar_one_or_none()
+        profile = await session.get(UserProfile, message.from_user.id)
 
-        if not last_answer:
+        if not profile:
             await message.answer(
                 "❌ **У тебя нет пройденных тестов**\n\n"
                 "Сначала пройди тест командой /start, а потом сможешь быстро проверять совместимость с новыми людьми!",
@@ -180,7 +169,8 @@ async def quick_check_command(message: types.Message):
         # Создаём новую сессию для быстрой проверки
         new_session = DBSession(
             partner1_user_id=message.from_user.id,
-            status="quick_check"  # специальный статус
+            status=SessionStatus.QUICK_CHECK,  # специальный статус
+            is_quick_check=True
         )
         session.add(new_session)
         await session.commit()
@@ -218,6 +208,7 @@ async def quick_check_deep_link(message: types.Message, args: str):
         parts = args.split("_")
         session_id = int(parts[1])
         original_user_id = int(parts[2])
+        bind_log_context(session_id=session_id)
 
         # Проверяем, что это не тот же пользователь
         if message.from_user.id == original_user_id:
@@ -230,14 +221,9 @@ async def quick_check_deep_link(message: types.Message, args: str):
 
         async with async_session_maker() as session:
             # Проверяем, есть ли у оригинального пользователя ответы
-            result = await session.execute(
-                select(Answer).where(Answer.user_id == original_user_id)
-                .order_by(Answer.completed_at.desc())
-                .limit(1)
-            )
-            original_answer = result.scalar_one_or_none()
+            original_profile = await session.get(UserProfile, original_user_id)
 
-            if not original_answer:
+            if not original_profile:
                 await message.answer(
                     "❌ У создателя ссылки нет пройденных тестов.\n"
                     "Попросите его сначала пройти тест!",
@@ -245,21 +231,21 @@ async def quick_check_deep_link(message: types.Message, args: str):
                 )
                 return
 
-            # Находим сессию
-            result = await session.execute(
-                select(DBSession).where(DBSession.id == session_id)
+            # Добавляем второго партнёра одним условным UPDATE — ссылка срабатывает один раз
+            partner1_user_id = await claim_partner2_slot(
+                session, session_id, message.from_user.id, SessionStatus.QUICK_CHECK,
+                partner1_user_id=original_user_id
             )
-            db_session = result.scalar_one_or_none()
+            await session.commit()
 
-            if not db_session:
-                await message.answer("❌ Сессия не найдена. Проверьте правильность ссылки.")
+            if partner1_user_id is None:
+                db_session = await session.get(DBSession, session_id)
+                if not db_session or db_session.partner1_user_id != original_user_id:
+                    await message.answer("❌ Сессия не найдена. Проверьте правильность ссылки.")
+                else:
+                    await message.answer("❌ Эта ссылка уже использована другим пользователем.")
                 return
 
-            # Обновляем сессию - добавляем второго партнёра
-            db_session.partner2_user_id = message.from_user.id
-            db_session.status = "in_progress"
-            await session.commit()
-
             # Кнопка для старта теста
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="🎯 Пройти тест", callback_data="start_test")]
@@ -11,14 +11,21 @@ from sqlalchemy import select, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.database import async_session_maker
-from db.models import Session as DBSession, Answer
-from services.analyzer import analyze
+from db.models import Session as DBSession, SessionStatus, Answer, UserProfile
+from db.repository import get_active_session_with_answer, add_answer, claim_analysis, upsert_user_profile
+from services.analysis_jobs import enqueue_analysis, attach_placeholder
+from services.answer_codec import ANSWER_CHOICES, encode_answers, decode_answers
+from services.quiz_callback import CALLBACK_PREFIX, encode_quiz_callback, decode_quiz_callback
+from services.logging_setup import bind_log_context
+from services.tracing import traced
 from services.utils import generate_join_link
-from config import FREE_REPORT_LIMIT
+from config import STATELESS_QUIZ
 
 router = Router()
 
-# Вопросы теста
+ALREADY_ANSWERED_TEXT = "✅ Ты уже прошёл этот тест. Ожидай результаты!"
+
+# Вопросы теста (их число продублировано в services.answer_codec.QUESTION_COUNT)
 QUESTIONS = [
     "1️⃣ Что для тебя важнее в отношениях?\n\nA) Проводить много времени вместе ⏰\nB) Получать подарки и сюрпризы 🎁\nC) Слышать слова любви и комплименты 💬\nD) Помощь и поддержка в делах 🤝\nE) Физическая близость и прикосновения 🤗",
 
@@ -37,6 +44,35 @@ class TestStates(StatesGroup):
     waiting_for_answer = State()
 
 
+def build_answer_keyboard(
+    session_id: int = None,
+    user_id: int = None,
+    answers: list = None,
+    question: int = 0
+) -> InlineKeyboardMarkup:
+    """
+    Кнопки вариантов ответа A–E
+
+    Args:
+        session_id: ID сессии (только для stateless-режима)
+        user_id: Telegram ID пользователя (только для stateless-режима)
+        answers: ответы на предыдущие вопросы (только для stateless-режима)
+        question: номер вопроса (только для режима FSM)
+
+    Returns:
+        InlineKeyboardMarkup: кнопки с answer_<вопрос>_X или с подписанным прогрессом теста
+    """
+    rows = []
+    for choice in ANSWER_CHOICES:
+        if session_id is None:
+            # Номер вопроса делает кнопки разных вопросов различимыми (в т.ч. для антифлуда)
+            callback_data = f"answer_{question}_{choice}"
+        else:
+            callback_data = encode_quiz_callback(session_id, encode_answers(answers + [choice]), user_id)
+        rows.append([InlineKeyboardButton(text=choice, callback_data=callback_data)])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
 @router.callback_query(F.data == "start_test")
 async def start_test_callback(callback: types.CallbackQuery, state: FSMContext):
     """Начало теста через callback (кнопка)"""
@@ -53,17 +89,8 @@ async def start_test_command(message: types.Message, state: FSMContext):
 async def start_test_logic(message: types.Message, user_id: int, state: FSMContext):
     """Общая логика начала теста"""
     async with async_session_maker() as session:
-        # Находим активную сессию пользователя (самую свежую)
-        result = await session.execute(
-            select(DBSession).where(
-                and_(
-                    (DBSession.partner1_user_id == user_id) |
-                    (DBSession.partner2_user_id == user_id),
-                    DBSession.status == "in_progress"
-                )
-            ).order_by(DBSession.created_at.desc()).limit(1)
-        )
-        db_session = result.scalar_one_or_none()
+        # Находим активную сессию пользователя (самую свежую) и его ответы в ней
+        db_session, existing_answer = await get_active_session_with_answer(session, user_id)
 
         if not db_session:
             await message.answer(
@@ -73,41 +100,29 @@ async def start_test_logic(message: types.Message, user_id: int, state: FSMConte
             return
 
         # Проверяем, не прошёл ли уже пользователь тест
-        result = await session.execute(
-            select(Answer).where(
-                and_(
-                    Answer.session_id == db_session.id,
-                    Answer.user_id == user_id
-                )
-            )
-        )
-        existing_answer = result.scalar_one_or_none()
-
         if existing_answer:
-            await message.answer("✅ Ты уже прошёл этот тест. Ожидай результаты!")
+            await message.answer(ALREADY_ANSWERED_TEXT)
             return
 
-        # Определяем роль пользователя
-        role = "partner1" if db_session.partner1_user_id == user_id else "partner2"
-
-        # Сохраняем данные в FSM
-        await state.update_data(
-            session_id=db_session.id,
-            role=role,
-            current_question=0,
-            answers=[]
-        )
+        if STATELESS_QUIZ:
+            # Прогресс едет в callback_data кнопок — FSM не трогаем до завершения теста
+            keyboard = build_answer_keyboard(db_session.id, user_id, [])
+        else:
+            # Определяем роль пользователя
+            role = "partner1" if db_session.partner1_user_id == user_id else "partner2"
+
+            # Сохраняем данные в FSM
+            await state.update_data(
+                session_id=db_session.id,
+                role=role,
+                current_question=0,
+                answers=[]
+            )
 
-        await state.set_state(TestStates.waiting_for_answer)
+            await state.set_state(TestStates.waiting_for_answer)
 
-        # Создаём inline кнопки для ответов
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="A", callback_data="answer_A")],
-            [InlineKeyboardButton(text="B", callback_data="answer_B")],
-            [InlineKeyboardButton(text="C", callback_data="answer_C")],
-            [InlineKeyboardButton(text="D", callback_data="answer_D")],
-            [InlineKeyboardButton(text="E", callback_data="answer_E")]
-        ])
+            # Создаём inline кнопки для ответов
+            keyboard = build_answer_keyboard()
 
         await message.answer(
             "🎯 **Тест на совместимость**\n\n"
@@ -121,12 +136,19 @@ async def start_test_logic(message: types.Message, user_id: int, state: FSMConte
 @router.callback_query(F.data.startswith("answer_"), TestStates.waiting_for_answer)
 async def process_answer_callback(callback: types.CallbackQuery, state: FSMContext):
     """Обработка ответа через callback"""
-    answer = callback.data.split("_")[1]  # Получаем A, B, C, D или E
+    parts = callback.data.split("_")
+    answer = parts[-1]  # Получаем A, B, C, D или E
 
     data = await state.get_data()
     current_question = data["current_question"]
     answers = data["answers"]
 
+    # Кнопка другого вопроса (повторное нажатие или старое сообщение) — не засчитываем.
+    # Кнопки без номера (answer_X) остались в сообщениях, отправленных до обновления бота
+    if len(parts) == 3 and parts[1] != str(current_question):
+        await callback.answer("Этот вопрос уже пройден 👇")
+        return
+
     # Сохраняем ответ
     answers.append(answer)
     current_question += 1
@@ -139,13 +161,7 @@ async def process_answer_callback(callback: types.CallbackQuery, state: FSMConte
         )
 
         # Создаём кнопки для следующего вопроса
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="A", callback_data="answer_A")],
-            [InlineKeyboardButton(text="B", callback_data="answer_B")],
-            [InlineKeyboardButton(text="C", callback_data="answer_C")],
-            [InlineKeyboardButton(text="D", callback_data="answer_D")],
-            [InlineKeyboardButton(text="E", callback_data="answer_E")]
-        ])
+        keyboard = build_answer_keyboard(question=current_question)
 
         try:
             await callback.message.edit_text(
@@ -170,6 +186,43 @@ async def process_answer_callback(callback: types.CallbackQuery, state: FSMConte
     await callback.answer()
 
 
+@router.callback_query(F.data.startswith(CALLBACK_PREFIX))
+async def process_stateless_answer_callback(callback: types.CallbackQuery, state: FSMContext):
+    """Обработка ответа в stateless-режиме (прогресс в callback_data, без обращений к FSM)"""
+    decoded = decode_quiz_callback(callback.data, callback.from_user.id)
+    if decoded is None:
+        await callback.answer("❌ Кнопка устарела. Начни тест заново: /test", show_alert=True)
+        return
+
+    session_id, answers_packed = decoded
+    answers = decode_answers(answers_packed)
+
+    # Проверяем, есть ли ещё вопросы
+    if len(answers) < len(QUESTIONS):
+        keyboard = build_answer_keyboard(session_id, callback.from_user.id, answers)
+        try:
+            await callback.message.edit_text(
+                QUESTIONS[len(answers)],
+                parse_mode="Markdown",
+                reply_markup=keyboard
+            )
+        except:
+            await callback.message.answer(
+                QUESTIONS[len(answers)],
+                parse_mode="Markdown",
+                reply_markup=keyboard
+            )
+        await callback.answer()
+        return
+
+    # Тест завершён
+    await callback.answer()
+    await callback.message.answer("✅ Спасибо! Обрабатываю твои ответы...")
+    await finish_test(
+        callback.message, state, answers, user_id=callback.from_user.id, session_id=session_id
+    )
+
+
 @router.message(TestStates.waiting_for_answer)
 async def process_answer_text(message: types.Message, state: FSMContext):
     """Обработка текстового ответа (на случай если пользователь пишет вручную)"""
@@ -194,13 +247,7 @@ async def process_answer_text(message: types.Message, state: FSMContext):
             answers=answers
         )
 
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="A", callback_data="answer_A")],
-            [InlineKeyboardButton(text="B", callback_data="answer_B")],
-            [InlineKeyboardButton(text="C", callback_data="answer_C")],
-            [InlineKeyboardButton(text="D", callback_data="answer_D")],
-            [InlineKeyboardButton(text="E", callback_data="answer_E")]
-        ])
+        keyboard = build_answer_keyboard(question=current_question)
 
         await message.answer(QUESTIONS[current_question], reply_markup=keyboard)
     else:
@@ -208,11 +255,20 @@ async def process_answer_text(message: types.Message, state: FSMContext):
         await finish_test(message, state, answers)
 
 
-async def finish_test(message: types.Message, state: FSMContext, answers: list, user_id: int = None):
+@traced("quiz.finish_test")
+async def finish_test(
+    message: types.Message,
+    state: FSMContext,
+    answers: list,
+    user_id: int = None,
+    session_id: int = None
+):
     """Завершение теста и сохранение результатов"""
-    data = await state.get_data()
-    session_id = data["session_id"]
-    role = data["role"]
+    # В stateless-режиме ID сессии приходит из callback_data, иначе — из FSM
+    if session_id is None:
+        data = await state.get_data()
+        session_id = data["session_id"]
+    bind_log_context(session_id=session_id)
 
     # Используем переданный user_id или берём из message
     if user_id is None:
@@ -220,63 +276,64 @@ async def finish_test(message: types.Message, state: FSMContext, answers: list,
 
     async with async_session_maker() as session:
         # Получаем информацию о сессии
-        session_result = await session.execute(
-            select(DBSession).where(DBSession.id == session_id)
-        )
-        db_session = session_result.scalar_one_or_none()
+        db_session = await session.get(DBSession, session_id)
 
-        # Проверяем, это быстрая проверка или обычный тест
-        is_quick_check = db_session.status in ["quick_check", "in_progress"] and db_session.partner1_user_id != user_id
+        # Повторное нажатие последней кнопки или кнопка из старого сообщения теста
+        if db_session is None:
+            await message.answer("❌ Сессия не найдена. Создай новую командой /start")
+            await state.clear()
+            return
+        if db_session.status != SessionStatus.IN_PROGRESS:
+            await message.answer(ALREADY_ANSWERED_TEXT)
+            await state.clear()
+            return
 
-        if is_quick_check:
-            # Это быстрая проверка - используем старые ответы первого партнёра
-            # Получаем последние ответы первого партнёра
-            result = await session.execute(
-                select(Answer).where(Answer.user_id == db_session.partner1_user_id)
-                .order_by(Answer.completed_at.desc())
-                .limit(1)
-            )
-            partner1_old_answer = result.scalar_one_or_none()
-
-            if partner1_old_answer:
-                # Создаём виртуальный Answer для текущей сессии с ответами первого партнёра
-                answer_partner1 = Answer(
-                    session_id=session_id,
-                    user_id=db_session.partner1_user_id,
-                    user_role="partner1",
-                    answers=partner1_old_answer.answers
-                )
-                session.add(answer_partner1)
+        role = "partner1" if db_session.partner1_user_id == user_id else "partner2"
+        answers_packed = encode_answers(answers)
+
+        if db_session.is_quick_check and user_id == db_session.partner2_user_id:
+            # Это быстрая проверка - ответы первого партнёра берём из его профиля
+            partner1_profile = await session.get(UserProfile, db_session.partner1_user_id)
 
+            if partner1_profile:
                 # Сохраняем ответы второго партнёра (текущего пользователя)
-                new_answer = Answer(
-                    session_id=session_id,
-                    user_id=user_id,
-                    user_role="partner2",
-                    answers=answers
-                )
-                session.add(new_answer)
+                if not await add_answer(session, session_id, user_id, "partner2", answers_packed):
+                    await message.answer(ALREADY_ANSWERED_TEXT)
+                    await state.clear()
+                    return
+                await upsert_user_profile(session, user_id, answers_packed)
+                claimed = await claim_analysis(session, session_id)
+                if claimed:
+                    await enqueue_analysis(
+                        session, session_id,
+                        db_session.partner1_user_id, partner1_profile.answers_packed,
+                        user_id, answers_packed,
+                        chat_id=message.chat.id
+                    )
                 await session.commit()
 
-                await message.answer(
+                if not claimed:
+                    # Анализ этой сессии уже запущен другим обработчиком
+                    await message.answer("✅ Твои ответы записаны. Результаты уже готовятся!")
+                    await state.clear()
+                    return
+
+                placeholder = await message.answer(
                     "✅ **Спасибо! Твои ответы записаны.**\n\n"
                     "🔄 Анализирую вашу совместимость...",
                     parse_mode="Markdown"
                 )
-
-                # Сразу запускаем анализ для быстрой проверки
-                await run_analysis(message, session_id, [answer_partner1, new_answer])
+                # Анализ выполнит воркер очереди — в этом сообщении он покажет результат
+                await attach_placeholder(session_id, placeholder.message_id)
             else:
                 await message.answer("❌ Ошибка: не найдены ответы первого партнёра.")
         else:
             # Обычный тест - сохраняем ответы и ждём второго партнёра
-            new_answer = Answer(
-                session_id=session_id,
-                user_id=user_id,
-                user_role=role,
-                answers=answers
-            )
-            session.add(new_answer)
+            if not await add_answer(session, session_id, user_id, role, answers_packed):
+                await message.answer(ALREADY_ANSWERED_TEXT)
+                await state.clear()
+                return
+            await upsert_user_profile(session, user_id, answers_packed)
             await session.commit()
 
             await message.answer(
@@ -288,86 +345,20 @@ async def finish_test(message: types.Message, state: FSMContext, answers: list,
             # Проверяем, прошли ли оба партнёра тест
             result = await session.execute(
                 select(Answer).where(Answer.session_id == session_id)
+                .order_by(Answer.user_role)
             )
             all_answers = result.scalars().all()
 
-            if len(all_answers) == 2:
-                # Оба прошли тест, запускаем анализ
-                await message.answer("🔄 Оба партнёра прошли тест! Анализирую результаты...")
-                await run_analysis(message, session_id, all_answers)
+            # Оба прошли тест — анализ запускает только тот, кто первым захватил сессию
+            if len(all_answers) == 2 and await claim_analysis(session, session_id):
+                await enqueue_analysis(
+                    session, session_id,
+                    all_answers[0].user_id, all_answers[0].answers_packed,
+                    all_answers[1].user_id, all_answers[1].answers_packed,
+                    chat_id=message.chat.id
+                )
+                await session.commit()
+                placeholder = await message.answer("🔄 Оба партнёра прошли тест! Анализирую результаты...")
+                await attach_placeholder(session_id, placeholder.message_id)
 
     await state.clear()
-
-
-async def run_analysis(message: types.Message, session_id: int, all_answers: list):
-    """Запуск AI-анализа и отправка результатов"""
-    from db.models import Result
-
-    # Получаем ответы партнёров
-    answers1 = all_answers[0].answers
-    answers2 = all_answers[1].answers
-    user1_id = all_answers[0].user_id
-    user2_id = all_answers[1].user_id
-
-    # Запускаем AI-анализ
-    score, report = await analyze(answers1, answers2)
-
-    async with async_session_maker() as session:
-        # Сохраняем результат в БД
-        result = Result(
-            session_id=session_id,
-            compatibility_score=score,
-            report=report
-        )
-        session.add(result)
-
-        # Обновляем статус сессии
-        db_session_result = await session.execute(
-            select(DBSession).where(DBSession.id == session_id)
-        )
-        db_session = db_session_result.scalar_one()
-        db_session.status = "completed"
-
-        await session.commit()
-
-        # Формируем бесплатный отчёт (ограниченная версия)
-        free_report = report[:FREE_REPORT_LIMIT]
-        has_full_report = len(report) > FREE_REPORT_LIMIT
-
-        if has_full_report:
-            free_report += "\n\n...\n\n💎 **Полный отчёт доступен в премиум-версии**"
-
-        result_message = (
-            f"✨ **Ваш результат готов!** ✨\n\n"
-            f"💕 **Совместимость: {score}%**\n\n"
-            f"{free_report}"
-        )
-
-        # Кнопки для upsell
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📖 Хочу полный отчёт", callback_data=f"premium_{session_id}")],
-            [InlineKeyboardButton(text="📤 Поделиться результатом",
-                                switch_inline_query=f"Мы прошли тест на совместимость! Наш результат: {score}%")]
-        ])
-
-        # Отправляем результаты обоим партнёрам
-        sent_to = []
-
-        # Отправка первому партнёру
-        try:
-            await message.bot.send_message(user1_id, result_message, parse_mode="Markdown", reply_markup=keyboard)
-            sent_to.append(user1_id)
-        except Exception as e:
-            print(f"Не удалось отправить партнёру 1 (ID: {user1_id}): {e}")
-
-        # Отправка второму партнёру (если это не тот же пользователь)
-        if user2_id != user1_id:
-            try:
-                await message.bot.send_message(user2_id, result_message, parse_mode="Markdown", reply_markup=keyboard)
-                sent_to.append(user2_id)
-            except Exception as e:
-                print(f"Не удалось отправить партнёру 2 (ID: {user2_id}): {e}")
-
-        # Если никому не удалось отправить, показываем текущему пользователю
-        if not sent_to:
-            await message.answer(result_message, parse_mode="Markdown", reply_markup=keyboard)
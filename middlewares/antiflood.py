@@ -0,0 +1,177 @@
+"""
+Антифлуд: сериализация апдейтов пользователя, защита от двойных нажатий и лимит частоты
+
+Регистрируется как outer-middleware на dp.update, после UserContextMiddleware
+aiogram, поэтому пользователь апдейта уже лежит в data["event_from_user"].
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import (
+    ANTIFLOOD_RATE,
+    ANTIFLOOD_BURST,
+    ANTIFLOOD_MAX_DELAY,
+    ANTIFLOOD_DUPLICATE_WINDOW,
+    ANTIFLOOD_IDLE_SECONDS,
+)
+from services.sender import TokenBucket
+
+
+class KeyedLock:
+    """Набор asyncio.Lock по ключу; замок удаляется, как только его никто не ждёт"""
+
+    def __init__(self):
+        # ключ → [замок, сколько корутин держат или ждут его]
+        self._locks: dict[Hashable, list] = {}
+
+    def locked(self, key: Hashable) -> bool:
+        entry = self._locks.get(key)
+        return entry is not None and entry[0].locked()
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class AntiFloodMiddleware(BaseMiddleware):
+    """
+    Per-user антифлуд для всех апдейтов
+
+    - повторное нажатие той же кнопки того же сообщения отбрасывается;
+    - частота апдейтов ограничена token bucket'ом на пользователя: небольшое
+      превышение выравнивается задержкой, большое — апдейт отбрасывается;
+    - апдейты одного пользователя обрабатываются строго по одному.
+    """
+
+    def __init__(
+        self,
+        rate: float = ANTIFLOOD_RATE,
+        burst: float = ANTIFLOOD_BURST,
+        max_delay: float = ANTIFLOOD_MAX_DELAY,
+        duplicate_window: float = ANTIFLOOD_DUPLICATE_WINDOW,
+        idle_seconds: float = ANTIFLOOD_IDLE_SECONDS
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_delay = max_delay
+        self.duplicate_window = duplicate_window
+        self.idle_seconds = idle_seconds
+
+        self.locks = KeyedLock()
+        self._buckets: dict[int, TokenBucket] = {}
+        # ключ нажатия → момент, до которого повтор считается дублем
+        self._recent_callbacks: OrderedDict[tuple, float] = OrderedDict()
+        self._last_sweep = time.monotonic()
+
+        self.counters = {
+            "passed": 0,
+            "dropped_duplicate": 0,
+            "dropped_rate_limited": 0,
+            "delayed": 0,
+            "serialized": 0,  # ждали, пока закончится предыдущий апдейт пользователя
+        }
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self._sweep(now)
+
+        if event.callback_query and self._is_duplicate_callback(event, now):
+            self.counters["dropped_duplicate"] += 1
+            await event.callback_query.answer()
+            return None
+
+        bucket = self._buckets.get(user.id)
+        if bucket is None:
+            bucket = self._buckets[user.id] = TokenBucket(self.rate, self.burst)
+        delay = bucket.reserve()
+        if delay > self.max_delay:
+            bucket.refund()
+            self.counters["dropped_rate_limited"] += 1
+            if event.callback_query:
+                await event.callback_query.answer("⏳ Не так быстро!")
+            return None
+        if delay > 0:
+            self.counters["delayed"] += 1
+            await asyncio.sleep(delay)
+
+        if self.locks.locked(user.id):
+            self.counters["serialized"] += 1
+        async with self.locks.hold(user.id):
+            self.counters["passed"] += 1
+            return await handler(event, data)
+
+    def stats(self) -> dict:
+        """Счётчики и размер внутренних структур"""
+        return {
+            **self.counters,
+            "buckets": len(self._buckets),
+            "locks": len(self.locks),
+            "recent_callbacks": len(self._recent_callbacks),
+        }
+
+    def _is_duplicate_callback(self, event: Update, now: float) -> bool:
+        """
+        Повтор той же кнопки того же сообщения
+
+        Кнопки теста несут номер вопроса (или подписанный прогресс) в callback_data,
+        поэтому законное нажатие на следующем вопросе дублем не считается, даже если
+        сообщение отредактировано в ту же секунду (edit_date хранит только секунды).
+        """
+        callback = event.callback_query
+        message = callback.message
+        key = (
+            callback.from_user.id,
+            message.chat.id if message else None,
+            message.message_id if message else callback.inline_message_id,
+            callback.data,
+        )
+        if self._recent_callbacks.get(key, 0.0) > now:
+            return True
+        self._recent_callbacks[key] = now + self.duplicate_window
+        self._recent_callbacks.move_to_end(key)
+        return False
+
+    def _sweep(self, now: float):
+        """Удаление устаревших отметок нажатий и неактивных корзин"""
+        # Окно у всех отметок одинаковое, поэтому самые старые — в начале
+        while self._recent_callbacks:
+            key, expires_at = next(iter(self._recent_callbacks.items()))
+            if expires_at > now:
+                break
+            del self._recent_callbacks[key]
+
+        if now - self._last_sweep < self.idle_seconds:
+            return
+        self._last_sweep = now
+        for user_id in [user_id for user_id, bucket in self._buckets.items()
+                        if bucket.idle_since(now) > self.idle_seconds]:
+            del self._buckets[user_id]
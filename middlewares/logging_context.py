@@ -0,0 +1,34 @@
+"""
+Middleware контекста логов: update_id и user_id для всех записей апдейта
+"""
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from services.logging_setup import session_id_var, update_id_var, user_id_var
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Заполняет контекст логов на время обработки апдейта (outer-middleware на dp.update)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        # Воркеры webhook обрабатывают апдейты подряд в одной задаче,
+        # поэтому session_id предыдущего апдейта тоже сбрасываем
+        tokens = (
+            update_id_var.set(event.update_id),
+            user_id_var.set(user.id if user else None),
+            session_id_var.set(None),
+        )
+        try:
+            return await handler(event, data)
+        finally:
+            for var, token in zip((update_id_var, user_id_var, session_id_var), tokens):
+                var.reset(token)
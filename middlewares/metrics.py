@@ -0,0 +1,58 @@
+"""
+Middleware сбора метрик: время обработчиков и запросов к Bot API
+"""
+
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject
+
+from services.metrics import HANDLER_SECONDS, HANDLER_ERRORS, TELEGRAM_SECONDS, TELEGRAM_ERRORS
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Гистограмма времени обработчиков
+
+    Регистрируется как inner-middleware на наблюдатели роутера, поэтому
+    вызывается только для апдейтов, которые прошли фильтры конкретного обработчика.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler_name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler_name)
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Гистограмма времени запросов к Bot API (middleware сессии бота)"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Response:
+        method_name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            TELEGRAM_ERRORS.inc(method_name)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, method_name)
@@ -0,0 +1,44 @@
+"""
+Middleware трассировки: корневой спан на апдейт и спаны запросов к Bot API
+"""
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject, Update
+
+from services.tracing import SPAN_KIND_CLIENT, SPAN_KIND_SERVER, start_span
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Корневой спан для каждого апдейта (outer-middleware на dp.update)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        with start_span(
+            f"telegram.update.{event.event_type}",
+            SPAN_KIND_SERVER,
+            update_id=event.update_id,
+            user_id=user.id if user else 0,
+        ):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Спан на каждый запрос к Bot API внутри трассы апдейта (middleware сессии бота)"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Response:
+        with start_span(f"telegram.{method.__api_method__}", SPAN_KIND_CLIENT, root=False):
+            return await make_request(bot, method)
@@ -0,0 +1,275 @@
+"""
+Офлайн-генерация отчётов для частых пар ответов через OpenAI Batch API
+
+Выбирает самые частые пары векторов ответов (по таблице results или по
+всему пространству ответов с выраженным доминирующим языком любви),
+отправляет запросы пачками в Batch API и загружает готовые отчёты в кэш
+services.report_cache — тот же, из которого читает analyzer.analyze.
+
+Прогресс хранится в файле состояния: после падения повторный запуск не
+отправляет пачки заново, а дожидается уже отправленных. Пары, для которых
+в кэше уже есть REPORT_CACHE_VARIANTS вариантов, пропускаются.
+
+Запуск:
+    python pregenerate.py --source answers --limit 500
+    python pregenerate.py --source space --min-dominant 4
+"""
+
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import logging
+import os
+from collections import Counter
+
+from sqlalchemy import case, func, select
+
+from config import REPORT_CACHE_VARIANTS
+from db.database import async_session_maker, init_db
+from db.models import ReportCacheEntry, Result
+from services.analyzer import PROMPT_VERSION, build_chat_request, compatibility_score
+from services.answer_codec import ANSWER_CHOICES, QUESTION_COUNT, encode_answers
+from services.llm_client import llm
+from services.logging_setup import setup_logging
+from services.report_cache import report_cache
+
+logger = logging.getLogger(__name__)
+
+_BATCH_ENDPOINT = "/v1/chat/completions"
+_FINISHED_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+async def select_frequent_pairs(limit: int) -> list[tuple[int, int]]:
+    """
+    Самые частые пары ответов среди готовых результатов
+
+    Args:
+        limit: сколько пар вернуть
+
+    Returns:
+        list: (меньший вектор, больший вектор) по убыванию частоты
+    """
+    low = case(
+        (Result.answers1_packed <= Result.answers2_packed, Result.answers1_packed),
+        else_=Result.answers2_packed,
+    )
+    high = case(
+        (Result.answers1_packed <= Result.answers2_packed, Result.answers2_packed),
+        else_=Result.answers1_packed,
+    )
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(low, high)
+            .where(Result.answers1_packed.is_not(None), Result.answers2_packed.is_not(None))
+            .group_by(low, high)
+            .order_by(func.count().desc())
+            .limit(limit)
+        )
+        return [(row[0], row[1]) for row in result]
+
+
+def enumerate_dominant_pairs(min_dominant: int, limit: int) -> list[tuple[int, int]]:
+    """
+    Пары из пространства ответов, где у каждого партнёра есть доминирующий язык любви
+
+    Вектор попадает в выборку, если один вариант ответа встречается в нём не
+    меньше min_dominant раз. Сначала идут пары с самыми «чистыми» профилями.
+
+    Args:
+        min_dominant: минимальное число одинаковых ответов
+        limit: сколько пар вернуть
+
+    Returns:
+        list: (меньший вектор, больший вектор)
+    """
+    profiles = []
+    for answers in itertools.product(ANSWER_CHOICES, repeat=QUESTION_COUNT):
+        dominant = Counter(answers).most_common(1)[0][1]
+        if dominant >= min_dominant:
+            profiles.append((dominant, encode_answers(list(answers))))
+
+    pairs = [
+        (-(dominant1 + dominant2), min(packed1, packed2), max(packed1, packed2))
+        for (dominant1, packed1), (dominant2, packed2)
+        in itertools.combinations_with_replacement(profiles, 2)
+    ]
+    pairs.sort()
+    return [(low, high) for _, low, high in pairs[:limit]]
+
+
+async def count_cached_variants() -> dict[tuple[int, int], int]:
+    """Сколько вариантов отчёта уже лежит в кэше для каждой пары текущей версии промпта"""
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(ReportCacheEntry.answers_low, ReportCacheEntry.answers_high, func.count())
+            .where(ReportCacheEntry.prompt_version == PROMPT_VERSION)
+            .group_by(ReportCacheEntry.answers_low, ReportCacheEntry.answers_high)
+        )
+        return {(low, high): count for low, high, count in result}
+
+
+def load_state(path: str) -> dict:
+    """Файл состояния (отправленные пачки); новый — если его нет или промпт сменился"""
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as state_file:
+            state = json.load(state_file)
+        if state.get("prompt_version") == PROMPT_VERSION:
+            return state
+        logger.warning("Файл состояния %s для другой версии промпта, начинаем заново", path)
+    return {"prompt_version": PROMPT_VERSION, "batches": []}
+
+
+def save_state(path: str, state: dict):
+    """Атомарная запись файла состояния"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file)
+    os.replace(tmp_path, path)
+
+
+async def submit_batch(pairs: list[tuple[int, int]]) -> str:
+    """
+    Отправка пачки запросов в Batch API
+
+    Args:
+        pairs: упорядоченные пары ответов
+
+    Returns:
+        str: ID пачки
+    """
+    lines = []
+    for low, high in pairs:
+        lines.append(json.dumps({
+            "custom_id": f"{low}-{high}",
+            "method": "POST",
+            "url": _BATCH_ENDPOINT,
+            "body": build_chat_request(low, high, compatibility_score(low, high)),
+        }, ensure_ascii=False))
+    payload = ("\n".join(lines) + "\n").encode("utf-8")
+
+    input_file = await llm.openai.files.create(file=("pregenerate.jsonl", io.BytesIO(payload)), purpose="batch")
+    batch = await llm.openai.batches.create(
+        input_file_id=input_file.id,
+        endpoint=_BATCH_ENDPOINT,
+        completion_window="24h",
+        metadata={"prompt_version": PROMPT_VERSION},
+    )
+    return batch.id
+
+
+async def load_batch_output(output_file_id: str) -> int:
+    """
+    Загрузка результатов пачки в кэш отчётов
+
+    Args:
+        output_file_id: ID файла с ответами
+
+    Returns:
+        int: сколько отчётов сохранено
+    """
+    content = await llm.openai.files.content(output_file_id)
+    stored = 0
+    for line in content.text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        response = item.get("response") or {}
+        if item.get("error") or response.get("status_code") != 200:
+            logger.warning("Запрос %s не выполнен: %s", item.get("custom_id"), item.get("error") or response)
+            continue
+        report = response["body"]["choices"][0]["message"]["content"]
+        if not report:
+            continue
+        low, high = (int(part) for part in item["custom_id"].split("-"))
+        await report_cache.put(PROMPT_VERSION, low, high, report)
+        stored += 1
+    return stored
+
+
+async def pregenerate(
+    source: str,
+    limit: int,
+    min_dominant: int,
+    batch_size: int,
+    poll_seconds: float,
+    state_path: str
+) -> int:
+    """
+    Отправка недостающих пар и загрузка всех готовых пачек
+
+    Returns:
+        int: сколько отчётов загружено в кэш
+    """
+    await init_db()
+    state = load_state(state_path)
+
+    if source == "answers":
+        pairs = await select_frequent_pairs(limit)
+    else:
+        pairs = enumerate_dominant_pairs(min_dominant, limit)
+
+    cached = await count_cached_variants()
+    in_flight = {tuple(pair) for batch in state["batches"] if not batch["loaded"] for pair in batch["pairs"]}
+    pending = [
+        pair for pair in pairs
+        if cached.get(pair, 0) < REPORT_CACHE_VARIANTS and pair not in in_flight
+    ]
+    logger.info("Пар выбрано: %d, уже в кэше или в работе: %d", len(pairs), len(pairs) - len(pending))
+
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        batch_id = await submit_batch(chunk)
+        state["batches"].append({"id": batch_id, "pairs": [list(pair) for pair in chunk], "loaded": False})
+        save_state(state_path, state)
+        logger.info("Отправлена пачка %s (%d запросов)", batch_id, len(chunk))
+
+    stored = 0
+    while True:
+        waiting = [batch for batch in state["batches"] if not batch["loaded"]]
+        if not waiting:
+            break
+        for entry in waiting:
+            batch = await llm.openai.batches.retrieve(entry["id"])
+            if batch.status not in _FINISHED_STATUSES:
+                continue
+            # У истёкшей пачки есть частичный результат; недостающие пары уйдут в следующий запуск
+            if batch.output_file_id:
+                loaded = await load_batch_output(batch.output_file_id)
+                stored += loaded
+                logger.info("Пачка %s (%s): загружено отчётов %d", entry["id"], batch.status, loaded)
+            else:
+                logger.warning("Пачка %s завершилась без результата: %s", entry["id"], batch.status)
+            entry["loaded"] = True
+            save_state(state_path, state)
+        if any(not batch["loaded"] for batch in state["batches"]):
+            await asyncio.sleep(poll_seconds)
+
+    # Все пачки загружены — следующий запуск начнёт с чистого состояния
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-генерация отчётов для частых пар ответов")
+    parser.add_argument("--source", choices=("answers", "space"), default="answers",
+                        help="answers — частые пары из results, space — профили с доминирующим языком любви")
+    parser.add_argument("--limit", type=int, default=500, help="сколько пар обработать")
+    parser.add_argument("--min-dominant", type=int, default=4,
+                        help="для --source space: минимум одинаковых ответов в профиле")
+    parser.add_argument("--batch-size", type=int, default=1000, help="запросов в одной пачке Batch API")
+    parser.add_argument("--poll-seconds", type=float, default=60, help="интервал проверки статуса пачек")
+    parser.add_argument("--state", default="pregenerate_state.json", help="файл состояния для продолжения")
+    args = parser.parse_args()
+
+    setup_logging()
+    stored = asyncio.run(pregenerate(
+        args.source, args.limit, args.min_dominant, args.batch_size, args.poll_seconds, args.state
+    ))
+    logger.info("Готово: загружено отчётов %d", stored)
+
+
+if __name__ == "__main__":
+    main()
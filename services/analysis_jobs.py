@@ -0,0 +1,396 @@
+"""
+Очередь задач анализа в БД и пул воркеров
+
+Обработчик завершения теста только записывает задачу в analysis_jobs (в
+той же транзакции, что захват сессии) и сразу отвечает пользователю.
+Воркеры берут задачи в аренду на ANALYSIS_LEASE_SECONDS и продлевают её,
+пока идёт генерация. Если процесс упал, аренда истекает, и задачу забирает
+другой воркер (или тот же процесс после рестарта). Результат, перевод
+сессии в completed и удаление задачи пишутся одной транзакцией, поэтому
+повторная обработка не создаёт второй Result.
+
+Новая задача становится доступной не сразу, а после того, как обработчик
+привяжет к ней сообщение «Анализирую...» (attach_placeholder) — в нём
+воркер показывает превью по мере генерации. Если обработчик не успел,
+задача всё равно станет доступна через _PLACEHOLDER_WAIT_SECONDS.
+
+Если исчерпаны все ANALYSIS_MAX_ATTEMPTS попыток, партнёры получают базовый
+отчёт (предварительный — его перегенерирует services.regenerator), чтобы
+сессия не осталась в статусе analyzing навсегда.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import (
+    ANALYSIS_WORKERS,
+    ANALYSIS_LEASE_SECONDS,
+    ANALYSIS_POLL_SECONDS,
+    ANALYSIS_MAX_ATTEMPTS,
+    FREE_REPORT_LIMIT,
+    STREAM_REPORTS,
+)
+from db.database import async_session_maker
+from db.models import AnalysisJob, JobStatus, Result, Session as DBSession, SessionStatus
+from db.queries import dialect_insert
+from services.analyzer import analyze, basic_report, compatibility_score
+from services.logging_setup import bind_log_context
+from services.metrics import ANALYSIS_JOB_SECONDS, ANALYSIS_JOB_WAIT_SECONDS
+from services.progressive_message import ProgressiveMessage
+from services.report_store import store_report
+from services.sender import sender
+from services.tracing import continue_trace, start_span, trace_parent
+
+logger = logging.getLogger(__name__)
+
+# Сколько задача ждёт привязки сообщения-заглушки, прежде чем стать доступной воркерам
+_PLACEHOLDER_WAIT_SECONDS = 5
+
+ANALYSIS_FAILED_TEXT = (
+    "😔 Не удалось подготовить результат теста. Мы уже разбираемся — "
+    "попробуйте пройти тест заново чуть позже: /start"
+)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+async def enqueue_analysis(
+    session: AsyncSession,
+    session_id: int,
+    user1_id: int,
+    answers1: int,
+    user2_id: int,
+    answers2: int,
+    chat_id: int
+):
+    """
+    Постановка анализа сессии в очередь (повторная постановка ничего не делает)
+
+    Args:
+        session: сессия БД (коммит — вместе с захватом сессии, за вызывающим кодом)
+        session_id: ID сессии
+        user1_id, answers1: первый партнёр и его упакованные ответы
+        user2_id, answers2: второй партнёр и его упакованные ответы
+        chat_id: чат, где будет сообщение «Анализирую...»
+    """
+    # Воркер продолжит трассу обработчика: апдейт → анализ → OpenAI → отправка
+    trace_id, parent_span_id, trace_sampled = trace_parent()
+    await session.execute(
+        dialect_insert(session, AnalysisJob)
+        .values(
+            session_id=session_id,
+            user1_id=user1_id,
+            answers1_packed=answers1,
+            user2_id=user2_id,
+            answers2_packed=answers2,
+            chat_id=chat_id,
+            status=JobStatus.QUEUED,
+            lease_until=_utcnow() + timedelta(seconds=_PLACEHOLDER_WAIT_SECONDS),
+            trace_id=trace_id,
+            parent_span_id=parent_span_id,
+            trace_sampled=trace_sampled,
+            created_at=_utcnow(),
+        )
+        .on_conflict_do_nothing(index_elements=["session_id"])
+    )
+
+
+async def attach_placeholder(session_id: int, message_id: int):
+    """Привязать сообщение «Анализирую...» к задаче и сразу отдать её воркерам"""
+    async with async_session_maker() as session:
+        await session.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.session_id == session_id, AnalysisJob.status == JobStatus.QUEUED)
+            .values(message_id=message_id, lease_until=None)
+        )
+        await session.commit()
+    analysis_workers.notify()
+
+
+def build_result_message(session_id: int, score: int, preview: str, has_full_report: bool) -> tuple[str, InlineKeyboardMarkup]:
+    """
+    Сообщение с результатом и кнопками upsell
+
+    Returns:
+        tuple: (текст в Markdown, клавиатура)
+    """
+    free_report = preview
+    if has_full_report:
+        free_report += "\n\n...\n\n💎 **Полный отчёт доступен в премиум-версии**"
+
+    result_message = (
+        f"✨ **Ваш результат готов!** ✨\n\n"
+        f"💕 **Совместимость: {score}%**\n\n"
+        f"{free_report}"
+    )
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📖 Хочу полный отчёт", callback_data=f"premium_{session_id}")],
+        [InlineKeyboardButton(text="📤 Поделиться результатом",
+                            switch_inline_query=f"Мы прошли тест на совместимость! Наш результат: {score}%")]
+    ])
+    return result_message, keyboard
+
+
+async def run_analysis(bot: Bot, job: AnalysisJob):
+    """
+    AI-анализ по задаче, сохранение результата и отправка партнёрам
+
+    Если к задаче привязано сообщение «Анализирую...», в нём по мере
+    генерации показывается бесплатное превью, а в конце — готовый результат.
+    """
+    session_id = job.session_id
+    bind_log_context(session_id=session_id)
+
+    progress = None
+    on_progress = None
+    if job.message_id is not None and STREAM_REPORTS:
+        progress = ProgressiveMessage(bot, job.chat_id, job.message_id)
+        score_preview = compatibility_score(job.answers1_packed, job.answers2_packed)
+        # Во время генерации Markdown может быть незакрытым, поэтому превью — обычным текстом
+        on_progress = lambda text: progress.update(
+            f"💕 Совместимость: {score_preview}%\n\n{text[:FREE_REPORT_LIMIT]} ▌"
+        )
+
+    # Отчёт сохраняется, только когда генерация завершена
+    score, report, is_provisional = await analyze(job.answers1_packed, job.answers2_packed, on_progress=on_progress)
+    await complete_analysis(bot, job, score, report, is_provisional, progress)
+
+
+async def complete_analysis(
+    bot: Bot,
+    job: AnalysisJob,
+    score: int,
+    report: str,
+    is_provisional: bool,
+    progress: ProgressiveMessage | None = None
+):
+    """
+    Сохранение результата задачи и отправка его партнёрам
+
+    Args:
+        bot: бот для отправки результата
+        job: задача анализа
+        score: индекс совместимости
+        report: полный отчёт
+        is_provisional: базовый отчёт, который нужно перегенерировать
+        progress: сообщение «Анализирую...», которое превращается в результат
+    """
+    session_id = job.session_id
+    async with async_session_maker() as session:
+        # Результат, статус сессии и удаление задачи — одной транзакцией
+        report_blob = await store_report(session, report)
+        session.add(Result(
+            session_id=session_id,
+            compatibility_score=score,
+            report_hash=report_blob.hash,
+            answers1_packed=job.answers1_packed,
+            answers2_packed=job.answers2_packed,
+            is_provisional=is_provisional
+        ))
+        await session.execute(
+            update(DBSession).where(DBSession.id == session_id).values(status=SessionStatus.COMPLETED)
+        )
+        await session.execute(delete(AnalysisJob).where(AnalysisJob.id == job.id))
+        await session.commit()
+
+    result_message, keyboard = build_result_message(
+        session_id, score, report_blob.preview, report_blob.size > FREE_REPORT_LIMIT
+    )
+
+    # Сообщение с превью превращается в результат, остальным партнёрам — новое сообщение
+    recipients = [job.user1_id] if job.user2_id == job.user1_id else [job.user1_id, job.user2_id]
+    if progress is not None and job.chat_id in recipients:
+        if await progress.finish(result_message, parse_mode="Markdown", reply_markup=keyboard):
+            recipients.remove(job.chat_id)
+
+    # Отправляем результаты партнёрам через очередь отправки (ошибки она логирует сама)
+    for user_id in recipients:
+        sender.send_message(bot, user_id, result_message, parse_mode="Markdown", reply_markup=keyboard)
+
+
+class AnalysisWorkerPool:
+    """Воркеры, выполняющие задачи из analysis_jobs"""
+
+    def __init__(
+        self,
+        workers: int = ANALYSIS_WORKERS,
+        lease_seconds: int = ANALYSIS_LEASE_SECONDS,
+        poll_seconds: float = ANALYSIS_POLL_SECONDS,
+        max_attempts: int = ANALYSIS_MAX_ATTEMPTS
+    ):
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self.busy = 0
+        self.depth = {status.name.lower(): 0 for status in JobStatus}
+        self.counters = {"completed": 0, "retried": 0, "fallback": 0, "failed": 0}
+
+    def start(self, bot: Bot) -> list[asyncio.Task]:
+        """Запуск воркеров и замера длины очереди (задачи отменяются при остановке бота)"""
+        tasks = [asyncio.create_task(self._worker(bot)) for _ in range(self.workers)]
+        tasks.append(asyncio.create_task(self._measure_depth()))
+        return tasks
+
+    def notify(self):
+        """Разбудить воркеры этого процесса (новая задача готова)"""
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        """Длина очереди по статусам и счётчики (для /metrics)"""
+        return {
+            **{f"jobs_{status}": count for status, count in self.depth.items()},
+            **self.counters,
+            "busy_workers": self.busy,
+            "workers": self.workers,
+        }
+
+    async def _worker(self, bot: Bot):
+        while True:
+            try:
+                job = await self._claim()
+            except Exception:
+                logger.exception("Не удалось взять задачу анализа")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.busy += 1
+            try:
+                # Спаны задачи — продолжение трассы обработчика, поставившего её в очередь
+                with continue_trace(job.trace_id, job.parent_span_id, job.trace_sampled):
+                    await self._process(bot, job)
+            finally:
+                self.busy -= 1
+
+    async def _claim(self) -> AnalysisJob | None:
+        """Взять в аренду одну доступную задачу: новую или с истёкшей арендой"""
+        now = _utcnow()
+        available = (
+            AnalysisJob.status.in_((JobStatus.QUEUED, JobStatus.RUNNING)),
+            or_(AnalysisJob.lease_until.is_(None), AnalysisJob.lease_until < now),
+        )
+        candidate = select(AnalysisJob.id).where(*available).order_by(AnalysisJob.id).limit(1).scalar_subquery()
+        async with async_session_maker() as session:
+            # Условие повторяется в UPDATE: из двух воркеров задачу получит только один
+            result = await session.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.id == candidate, *available)
+                .values(
+                    status=JobStatus.RUNNING,
+                    lease_until=now + timedelta(seconds=self.lease_seconds),
+                    attempts=AnalysisJob.attempts + 1,
+                )
+                .returning(AnalysisJob)
+                .execution_options(synchronize_session=False)
+            )
+            job = result.scalar_one_or_none()
+            await session.commit()
+        return job
+
+    async def _process(self, bot: Bot, job: AnalysisJob):
+        ANALYSIS_JOB_WAIT_SECONDS.observe((_utcnow() - job.created_at).total_seconds())
+        renewal = asyncio.create_task(self._renew_lease(job.id))
+        started = time.perf_counter()
+        try:
+            with start_span("analysis.job", session_id=job.session_id, attempt=job.attempts):
+                await run_analysis(bot, job)
+        except Exception as e:
+            logger.exception("Ошибка задачи анализа сессии %s (попытка %d)", job.session_id, job.attempts)
+            if job.attempts >= self.max_attempts:
+                await self._give_up(bot, job, e)
+            else:
+                await self._release(job, e)
+        else:
+            self.counters["completed"] += 1
+            ANALYSIS_JOB_SECONDS.observe(time.perf_counter() - started)
+        finally:
+            renewal.cancel()
+
+    async def _renew_lease(self, job_id: int):
+        """Продление аренды, пока задача выполняется"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            async with async_session_maker() as session:
+                await session.execute(
+                    update(AnalysisJob)
+                    .where(AnalysisJob.id == job_id, AnalysisJob.status == JobStatus.RUNNING)
+                    .values(lease_until=_utcnow() + timedelta(seconds=self.lease_seconds))
+                )
+                await session.commit()
+
+    async def _release(self, job: AnalysisJob, error: Exception, status: JobStatus = JobStatus.QUEUED):
+        """Вернуть задачу в очередь с экспоненциальной задержкой (или пометить failed)"""
+        if status == JobStatus.QUEUED:
+            delay = min(self.lease_seconds, 2 ** job.attempts)
+            lease_until = _utcnow() + timedelta(seconds=delay)
+            self.counters["retried"] += 1
+        else:
+            lease_until = None
+        async with async_session_maker() as session:
+            await session.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.id == job.id)
+                .values(status=status, lease_until=lease_until, last_error=f"{type(error).__name__}: {error}"[:500])
+            )
+            await session.commit()
+
+    async def _give_up(self, bot: Bot, job: AnalysisJob, error: Exception):
+        """
+        Попытки исчерпаны: партнёрам уходит базовый отчёт без OpenAI
+
+        Он сохраняется как предварительный, поэтому services.regenerator позже
+        заменит его подробным. Если не удалось сохранить и его, задача
+        помечается failed, а партнёры получают сообщение об ошибке.
+        """
+        score = compatibility_score(job.answers1_packed, job.answers2_packed)
+        try:
+            report = basic_report(job.answers1_packed, job.answers2_packed, score)
+            await complete_analysis(bot, job, score, report, is_provisional=True)
+        except Exception:
+            logger.exception("Не удалось выдать базовый отчёт сессии %s", job.session_id)
+        else:
+            self.counters["fallback"] += 1
+            return
+
+        self.counters["failed"] += 1
+        try:
+            await self._release(job, error, status=JobStatus.FAILED)
+        except Exception:
+            logger.exception("Не удалось пометить задачу анализа сессии %s", job.session_id)
+        for user_id in {job.user1_id, job.user2_id}:
+            sender.send_message(bot, user_id, ANALYSIS_FAILED_TEXT)
+
+    async def _measure_depth(self):
+        """Периодический подсчёт задач по статусам"""
+        while True:
+            try:
+                async with async_session_maker() as session:
+                    result = await session.execute(
+                        select(AnalysisJob.status, func.count()).group_by(AnalysisJob.status)
+                    )
+                    counts = dict(result.all())
+                self.depth = {status.name.lower(): counts.get(int(status), 0) for status in JobStatus}
+            except Exception:
+                logger.exception("Не удалось посчитать очередь анализа")
+            await asyncio.sleep(self.poll_seconds * 5)
+
+
+# Пул воркеров процесса
+analysis_workers = AnalysisWorkerPool()
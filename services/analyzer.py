@@ -2,26 +2,100 @@
 AI-анализ совместимости партнёров
 """
 
+import logging
+import time
+from typing import Callable
+
 from openai import AsyncOpenAI
-from config import OPENAI_API_KEY
+from openai.types import CompletionUsage
+from services.answer_codec import answers_length, count_matches, decode_answers
+from services.llm_client import CircuitOpenError, llm
+from services.metrics import OPENAI_FIRST_TOKEN_SECONDS, OPENAI_SECONDS, OPENAI_TOKENS
+from services.report_cache import cache_key, report_cache, swap_partner_labels
+from services.tracing import SPAN_KIND_CLIENT, begin_span
+
+logger = logging.getLogger(__name__)
+
+# Версия промпта: меняется при любой правке промпта или модели, чтобы не отдавать старые отчёты из кэша
+PROMPT_VERSION = "1"
+OPENAI_MODEL = "gpt-4o-mini"
+
+
+def compatibility_score(packed1: int, packed2: int) -> int:
+    """
+    Базовый расчёт совместимости (процент совпадающих ответов)
+
+    Args:
+        packed1: упакованные ответы первого партнёра
+        packed2: упакованные ответы второго партнёра
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    Returns:
+        int: совместимость 0-100
+    """
+    total = answers_length(packed1)
+    return int(count_matches(packed1, packed2) / total * 100) if total else 0
 
 
-async def analyze(answers1: list, answers2: list) -> tuple[int, str]:
+async def analyze(
+    packed1: int,
+    packed2: int,
+    on_progress: Callable[[str], None] | None = None
+) -> tuple[int, str, bool]:
     """
     Анализ совместимости на основе ответов двух партнёров
 
+    Повторная пара (в любом порядке) берётся из services.report_cache без
+    запроса к OpenAI; базовый отчёт при ошибке API в кэш не попадает и
+    помечается как предварительный (его перегенерирует services.regenerator).
+
     Args:
-        answers1: список ответов первого партнёра
-        answers2: список ответов второго партнёра
+        packed1: упакованные ответы первого партнёра (services.answer_codec)
+        packed2: упакованные ответы второго партнёра
+        on_progress: если задан, отчёт генерируется потоком, и функция
+            получает накопленный текст после каждого фрагмента
 
     Returns:
-        tuple: (compatibility_score, full_report)
+        tuple: (compatibility_score, full_report, is_provisional)
     """
-    # Базовый расчёт совместимости (процент совпадающих ответов)
-    same = sum(1 for a, b in zip(answers1, answers2) if a == b)
-    score = int(same / len(answers1) * 100) if answers1 else 0
+    score = compatibility_score(packed1, packed2)
+    if not report_cache.enabled:
+        report, ok = await generate_report(packed1, packed2, score, on_progress)
+        return score, report, not ok
+
+    low, high, swapped = cache_key(packed1, packed2)
+    if swapped and on_progress is not None:
+        # Поток идёт в каноническом порядке — метки партнёров меняем и в промежуточном тексте
+        report_progress = on_progress
+        on_progress = lambda text: report_progress(swap_partner_labels(text))
+
+    report, needs_variant = await report_cache.get(PROMPT_VERSION, low, high)
+    is_provisional = False
+    if needs_variant:
+        generated, ok = await generate_report(low, high, score, on_progress)
+        if ok:
+            await report_cache.put(PROMPT_VERSION, low, high, generated)
+            report = generated
+        elif report is None:
+            report = generated
+            is_provisional = True
+
+    return score, swap_partner_labels(report) if swapped else report, is_provisional
+
+
+def build_chat_request(packed1: int, packed2: int, score: int) -> dict:
+    """
+    Параметры запроса chat.completions для пары (общие для онлайн-анализа и Batch API)
+
+    Args:
+        packed1: упакованные ответы первого партнёра
+        packed2: упакованные ответы второго партнёра
+        score: индекс совместимости
+
+    Returns:
+        dict: model, messages, temperature, max_completion_tokens
+    """
+    answers1 = decode_answers(packed1)
+    answers2 = decode_answers(packed2)
 
     # Системное сообщение для настройки роли
     system_message = """Ты — опытный психолог-эксперт по отношениям с 15-летним стажем работы с парами.
@@ -89,34 +163,123 @@ E) Прикосновения (Physical Touch)
 - Каждая рекомендация должна быть применима уже сегодня
 - Найди что-то уникальное в этой паре"""
 
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.8,
-            max_completion_tokens=2500
-        )
-
-        full_report = response.choices[0].message.content
-        return score, full_report
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_prompt}
+        ],
+        "temperature": 0.8,
+        "max_completion_tokens": 2500,
+    }
 
-    except Exception as e:
-        # Логируем ошибку
-        print(f"❌ Ошибка OpenAI API: {e}")
 
-        # В случае ошибки возвращаем базовый отчёт
-        fallback_report = f"""
+def basic_report(packed1: int, packed2: int, score: int) -> str:
+    """
+    Базовый отчёт без обращения к OpenAI
+
+    Args:
+        packed1: упакованные ответы первого партнёра
+        packed2: упакованные ответы второго партнёра
+        score: индекс совместимости
+
+    Returns:
+        str: отчёт с процентом и числом совпавших ответов
+    """
+    return f"""
 ❤️ **Индекс совместимости**: {score}%
 
 К сожалению, не удалось сгенерировать подробный отчёт.
 Ваш базовый процент совместимости: {score}%
 
-Это означает, что у вас совпадает {same} из {len(answers1)} ответов.
+Это означает, что у вас совпадает {count_matches(packed1, packed2)} из {answers_length(packed1)} ответов.
 """
-        return score, fallback_report
+
+
+async def generate_report(
+    packed1: int,
+    packed2: int,
+    score: int,
+    on_progress: Callable[[str], None] | None = None
+) -> tuple[str, bool]:
+    """
+    Генерация отчёта через OpenAI
+
+    Args:
+        packed1: упакованные ответы первого партнёра
+        packed2: упакованные ответы второго партнёра
+        score: индекс совместимости
+        on_progress: получает накопленный текст по мере генерации (потоковый режим)
+
+    Returns:
+        tuple: (текст отчёта, получен ли он от модели — False для базового отчёта)
+    """
+    request = build_chat_request(packed1, packed2, score)
+
+    started = time.perf_counter()
+    span = begin_span(
+        "openai.chat.completions", SPAN_KIND_CLIENT, root=False,
+        model=OPENAI_MODEL, stream=on_progress is not None,
+    )
+    try:
+        if on_progress is None:
+            response = await llm.call(lambda openai: openai.chat.completions.create(**request))
+            full_report, usage = response.choices[0].message.content, response.usage
+        else:
+            full_report, usage = await llm.call(
+                lambda openai: _stream_completion(openai, request, on_progress, started)
+            )
+
+        OPENAI_SECONDS.observe(time.perf_counter() - started, "ok")
+        if usage:
+            OPENAI_TOKENS.inc("prompt", amount=usage.prompt_tokens)
+            OPENAI_TOKENS.inc("completion", amount=usage.completion_tokens)
+            span.set_attribute("prompt_tokens", usage.prompt_tokens)
+            span.set_attribute("completion_tokens", usage.completion_tokens)
+
+        return full_report, True
+
+    except Exception as e:
+        OPENAI_SECONDS.observe(time.perf_counter() - started, "error")
+        span.record_error(e)
+        if isinstance(e, CircuitOpenError):
+            logger.warning("OpenAI недоступен, отдаём базовый отчёт")
+        else:
+            logger.exception("Ошибка OpenAI API, отдаём базовый отчёт")
+
+        # В случае ошибки возвращаем базовый отчёт
+        return basic_report(packed1, packed2, score), False
+
+    finally:
+        span.end()
+
+
+async def _stream_completion(
+    openai: AsyncOpenAI,
+    request: dict,
+    on_progress: Callable[[str], None],
+    started: float
+) -> tuple[str, CompletionUsage | None]:
+    """
+    Потоковый запрос: текст копится по фрагментам, каждый передаётся в on_progress
+
+    При повторе после обрыва текст начинается заново — превью просто перепишется.
+    """
+    stream = await openai.chat.completions.create(
+        **request, stream=True, stream_options={"include_usage": True}
+    )
+    report = ""
+    usage = None
+    async for chunk in stream:
+        if chunk.usage:
+            usage = chunk.usage
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        if not report:
+            OPENAI_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+        report += chunk.choices[0].delta.content
+        on_progress(report)
+    return report, usage
 
 
 def get_free_preview(full_report: str, limit: int = 500) -> str:
@@ -0,0 +1,108 @@
+"""
+Компактное хранение ответов теста
+
+Каждый ответ (A–E) кодируется 3 битами: A=1 … E=5, 0 означает «ответа нет».
+Ответ на вопрос i лежит в битах [3*i, 3*i + 3), поэтому пять ответов
+занимают 15 бит, а в BIGINT помещается анкета до 21 вопроса.
+Сравнение профилей выполняется побитовыми операциями без распаковки.
+"""
+
+ANSWER_CHOICES = "ABCDE"
+QUESTION_COUNT = 5  # вопросов в тесте (handlers/test.py: QUESTIONS)
+BITS_PER_ANSWER = 3
+MAX_PACKED_ANSWERS = 21  # 63 бита — предел знакового BIGINT
+
+_LANE_MASK = (1 << BITS_PER_ANSWER) - 1
+
+
+def _low_bits_mask(length: int) -> int:
+    """Маска с единицей в младшем бите каждой из первых length ячеек"""
+    mask = 0
+    for i in range(length):
+        mask |= 1 << (BITS_PER_ANSWER * i)
+    return mask
+
+
+def encode_answers(answers: list) -> int:
+    """
+    Упаковка списка ответов в целое число
+
+    Args:
+        answers: список ответов, например ["A", "C", "E", "B", "D"]
+
+    Returns:
+        int: упакованный вектор ответов
+    """
+    if len(answers) > MAX_PACKED_ANSWERS:
+        raise ValueError(f"Слишком много ответов для упаковки: {len(answers)}")
+
+    packed = 0
+    for i, answer in enumerate(answers):
+        code = ANSWER_CHOICES.index(answer) + 1
+        packed |= code << (BITS_PER_ANSWER * i)
+    return packed
+
+
+def decode_answers(packed: int) -> list:
+    """
+    Распаковка вектора ответов обратно в список букв
+
+    Args:
+        packed: упакованный вектор ответов
+
+    Returns:
+        list: список ответов
+    """
+    answers = []
+    while packed:
+        answers.append(ANSWER_CHOICES[(packed & _LANE_MASK) - 1])
+        packed >>= BITS_PER_ANSWER
+    return answers
+
+
+def answers_length(packed: int) -> int:
+    """Количество ответов в упакованном векторе"""
+    return (packed.bit_length() + BITS_PER_ANSWER - 1) // BITS_PER_ANSWER
+
+
+def _zero_lanes(value: int, length: int) -> int:
+    """Количество нулевых ячеек среди первых length"""
+    low_bits = _low_bits_mask(length)
+    nonzero = (value | (value >> 1) | (value >> 2)) & low_bits
+    return length - nonzero.bit_count()
+
+
+def count_matches(packed1: int, packed2: int) -> int:
+    """
+    Количество совпадающих ответов двух партнёров
+
+    Args:
+        packed1: ответы первого партнёра
+        packed2: ответы второго партнёра
+
+    Returns:
+        int: сколько позиций совпало
+    """
+    length = min(answers_length(packed1), answers_length(packed2))
+    return _zero_lanes(packed1 ^ packed2, length)
+
+
+def count_choice(packed: int, choice: str) -> int:
+    """
+    Сколько раз вариант встречается в ответах
+
+    Args:
+        packed: упакованный вектор ответов
+        choice: буква варианта (A–E)
+
+    Returns:
+        int: количество вхождений
+    """
+    length = answers_length(packed)
+    code = ANSWER_CHOICES.index(choice) + 1
+    return _zero_lanes(packed ^ (code * _low_bits_mask(length)), length)
+
+
+def dominant_choice(packed: int) -> str:
+    """Самый частый вариант ответа (доминирующий язык любви)"""
+    return max(ANSWER_CHOICES, key=lambda choice: count_choice(packed, choice))
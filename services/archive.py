@@ -0,0 +1,259 @@
+"""
+Архивация старых завершённых сессий
+
+Завершённые сессии старше ARCHIVE_AFTER_DAYS вместе с ответами и результатом
+переносятся из рабочих таблиц в append-only сегменты на диске. Каждая запись
+сегмента — 4 байта длины и JSON, сжатый zlib. Таблица archived_sessions хранит
+для каждой сессии партнёров и положение записи, чтобы /results мог прочитать
+архивный результат по требованию.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, exists, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from config import (
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_DIR,
+    ARCHIVE_SEGMENT_MAX_BYTES,
+    ARCHIVE_INTERVAL_SECONDS,
+    ARCHIVE_BATCH_SIZE,
+    REPORT_COMPRESSION_LEVEL,
+)
+from db.database import async_session_maker
+from db.models import Session as DBSession, SessionStatus, Answer, Result, ReportBlob, ReportCacheEntry, ArchivedSession
+from services.report_store import decompress_report
+from services.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+_RECORD_HEADER = struct.Struct(">I")
+
+
+def _isoformat(value: datetime | None) -> str | None:
+    return value.isoformat() if value else None
+
+
+def _session_to_record(db_session: DBSession) -> dict:
+    """Сериализация сессии со всеми зависимыми строками в словарь"""
+    record = {
+        "session_id": db_session.id,
+        "created_at": _isoformat(db_session.created_at),
+        "partner1_user_id": db_session.partner1_user_id,
+        "partner2_user_id": db_session.partner2_user_id,
+        "is_quick_check": db_session.is_quick_check,
+        "answers": [
+            {
+                "user_id": answer.user_id,
+                "user_role": answer.user_role,
+                "answers_packed": answer.answers_packed,
+                "completed_at": _isoformat(answer.completed_at),
+            }
+            for answer in db_session.answers
+        ],
+        "result": None,
+    }
+    if db_session.result:
+        result = db_session.result
+        record["result"] = {
+            "compatibility_score": result.compatibility_score,
+            "report": decompress_report(result.report_blob.data),
+            "answers1_packed": result.answers1_packed,
+            "answers2_packed": result.answers2_packed,
+            "created_at": _isoformat(result.created_at),
+        }
+    return record
+
+
+def _current_segment(archive_dir: str) -> str:
+    """Имя сегмента для дозаписи (новый, если последний переполнен)"""
+    segments = sorted(name for name in os.listdir(archive_dir) if name.endswith(".seg"))
+    if segments:
+        last = segments[-1]
+        if os.path.getsize(os.path.join(archive_dir, last)) < ARCHIVE_SEGMENT_MAX_BYTES:
+            return last
+        number = int(last.split("-")[1].split(".")[0]) + 1
+    else:
+        number = 1
+    return f"segment-{number:06d}.seg"
+
+
+def append_records(records: list, archive_dir: str = ARCHIVE_DIR) -> list:
+    """
+    Дозапись записей в текущий сегмент (блокирующая, вызывать через to_thread)
+
+    Args:
+        records: словари для сохранения
+        archive_dir: каталог архива
+
+    Returns:
+        list: (segment, offset, length) для каждой записи
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    segment = _current_segment(archive_dir)
+    positions = []
+
+    with open(os.path.join(archive_dir, segment), "ab") as segment_file:
+        offset = segment_file.tell()
+        for record in records:
+            payload = zlib.compress(
+                json.dumps(record, ensure_ascii=False).encode("utf-8"), REPORT_COMPRESSION_LEVEL
+            )
+            segment_file.write(_RECORD_HEADER.pack(len(payload)))
+            segment_file.write(payload)
+            positions.append((segment, offset, len(payload)))
+            offset += _RECORD_HEADER.size + len(payload)
+        # Строки удаляются из БД только после того, как запись гарантированно на диске
+        segment_file.flush()
+        os.fsync(segment_file.fileno())
+
+    return positions
+
+
+def read_record(segment: str, offset: int, length: int, archive_dir: str = ARCHIVE_DIR) -> dict:
+    """
+    Чтение одной записи из сегмента (блокирующее, вызывать через to_thread)
+
+    Args:
+        segment: имя файла сегмента
+        offset: смещение заголовка записи
+        length: длина сжатых данных
+        archive_dir: каталог архива
+
+    Returns:
+        dict: запись сессии
+    """
+    with open(os.path.join(archive_dir, segment), "rb") as segment_file:
+        segment_file.seek(offset + _RECORD_HEADER.size)
+        payload = segment_file.read(length)
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+@traced("archive.run")
+async def archive_completed_sessions(
+    max_age_days: int = ARCHIVE_AFTER_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE
+) -> int:
+    """
+    Перенос старых завершённых сессий в архив пачками
+
+    Args:
+        max_age_days: возраст сессии, после которого она уходит в архив
+        batch_size: сколько сессий переносить за одну транзакцию
+
+    Returns:
+        int: сколько сессий заархивировано
+    """
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=max_age_days)
+    archived = 0
+
+    while True:
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(DBSession)
+                .options(
+                    selectinload(DBSession.answers),
+                    selectinload(DBSession.result)
+                    .selectinload(Result.report_blob)
+                    .undefer(ReportBlob.data),
+                )
+                .where(DBSession.status == SessionStatus.COMPLETED, DBSession.created_at < cutoff)
+                .order_by(DBSession.created_at)
+                .limit(batch_size)
+            )
+            db_sessions = result.scalars().all()
+            if not db_sessions:
+                break
+
+            records = [_session_to_record(db_session) for db_session in db_sessions]
+            positions = await asyncio.to_thread(append_records, records)
+
+            session_ids = [db_session.id for db_session in db_sessions]
+            report_hashes = {
+                db_session.result.report_hash for db_session in db_sessions if db_session.result
+            }
+            for db_session, (segment, offset, length) in zip(db_sessions, positions):
+                session.add(ArchivedSession(
+                    session_id=db_session.id,
+                    partner1_user_id=db_session.partner1_user_id,
+                    partner2_user_id=db_session.partner2_user_id,
+                    created_at=db_session.created_at,
+                    segment=segment,
+                    offset=offset,
+                    length=length,
+                ))
+            await session.flush()
+
+            await session.execute(delete(Result).where(Result.session_id.in_(session_ids)))
+            await session.execute(delete(Answer).where(Answer.session_id.in_(session_ids)))
+            await session.execute(delete(DBSession).where(DBSession.id.in_(session_ids)))
+            await delete_unreferenced_reports(session, report_hashes)
+            await session.commit()
+
+        archived += len(db_sessions)
+        if len(db_sessions) < batch_size:
+            break
+
+    return archived
+
+
+async def delete_unreferenced_reports(session: AsyncSession, report_hashes: set):
+    """Удаление отчётов из хранилища, на которые больше не ссылаются ни результаты, ни кэш отчётов"""
+    if not report_hashes:
+        return
+    await session.execute(
+        delete(ReportBlob).where(
+            ReportBlob.hash.in_(report_hashes),
+            ~exists().where(Result.report_hash == ReportBlob.hash),
+            ~exists().where(ReportCacheEntry.report_hash == ReportBlob.hash),
+        )
+    )
+
+
+async def load_archived_result(session: AsyncSession, user_id: int) -> dict | None:
+    """
+    Последний заархивированный результат пользователя
+
+    Args:
+        session: сессия БД
+        user_id: Telegram ID пользователя
+
+    Returns:
+        dict | None: запись result из архива (compatibility_score, report, ...) или None
+    """
+    result = await session.execute(
+        select(ArchivedSession)
+        .where(or_(
+            ArchivedSession.partner1_user_id == user_id,
+            ArchivedSession.partner2_user_id == user_id,
+        ))
+        .order_by(ArchivedSession.created_at.desc())
+        .limit(1)
+    )
+    entry = result.scalar_one_or_none()
+    if not entry:
+        return None
+
+    record = await asyncio.to_thread(read_record, entry.segment, entry.offset, entry.length)
+    return record["result"]
+
+
+async def run_archiver(interval: int = ARCHIVE_INTERVAL_SECONDS):
+    """Бесконечный цикл архивации (запускается задачей из bot.py)"""
+    while True:
+        try:
+            archived = await archive_completed_sessions()
+            if archived:
+                logger.info("Архивация: перенесено сессий %d", archived)
+        except Exception:
+            logger.exception("Ошибка архивации сессий")
+
+        await asyncio.sleep(interval)
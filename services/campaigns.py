@@ -0,0 +1,305 @@
+"""
+Еженедельные мини-тесты для подписчиков LoveBot+
+
+Планировщик выбирает из subscriptions пачку подписчиков, у которых наступил
+next_due_at (по частичному индексу, без загрузки всей таблицы), в одной
+транзакции записывает чекпоинты доставки и сдвигает расписание, затем
+отправляет мини-тесты через отдельную очередь с ограничением скорости.
+Если процесс упал между выборкой и отправкой, чекпоинты в статусе pending
+дорассылаются при следующем проходе. Доставка — «как минимум один раз»:
+после падения в момент отправки сообщение может прийти повторно.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import delete, select, true, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import (
+    CAMPAIGN_INTERVAL_DAYS,
+    CAMPAIGN_SEND_RATE,
+    CAMPAIGN_BATCH_SIZE,
+    CAMPAIGN_POLL_SECONDS,
+    CAMPAIGN_RESUME_AFTER_SECONDS,
+    CAMPAIGN_CHECKPOINT_RETENTION_DAYS,
+)
+from db.database import async_session_maker
+from db.models import Subscription, CampaignDelivery, DeliveryStatus
+from db.queries import dialect_insert
+from services.sender import OutboundSender
+from services.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+MINI_TEST_CALLBACK_PREFIX = "mini_"
+
+# Мини-тесты рассылаются по кругу: вопрос и короткий совет на каждый вариант ответа
+MINI_TESTS = [
+    {
+        "question": "Как вы чаще всего проводите вечер вместе?",
+        "options": [
+            ("🎬 Фильм или сериал", "Попробуйте раз в неделю заменить экран разговором о прошедшем дне — это сближает."),
+            ("🚶 Прогулка", "Отличная привычка! Во время прогулки легче обсуждать важные темы."),
+            ("📱 Каждый в своём телефоне", "Договоритесь о часе без гаджетов — даже 30 минут внимания друг к другу многое меняют."),
+        ],
+    },
+    {
+        "question": "Когда вы в последний раз говорили друг другу комплименты?",
+        "options": [
+            ("☀️ Сегодня", "Здорово! Слова поддержки — один из главных языков любви."),
+            ("📅 На этой неделе", "Хорошо. Попробуйте замечать мелочи: «мне нравится, как ты…»."),
+            ("🤔 Не помню", "Челлендж недели: один искренний комплимент партнёру каждый день."),
+        ],
+    },
+    {
+        "question": "Как вы решаете разногласия?",
+        "options": [
+            ("🗣 Сразу обсуждаем", "Важно не только говорить, но и пересказывать услышанное — так меньше недопонимания."),
+            ("⏳ Берём паузу", "Пауза полезна, если вы договорились, когда вернётесь к разговору."),
+            ("🙈 Избегаем темы", "Невысказанное копится. Начните с фразы «мне важно обсудить…» в спокойный момент."),
+        ],
+    },
+    {
+        "question": "Что вы планируете на ближайшие выходные?",
+        "options": [
+            ("🗺 Что-то новое вместе", "Новые впечатления укрепляют пару — вы на верном пути!"),
+            ("🏠 Отдохнуть дома", "Добавьте маленький ритуал: завтрак в постель или совместную готовку."),
+            ("🤷 Ещё не решили", "Составьте список из 5 идей и выберите одну вместе."),
+        ],
+    },
+]
+
+# Отдельная очередь для рассылок, чтобы они не отнимали лимит у ответов пользователям
+campaign_sender = OutboundSender(global_rate=CAMPAIGN_SEND_RATE)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def get_mini_test(number: int) -> dict:
+    """Мини-тест по порядковому номеру (нумерация с 1, по кругу)"""
+    return MINI_TESTS[(number - 1) % len(MINI_TESTS)]
+
+
+def build_mini_test_message(number: int) -> tuple[str, InlineKeyboardMarkup]:
+    """
+    Текст и клавиатура мини-теста
+
+    Args:
+        number: номер мини-теста у подписчика
+
+    Returns:
+        tuple: (текст, клавиатура с вариантами ответа)
+    """
+    mini_test = get_mini_test(number)
+    text = (
+        f"📅 **Еженедельный мини-тест LoveBot+ #{number}**\n\n"
+        f"{mini_test['question']}"
+    )
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=option, callback_data=f"{MINI_TEST_CALLBACK_PREFIX}{number}_{index}")]
+        for index, (option, _) in enumerate(mini_test["options"])
+    ])
+    return text, keyboard
+
+
+async def subscribe(session: AsyncSession, user_id: int):
+    """
+    Активация подписки: первый мини-тест через CAMPAIGN_INTERVAL_DAYS
+
+    Повторная покупка активной подписки не сдвигает расписание.
+    Коммит остаётся за вызывающим кодом.
+
+    Args:
+        session: сессия БД
+        user_id: Telegram ID подписчика
+    """
+    insert_stmt = dialect_insert(session, Subscription).values(
+        user_id=user_id,
+        is_active=True,
+        next_due_at=_utcnow() + timedelta(days=CAMPAIGN_INTERVAL_DAYS),
+    )
+    await session.execute(
+        insert_stmt.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={"is_active": True, "next_due_at": insert_stmt.excluded.next_due_at},
+            where=Subscription.is_active.is_(False),
+        )
+    )
+
+
+async def _claim_due_subscribers(batch_size: int) -> list[tuple[str, int, int]]:
+    """
+    Выбор пачки подписчиков с наступившим сроком и запись чекпоинтов
+
+    Returns:
+        list: (campaign, user_id, mini_test) для отправки
+    """
+    now = _utcnow()
+    is_due = (Subscription.is_active == true(), Subscription.next_due_at <= now)
+    due = (
+        select(Subscription.user_id)
+        .where(*is_due)
+        .order_by(Subscription.next_due_at)
+        .limit(batch_size)
+    )
+    async with async_session_maker() as session:
+        # Условие повторяется в UPDATE: из двух планировщиков подписчика сдвинет только один,
+        # и отправляет только тот, кому он вернулся
+        result = await session.execute(
+            update(Subscription)
+            .where(Subscription.user_id.in_(due), *is_due)
+            .values(
+                next_due_at=now + timedelta(days=CAMPAIGN_INTERVAL_DAYS),
+                tests_sent=Subscription.tests_sent + 1,
+            )
+            .returning(Subscription.user_id, Subscription.tests_sent)
+            .execution_options(synchronize_session=False)
+        )
+        claimed = result.all()
+        if not claimed:
+            await session.commit()
+            return []
+
+        deliveries = [
+            (f"weekly-{row.tests_sent}", row.user_id, row.tests_sent) for row in claimed
+        ]
+        await session.execute(
+            dialect_insert(session, CampaignDelivery)
+            .values([
+                {"campaign": campaign, "user_id": user_id, "mini_test": number,
+                 "status": DeliveryStatus.PENDING, "updated_at": now}
+                for campaign, user_id, number in deliveries
+            ])
+            .on_conflict_do_nothing()
+        )
+        await session.commit()
+    return deliveries
+
+
+async def _claim_stale_deliveries(batch_size: int) -> list[tuple[str, int, int]]:
+    """Чекпоинты pending, оставшиеся от прерванной рассылки"""
+    now = _utcnow()
+    stale = (
+        select(CampaignDelivery.campaign, CampaignDelivery.user_id)
+        .where(
+            CampaignDelivery.status == DeliveryStatus.PENDING,
+            CampaignDelivery.updated_at < now - timedelta(seconds=CAMPAIGN_RESUME_AFTER_SECONDS),
+        )
+        .limit(batch_size)
+    )
+    async with async_session_maker() as session:
+        # Обновляем updated_at, чтобы следующий проход не взял их повторно
+        result = await session.execute(
+            update(CampaignDelivery)
+            .where(tuple_(CampaignDelivery.campaign, CampaignDelivery.user_id).in_(stale))
+            .values(updated_at=now)
+            .returning(CampaignDelivery.campaign, CampaignDelivery.user_id, CampaignDelivery.mini_test)
+            .execution_options(synchronize_session=False)
+        )
+        deliveries = [tuple(row) for row in result.all()]
+        await session.commit()
+    return deliveries
+
+
+def _is_unreachable(error: Exception) -> bool:
+    """Ошибка означает, что пользователю больше нельзя писать (бот заблокирован, чат удалён)"""
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and "chat not found" in error.message.lower()
+
+
+async def _send_deliveries(bot: Bot, deliveries: list[tuple[str, int, int]]) -> int:
+    """Отправка пачки и запись итогов в чекпоинты; возвращает число доставленных"""
+    futures = []
+    for _, user_id, number in deliveries:
+        text, keyboard = build_mini_test_message(number)
+        futures.append(
+            campaign_sender.send_message(bot, user_id, text, parse_mode="Markdown", reply_markup=keyboard)
+        )
+    outcomes = await asyncio.gather(*futures, return_exceptions=True)
+
+    sent, failed, unreachable = [], [], []
+    for (campaign, user_id, _), outcome in zip(deliveries, outcomes):
+        if not isinstance(outcome, Exception):
+            sent.append((campaign, user_id))
+        elif isinstance(outcome, (TelegramForbiddenError, TelegramBadRequest)):
+            failed.append((campaign, user_id))
+            # Ошибка в самом сообщении (разметка, длина) не повод отключать платную подписку
+            if _is_unreachable(outcome):
+                unreachable.append(user_id)
+        # Прочие ошибки (сеть, исчерпанный RetryAfter) оставляют чекпоинт pending до следующего прохода
+
+    async with async_session_maker() as session:
+        for status, keys in ((DeliveryStatus.SENT, sent), (DeliveryStatus.FAILED, failed)):
+            if keys:
+                await session.execute(
+                    update(CampaignDelivery)
+                    .where(tuple_(CampaignDelivery.campaign, CampaignDelivery.user_id).in_(keys))
+                    .values(status=status)
+                    .execution_options(synchronize_session=False)
+                )
+        if unreachable:
+            # Пользователь заблокировал бота — не тратим на него рассылки
+            await session.execute(
+                update(Subscription).where(Subscription.user_id.in_(unreachable)).values(is_active=False)
+            )
+        await session.commit()
+    return len(sent)
+
+
+async def purge_delivery_checkpoints(retention_days: int = CAMPAIGN_CHECKPOINT_RETENTION_DAYS) -> int:
+    """Удаление завершённых чекпоинтов старше retention_days"""
+    async with async_session_maker() as session:
+        result = await session.execute(
+            delete(CampaignDelivery).where(
+                CampaignDelivery.status != DeliveryStatus.PENDING,
+                CampaignDelivery.updated_at < _utcnow() - timedelta(days=retention_days),
+            )
+        )
+        await session.commit()
+    return result.rowcount
+
+
+@traced("campaigns.round")
+async def run_campaign_round(bot: Bot, batch_size: int = CAMPAIGN_BATCH_SIZE) -> int:
+    """
+    Один проход планировщика: дорассылка прерванного, затем всё, у чего наступил срок
+
+    Args:
+        bot: бот для отправки
+        batch_size: подписчиков в одной пачке
+
+    Returns:
+        int: сколько мини-тестов доставлено
+    """
+    delivered = 0
+    for claim in (_claim_stale_deliveries, _claim_due_subscribers):
+        while True:
+            deliveries = await claim(batch_size)
+            if not deliveries:
+                break
+            delivered += await _send_deliveries(bot, deliveries)
+            if len(deliveries) < batch_size:
+                break
+    return delivered
+
+
+async def run_campaign_scheduler(bot: Bot, interval: int = CAMPAIGN_POLL_SECONDS):
+    """Бесконечный цикл рассылки мини-тестов (запускается задачей из bot.py)"""
+    while True:
+        try:
+            delivered = await run_campaign_round(bot)
+            if delivered:
+                logger.info("Мини-тесты: доставлено %d, метрики %s", delivered, campaign_sender.stats())
+            await purge_delivery_checkpoints()
+        except Exception:
+            logger.exception("Ошибка рассылки мини-тестов")
+
+        await asyncio.sleep(interval)
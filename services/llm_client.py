@@ -0,0 +1,195 @@
+"""
+Устойчивый клиент OpenAI
+
+Все запросы к модели идут через модульный llm:
+- не больше OPENAI_CONCURRENCY одновременных запросов (остальные ждут в очереди);
+- у каждой попытки свой дедлайн OPENAI_TIMEOUT (вместе с чтением потока);
+- 429, 5xx, таймауты и сетевые ошибки повторяются с экспоненциальной
+  задержкой со случайным разбросом (full jitter), Retry-After учитывается;
+- после OPENAI_BREAKER_THRESHOLD неудачных вызовов подряд предохранитель
+  размыкается на OPENAI_BREAKER_COOLDOWN секунд: вызовы сразу получают
+  CircuitOpenError, а не копятся в очереди, пока провайдер недоступен.
+  Затем пропускается один пробный вызов.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, TypeVar
+
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_CONCURRENCY,
+    OPENAI_TIMEOUT,
+    OPENAI_MAX_RETRIES,
+    OPENAI_BREAKER_THRESHOLD,
+    OPENAI_BREAKER_COOLDOWN,
+)
+from services.metrics import OPENAI_RETRIES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError, APITimeoutError, TimeoutError)
+_BACKOFF_BASE = 1.0
+_BACKOFF_CAP = 30.0
+
+
+class CircuitOpenError(Exception):
+    """Предохранитель разомкнут: провайдер считается недоступным"""
+
+
+class CircuitBreaker:
+    """Предохранитель: closed → open после серии ошибок → half-open (один пробный вызов)"""
+
+    def __init__(self, threshold: int = OPENAI_BREAKER_THRESHOLD, cooldown: float = OPENAI_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """Можно ли выполнять вызов (в half-open — только один одновременно)"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def cancel_probe(self):
+        """Пробный вызов отменён, не дойдя до результата — следующий вызов снова может стать пробным"""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.threshold:
+            if self.opened_at is None or self._probing:
+                logger.warning("OpenAI недоступен, предохранитель разомкнут на %s с", self.cooldown)
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+class ResilientLLMClient:
+    """AsyncOpenAI с ограничением параллельности, дедлайнами, повторами и предохранителем"""
+
+    def __init__(
+        self,
+        concurrency: int = OPENAI_CONCURRENCY,
+        timeout: float = OPENAI_TIMEOUT,
+        max_retries: int = OPENAI_MAX_RETRIES
+    ):
+        # Повторы делаем сами (с джиттером и предохранителем), встроенные в SDK выключены
+        self.openai = AsyncOpenAI(
+            api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, timeout=timeout, max_retries=0
+        )
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.slots = asyncio.Semaphore(concurrency)
+        self.breaker = CircuitBreaker()
+        self.waiting = 0
+
+    async def call(self, operation: Callable[[AsyncOpenAI], Awaitable[T]]) -> T:
+        """
+        Выполнить запрос к OpenAI с повторами
+
+        Args:
+            operation: корутина-функция, выполняющая одну попытку через переданный
+                AsyncOpenAI (для потокового ответа — вместе с чтением потока)
+
+        Returns:
+            результат operation
+
+        Raises:
+            CircuitOpenError: предохранитель разомкнут
+            openai.APIError, TimeoutError: попытки исчерпаны или ошибка не повторяемая
+        """
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError("OpenAI временно недоступен")
+            try:
+                self.waiting += 1
+                try:
+                    await self.slots.acquire()
+                finally:
+                    self.waiting -= 1
+                try:
+                    async with asyncio.timeout(self.timeout):
+                        result = await operation(self.openai)
+                finally:
+                    self.slots.release()
+            except _RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    self.breaker.record_failure()
+                    raise
+                # Пробный вызов half-open не повторяем: ошибка снова размыкает предохранитель
+                if self.breaker.state != "closed":
+                    self.breaker.record_failure()
+                    raise
+                delay = self._backoff(attempt, e)
+                OPENAI_RETRIES.inc(type(e).__name__)
+                logger.warning("Ошибка OpenAI (%s), повтор через %.1f с", type(e).__name__, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+            except asyncio.CancelledError:
+                self.breaker.cancel_probe()
+                raise
+            except Exception:
+                # Ошибка запроса (400 и т.п.): провайдер отвечает, для предохранителя это не сбой
+                self.breaker.record_success()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    def stats(self) -> dict:
+        """Состояние клиента (для /metrics)"""
+        return {
+            "waiting": self.waiting,
+            "breaker_open": int(self.breaker.state != "closed"),
+            "consecutive_failures": self.breaker.failures,
+        }
+
+    @staticmethod
+    def _backoff(attempt: int, error: Exception) -> float:
+        """Задержка перед повтором: full jitter, но не меньше Retry-After"""
+        delay = random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(_BACKOFF_CAP, float(retry_after)))
+            except ValueError:
+                pass
+        return delay
+
+
+# Клиент процесса
+llm = ResilientLLMClient()
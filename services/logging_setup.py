@@ -0,0 +1,124 @@
+"""
+Неблокирующее структурированное логирование
+
+Обработчики логов в event loop только кладут запись в ограниченную очередь
+(QueueHandler), а запись в поток вывода делает отдельный поток QueueListener.
+При переполнении очереди записи отбрасываются и считаются, а не ждут.
+
+Каждая запись получает update_id, user_id и session_id текущего апдейта
+(contextvars, заполняются LogContextMiddleware и bind_log_context) и trace_id
+из services.tracing, поэтому логи одного апдейта можно собрать по ID.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import queue
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, DB_ECHO
+from services.tracing import current_span
+
+update_id_var: ContextVar[int | None] = ContextVar("log_update_id", default=None)
+user_id_var: ContextVar[int | None] = ContextVar("log_user_id", default=None)
+session_id_var: ContextVar[int | None] = ContextVar("log_session_id", default=None)
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+def bind_log_context(session_id: int | None = None):
+    """Добавить ID сессии к логам текущего апдейта"""
+    if session_id is not None:
+        session_id_var.set(session_id)
+
+
+class ContextFilter(logging.Filter):
+    """Копирует контекст апдейта в запись (выполняется в потоке, который пишет лог)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = update_id_var.get()
+        record.user_id = user_id_var.get()
+        record.session_id = session_id_var.get()
+        span = current_span()
+        record.trace_id = span.trace_id if span is not None and span.sampled else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("update_id", "user_id", "session_id", "trace_id"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который при переполнении очереди отбрасывает запись"""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Стандартный prepare форматирует запись целиком в потоке event loop;
+        # здесь только подставляем аргументы, а traceback форматирует поток-писатель
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def logging_stats() -> dict:
+    """Счётчики логирования (для /metrics)"""
+    return {"dropped": DroppingQueueHandler.dropped}
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT) -> QueueListener:
+    """
+    Настройка логирования через очередь и поток-писатель
+
+    Args:
+        level: уровень корневого логгера (INFO, DEBUG, ...)
+        log_format: json — структурированные логи, text — для локальной разработки
+
+    Returns:
+        QueueListener: запущенный поток записи (останавливается при выходе)
+    """
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    # SQL-эхо идёт через ту же очередь (echo=True у движка писал бы в stdout напрямую)
+    if DB_ECHO:
+        logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
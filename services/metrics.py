@@ -0,0 +1,203 @@
+"""
+Метрики бота в формате Prometheus
+
+Счётчики и гистограммы без блокировок: всё обновляется из потока event loop
+(в т.ч. события SQLAlchemy при async-движке), а инкремент в Python — одна
+операция под GIL. Гистограмма хранит кумулятивные бакеты только при выводе;
+при записи увеличивается один бакет, найденный bisect'ом.
+
+Отдаются по HTTP на METRICS_HOST:METRICS_PORT/metrics (см. start_metrics_server).
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import ContextDecorator
+from typing import Callable, Iterable
+
+from aiohttp import web
+
+from config import METRICS_HOST, METRICS_PORT
+
+# Границы бакетов по умолчанию (секунды): от 1 мс до 60 с
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics: list = []
+_collectors: dict[str, Callable[[], dict]] = {}
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Монотонный счётчик (опционально с метками)"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        _metrics.append(self)
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class _Timer(ContextDecorator):
+    """with histogram.time(...) / @histogram.time(...)"""
+
+    def __init__(self, histogram: "Histogram", labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class Histogram:
+    """Гистограмма длительностей (опционально с метками)"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # метки → [счётчики по бакетам (+Inf последним), сумма, количество]
+        self._series: dict[tuple, list] = {}
+        _metrics.append(self)
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels: str) -> _Timer:
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+def register_collector(prefix: str, collect: Callable[[], dict]):
+    """
+    Подключить числовые показатели компонента (например, sender.stats) как gauge
+
+    Args:
+        prefix: префикс имён, например lovebot_sender
+        collect: функция, возвращающая {имя: число}
+    """
+    _collectors[prefix] = collect
+
+
+def render_metrics() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for prefix, collect in _collectors.items():
+        for key, value in collect().items():
+            if isinstance(value, (int, float)):
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """GET /metrics"""
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> web.AppRunner | None:
+    """
+    Запуск локального HTTP-сервера с /metrics
+
+    Args:
+        port: порт (0 — не запускать)
+        host: адрес (по умолчанию только localhost)
+
+    Returns:
+        web.AppRunner | None: runner для остановки (runner.cleanup())
+    """
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+# Метрики бота
+HANDLER_SECONDS = Histogram(
+    "lovebot_handler_duration_seconds", "Время работы обработчика", ("handler",)
+)
+HANDLER_ERRORS = Counter(
+    "lovebot_handler_errors_total", "Исключения в обработчиках", ("handler",)
+)
+DB_QUERY_SECONDS = Histogram(
+    "lovebot_db_query_duration_seconds", "Время выполнения SQL-запроса", ("statement",)
+)
+OPENAI_SECONDS = Histogram(
+    "lovebot_openai_request_duration_seconds", "Время запроса к OpenAI", ("outcome",)
+)
+OPENAI_FIRST_TOKEN_SECONDS = Histogram(
+    "lovebot_openai_first_token_seconds", "Время до первого фрагмента потокового ответа OpenAI"
+)
+OPENAI_RETRIES = Counter(
+    "lovebot_openai_retries_total", "Повторы запросов к OpenAI", ("error",)
+)
+OPENAI_TOKENS = Counter(
+    "lovebot_openai_tokens_total", "Токены OpenAI", ("kind",)
+)
+REPORT_CACHE_LOOKUPS = Counter(
+    "lovebot_report_cache_lookups_total", "Обращения к кэшу отчётов", ("result",)
+)
+ANALYSIS_JOB_WAIT_SECONDS = Histogram(
+    "lovebot_analysis_job_wait_seconds", "Время от постановки задачи анализа до начала выполнения"
+)
+ANALYSIS_JOB_SECONDS = Histogram(
+    "lovebot_analysis_job_duration_seconds", "Время выполнения задачи анализа"
+)
+PDF_RENDER_SECONDS = Histogram(
+    "lovebot_pdf_render_duration_seconds", "Время генерации PDF-отчёта"
+)
+TELEGRAM_SECONDS = Histogram(
+    "lovebot_telegram_request_duration_seconds", "Время запроса к Bot API", ("method",)
+)
+TELEGRAM_ERRORS = Counter(
+    "lovebot_telegram_errors_total", "Ошибки запросов к Bot API", ("method",)
+)
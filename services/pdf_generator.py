@@ -6,6 +6,9 @@ from fpdf import FPDF
 from datetime import datetime
 import os
 
+from services.metrics import PDF_RENDER_SECONDS
+from services.tracing import traced
+
 
 class PDF(FPDF):
     def header(self):
@@ -22,6 +25,8 @@ class PDF(FPDF):
         self.cell(0, 10, f'Created: {datetime.now().strftime("%d.%m.%Y %H:%M")}', align='C')
 
 
+@traced("pdf.render")
+@PDF_RENDER_SECONDS.time()
 def generate_pdf_report(
     compatibility_score: int,
     report: str,
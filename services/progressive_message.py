@@ -0,0 +1,94 @@
+"""
+Сообщение, которое дописывается по мере генерации отчёта
+
+Текст обновляется часто (каждый фрагмент потока OpenAI), а правки в
+Telegram уходят не чаще STREAM_EDIT_INTERVAL: промежуточные версии
+объединяются, и отправляется только последняя. Правки идут через очередь
+отправки (services.sender), поэтому учитывают и её лимит на чат.
+"""
+
+import asyncio
+import time
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.methods import EditMessageText
+
+from config import STREAM_EDIT_INTERVAL
+from services.sender import sender
+
+
+class ProgressiveMessage:
+    """Правки одного сообщения с объединением и ограничением частоты"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        chat_id: int,
+        message_id: int,
+        text: str | None = None,
+        interval: float = STREAM_EDIT_INTERVAL
+    ):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self._latest = text
+        self._shown = text
+        self._last_edit = 0.0
+        self._task: asyncio.Task | None = None
+        self._closed = False
+
+    def update(self, text: str):
+        """Новый текст сообщения (правка уйдёт, когда позволит лимит)"""
+        if self._closed:
+            return
+        self._latest = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def finish(self, text: str, **kwargs: Any) -> bool:
+        """
+        Последняя правка — обычно готовый результат с разметкой и кнопками
+
+        Args:
+            text: итоговый текст
+            **kwargs: аргументы EditMessageText (parse_mode, reply_markup, ...)
+
+        Returns:
+            bool: удалось ли отредактировать сообщение
+        """
+        self._closed = True
+        if self._task is not None:
+            await self._task
+        try:
+            await self._edit(text, **kwargs)
+        except TelegramAPIError:
+            return False
+        return True
+
+    async def _flush(self):
+        while not self._closed and self._latest != self._shown:
+            delay = self._last_edit + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                if self._closed:
+                    return
+            text = self._latest
+            try:
+                await self._edit(text)
+            except TelegramAPIError:
+                # Ошибка залогирована очередью; промежуточные правки больше не шлём
+                self._closed = True
+                return
+            self._shown = text
+
+    async def _edit(self, text: str, **kwargs: Any):
+        self._last_edit = time.monotonic()
+        await sender.enqueue(self.bot, EditMessageText(
+            chat_id=self.chat_id,
+            message_id=self.message_id,
+            text=text,
+            **kwargs,
+        ))
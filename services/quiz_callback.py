@@ -0,0 +1,81 @@
+"""
+Stateless-режим теста: прогресс хранится прямо в callback_data кнопок
+
+Формат: q:<session_id>:<ответы>:<подпись>, где session_id и упакованные
+ответы (services.answer_codec) записаны в base36, а подпись — обрезанный
+HMAC-SHA256 от session_id, ответов и Telegram ID пользователя. Подпись
+не даёт подделать ответы или нажать чужую кнопку. Вся строка укладывается
+в лимит Telegram в 64 байта.
+"""
+
+import base64
+import hashlib
+import hmac
+
+from config import QUIZ_CALLBACK_SECRET
+
+CALLBACK_PREFIX = "q:"
+CALLBACK_DATA_LIMIT = 64  # байт, ограничение Telegram
+_MAC_LENGTH = 12  # символов base64url — 72 бита подписи
+
+_BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _to_base36(value: int) -> str:
+    if value == 0:
+        return "0"
+    digits = []
+    while value:
+        value, remainder = divmod(value, 36)
+        digits.append(_BASE36_DIGITS[remainder])
+    return "".join(reversed(digits))
+
+
+def _sign(session_id: int, answers_packed: int, user_id: int) -> str:
+    message = f"{session_id}:{answers_packed}:{user_id}".encode("ascii")
+    digest = hmac.new(QUIZ_CALLBACK_SECRET.encode("utf-8"), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii")[:_MAC_LENGTH]
+
+
+def encode_quiz_callback(session_id: int, answers_packed: int, user_id: int) -> str:
+    """
+    callback_data для кнопки ответа
+
+    Args:
+        session_id: ID сессии
+        answers_packed: ответы с учётом выбора на этой кнопке
+        user_id: Telegram ID пользователя, для которого создана кнопка
+
+    Returns:
+        str: подписанная строка не длиннее 64 байт
+    """
+    data = (
+        f"{CALLBACK_PREFIX}{_to_base36(session_id)}:{_to_base36(answers_packed)}:"
+        f"{_sign(session_id, answers_packed, user_id)}"
+    )
+    if len(data.encode("ascii")) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {data}")
+    return data
+
+
+def decode_quiz_callback(data: str, user_id: int) -> tuple[int, int] | None:
+    """
+    Проверка подписи и разбор callback_data
+
+    Args:
+        data: callback_data нажатой кнопки
+        user_id: Telegram ID нажавшего пользователя
+
+    Returns:
+        tuple | None: (session_id, answers_packed) или None, если данные подделаны
+    """
+    try:
+        _, session_part, answers_part, mac = data.split(":")
+        session_id = int(session_part, 36)
+        answers_packed = int(answers_part, 36)
+    except ValueError:
+        return None
+
+    if not hmac.compare_digest(mac, _sign(session_id, answers_packed, user_id)):
+        return None
+    return session_id, answers_packed
@@ -0,0 +1,90 @@
+"""
+Фоновая очистка истёкших сессий
+"""
+
+import asyncio
+import logging
+
+from sqlalchemy import delete, select
+
+from config import (
+    MAX_SESSION_LIFETIME_HOURS,
+    REAPER_INTERVAL_SECONDS,
+    REAPER_BATCH_SIZE,
+    REAPER_BATCH_PAUSE_SECONDS,
+)
+from db.database import async_session_maker
+from db.models import Session as DBSession, SessionStatus, Answer
+from services.tracing import traced
+from services.utils import session_expiry_cutoff
+
+logger = logging.getLogger(__name__)
+
+# Сессии, к которым так и не присоединился второй партнёр
+EXPIRABLE_STATUSES = (SessionStatus.PENDING, SessionStatus.QUICK_CHECK)
+
+
+@traced("reaper.run")
+async def reap_expired_sessions(
+    max_hours: int = MAX_SESSION_LIFETIME_HOURS,
+    batch_size: int = REAPER_BATCH_SIZE
+) -> tuple[int, int]:
+    """
+    Удаление истёкших сессий и их ответов небольшими пачками
+
+    Каждая пачка — отдельная короткая транзакция, между пачками делается пауза,
+    чтобы не держать блокировку записи SQLite и не мешать обработчикам.
+
+    Args:
+        max_hours: время жизни сессии в часах
+        batch_size: сколько сессий удалять за одну транзакцию
+
+    Returns:
+        tuple: (удалено сессий, удалено ответов)
+    """
+    cutoff = session_expiry_cutoff(max_hours)
+    removed_sessions = 0
+    removed_answers = 0
+
+    while True:
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(DBSession.id).where(
+                    DBSession.status.in_(EXPIRABLE_STATUSES),
+                    DBSession.created_at < cutoff
+                ).limit(batch_size)
+            )
+            session_ids = result.scalars().all()
+            if not session_ids:
+                break
+
+            result = await session.execute(
+                delete(Answer).where(Answer.session_id.in_(session_ids))
+            )
+            removed_answers += result.rowcount
+            result = await session.execute(
+                delete(DBSession).where(DBSession.id.in_(session_ids))
+            )
+            removed_sessions += result.rowcount
+            await session.commit()
+
+        if len(session_ids) < batch_size:
+            break
+        await asyncio.sleep(REAPER_BATCH_PAUSE_SECONDS)
+
+    return removed_sessions, removed_answers
+
+
+async def run_session_reaper(interval: int = REAPER_INTERVAL_SECONDS):
+    """Бесконечный цикл очистки (запускается задачей из bot.py)"""
+    while True:
+        try:
+            removed_sessions, removed_answers = await reap_expired_sessions()
+            if removed_sessions or removed_answers:
+                logger.info(
+                    "Очистка: удалено сессий %d, ответов %d", removed_sessions, removed_answers
+                )
+        except Exception:
+            logger.exception("Ошибка фоновой очистки сессий")
+
+        await asyncio.sleep(interval)
@@ -0,0 +1,100 @@
+"""
+Перегенерация базовых отчётов
+
+Если OpenAI был недоступен, пара получает базовый отчёт, а результат
+помечается is_provisional. Фоновая задача периодически берёт такие
+результаты, генерирует полный отчёт, подменяет его в results и сообщает
+партнёрам, что подробный отчёт готов.
+"""
+
+import asyncio
+import logging
+
+from aiogram import Bot
+from sqlalchemy import select, true, update
+
+from config import REGENERATE_INTERVAL_SECONDS, REGENERATE_BATCH_SIZE
+from db.database import async_session_maker
+from db.models import Session as DBSession, Result
+from services.analyzer import analyze
+from services.archive import delete_unreferenced_reports
+from services.llm_client import llm
+from services.report_store import store_report
+from services.sender import sender
+from services.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+REPORT_READY_TEXT = "✨ Подробный отчёт о вашей совместимости готов! Посмотреть: /results"
+
+
+@traced("regenerator.run")
+async def regenerate_provisional_reports(bot: Bot, batch_size: int = REGENERATE_BATCH_SIZE) -> int:
+    """
+    Замена базовых отчётов полными
+
+    Args:
+        bot: бот для уведомления партнёров
+        batch_size: сколько результатов обработать за проход
+
+    Returns:
+        int: сколько отчётов заменено
+    """
+    # Пока предохранитель разомкнут, не тратим попытки
+    if llm.breaker.state == "open":
+        return 0
+
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(
+                Result.id,
+                Result.answers1_packed,
+                Result.answers2_packed,
+                Result.report_hash,
+                DBSession.partner1_user_id,
+                DBSession.partner2_user_id,
+            )
+            .join(DBSession, DBSession.id == Result.session_id)
+            .where(Result.is_provisional == true())
+            .order_by(Result.created_at)
+            .limit(batch_size)
+        )
+        rows = result.all()
+
+    regenerated = 0
+    for result_id, answers1, answers2, old_hash, partner1_id, partner2_id in rows:
+        _, report, is_provisional = await analyze(answers1, answers2)
+        if is_provisional:
+            # OpenAI всё ещё недоступен — остальные попробуем в следующий раз
+            break
+
+        async with async_session_maker() as session:
+            blob = await store_report(session, report)
+            updated = await session.execute(
+                update(Result)
+                .where(Result.id == result_id, Result.is_provisional == true())
+                .values(report_hash=blob.hash, is_provisional=False)
+            )
+            await delete_unreferenced_reports(session, {old_hash})
+            await session.commit()
+        if not updated.rowcount:
+            continue
+
+        regenerated += 1
+        for user_id in {partner1_id, partner2_id} - {None}:
+            sender.send_message(bot, user_id, REPORT_READY_TEXT)
+
+    return regenerated
+
+
+async def run_report_regenerator(bot: Bot, interval: int = REGENERATE_INTERVAL_SECONDS):
+    """Бесконечный цикл перегенерации (запускается задачей из bot.py)"""
+    while True:
+        try:
+            regenerated = await regenerate_provisional_reports(bot)
+            if regenerated:
+                logger.info("Перегенерировано базовых отчётов: %d", regenerated)
+        except Exception:
+            logger.exception("Ошибка перегенерации отчётов")
+
+        await asyncio.sleep(interval)
@@ -0,0 +1,157 @@
+"""
+Кэш AI-отчётов по паре векторов ответов
+
+При пяти вопросах возможных векторов ответов всего 3125, поэтому одинаковые
+пары встречаются часто. Ключ — версия промпта и упорядоченная пара
+(меньший вектор, больший вектор): отчёт пишется для пары в этом порядке, а
+для пары в обратном порядке в тексте меняются местами «Партнёр 1» и «Партнёр 2».
+
+Два уровня: LRU в памяти процесса и таблица report_cache в БД, которая
+ссылается на отчёты в report_blobs (общее хранилище с результатами).
+На пару хранится до REPORT_CACHE_VARIANTS вариантов: пока их меньше, отчёт
+генерируется заново, дальше отдаётся случайный из готовых.
+"""
+
+import random
+import re
+from collections import OrderedDict
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import REPORT_CACHE_SIZE, REPORT_CACHE_VARIANTS
+from db.database import async_session_maker
+from db.models import ReportBlob, ReportCacheEntry
+from db.queries import dialect_insert
+from services.metrics import REPORT_CACHE_LOOKUPS
+from services.report_store import decompress_report, store_report
+
+_PARTNER_LABEL = re.compile(r"([Пп]артн[её]р\w*)(\s+)([12])\b")
+
+
+def cache_key(packed1: int, packed2: int) -> tuple[int, int, bool]:
+    """
+    Нормализация пары ответов
+
+    Returns:
+        tuple: (меньший вектор, больший вектор, поменялся ли порядок)
+    """
+    if packed1 <= packed2:
+        return packed1, packed2, False
+    return packed2, packed1, True
+
+
+def swap_partner_labels(report: str) -> str:
+    """Поменять местами «Партнёр 1» и «Партнёр 2» (в любом падеже) в тексте отчёта"""
+    return _PARTNER_LABEL.sub(
+        lambda match: f"{match[1]}{match[2]}{'2' if match[3] == '1' else '1'}", report
+    )
+
+
+class ReportCache:
+    """Двухуровневый кэш отчётов: LRU в памяти и report_cache в БД"""
+
+    def __init__(self, variants: int = REPORT_CACHE_VARIANTS, max_size: int = REPORT_CACHE_SIZE):
+        self.variants = variants
+        self.max_size = max_size
+        # (версия, меньший вектор, больший вектор) → сохранённые варианты отчёта
+        self._lru: OrderedDict[tuple, list[str]] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.variants > 0
+
+    async def get(self, prompt_version: str, low: int, high: int) -> tuple[str | None, bool]:
+        """
+        Отчёт для упорядоченной пары
+
+        Args:
+            prompt_version: версия промпта анализа
+            low: меньший вектор ответов
+            high: больший вектор ответов
+
+        Returns:
+            tuple: (случайный сохранённый вариант или None, нужно ли сгенерировать ещё вариант)
+        """
+        key = (prompt_version, low, high)
+        reports = self._lru.get(key)
+        if reports is not None:
+            self._lru.move_to_end(key)
+            result = "memory_hit"
+        else:
+            async with async_session_maker() as session:
+                reports = await self._load(session, prompt_version, low, high)
+            if reports:
+                self._remember(key, reports)
+            result = "db_hit" if reports else "miss"
+
+        needs_variant = len(reports) < self.variants
+        if needs_variant:
+            result = "miss"
+        REPORT_CACHE_LOOKUPS.inc(result)
+        return (random.choice(reports) if reports else None), needs_variant
+
+    async def put(self, prompt_version: str, low: int, high: int, report: str):
+        """
+        Сохранить новый вариант отчёта для упорядоченной пары
+
+        Номер варианта берётся из снимка, который мог устареть (параллельный put
+        в этом или другом процессе). Если такой вариант уже записан, вставка
+        ничего не делает, и LRU перечитывается из БД, а не дополняется отчётом,
+        которого в report_cache нет.
+        """
+        key = (prompt_version, low, high)
+        async with async_session_maker() as session:
+            blob = await store_report(session, report)
+            reports = self._lru.get(key)
+            if reports is None:
+                reports = await self._load(session, prompt_version, low, high)
+            if len(reports) >= self.variants:
+                return
+            result = await session.execute(
+                dialect_insert(session, ReportCacheEntry)
+                .values(
+                    prompt_version=prompt_version,
+                    answers_low=low,
+                    answers_high=high,
+                    variant=len(reports),
+                    report_hash=blob.hash,
+                )
+                .on_conflict_do_nothing()
+                .returning(ReportCacheEntry.variant)
+            )
+            inserted = result.scalar_one_or_none() is not None
+            await session.commit()
+            if inserted:
+                reports = reports + [report]
+            else:
+                reports = await self._load(session, prompt_version, low, high)
+        self._remember(key, reports)
+
+    def stats(self) -> dict:
+        """Размер кэша в памяти (для /metrics)"""
+        return {"memory_entries": len(self._lru)}
+
+    def _remember(self, key: tuple, reports: list[str]):
+        self._lru[key] = reports
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    @staticmethod
+    async def _load(session: AsyncSession, prompt_version: str, low: int, high: int) -> list[str]:
+        result = await session.execute(
+            select(ReportBlob.data)
+            .join(ReportCacheEntry, ReportCacheEntry.report_hash == ReportBlob.hash)
+            .where(
+                ReportCacheEntry.prompt_version == prompt_version,
+                ReportCacheEntry.answers_low == low,
+                ReportCacheEntry.answers_high == high,
+            )
+            .order_by(ReportCacheEntry.variant)
+        )
+        return [decompress_report(data) for data in result.scalars()]
+
+
+# Кэш процесса
+report_cache = ReportCache()
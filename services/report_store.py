@@ -0,0 +1,87 @@
+"""
+Хранилище отчётов AI
+
+Каждый отчёт хранится один раз: ключ — sha256 от текста, содержимое
+сжато zlib, а бесплатное превью считается при записи и лежит рядом,
+чтобы /results не приходилось читать и распаковывать полный текст.
+"""
+
+import hashlib
+import zlib
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import FREE_REPORT_LIMIT, REPORT_COMPRESSION_LEVEL
+from db.models import ReportBlob
+from db.queries import dialect_insert
+
+
+def report_hash(report: str) -> str:
+    """Хэш содержимого отчёта (ключ в report_blobs)"""
+    return hashlib.sha256(report.encode("utf-8")).hexdigest()
+
+
+def compress_report(report: str) -> bytes:
+    """Сжатие текста отчёта"""
+    return zlib.compress(report.encode("utf-8"), REPORT_COMPRESSION_LEVEL)
+
+
+def decompress_report(data: bytes) -> str:
+    """Распаковка текста отчёта"""
+    return zlib.decompress(data).decode("utf-8")
+
+
+def build_report_blob(report: str) -> ReportBlob:
+    """
+    Подготовка записи хранилища для отчёта
+
+    Args:
+        report: полный текст отчёта
+
+    Returns:
+        ReportBlob: объект с хэшем, сжатым текстом и превью (ещё не сохранён)
+    """
+    return ReportBlob(
+        hash=report_hash(report),
+        data=compress_report(report),
+        preview=report[:FREE_REPORT_LIMIT],
+        size=len(report),
+    )
+
+
+async def store_report(session: AsyncSession, report: str) -> ReportBlob:
+    """
+    Сохранение отчёта (повторная запись того же текста ничего не делает)
+
+    Args:
+        session: сессия БД (коммит остаётся за вызывающим кодом)
+        report: полный текст отчёта
+
+    Returns:
+        ReportBlob: запись хранилища; Result ссылается на неё через report_hash
+    """
+    blob = build_report_blob(report)
+    await session.execute(
+        dialect_insert(session, ReportBlob)
+        .values(hash=blob.hash, data=blob.data, preview=blob.preview, size=blob.size)
+        .on_conflict_do_nothing(index_elements=["hash"])
+    )
+    return blob
+
+
+async def load_report(session: AsyncSession, report_hash_value: str) -> str:
+    """
+    Загрузка полного текста отчёта
+
+    Args:
+        session: сессия БД
+        report_hash_value: хэш отчёта (Result.report_hash)
+
+    Returns:
+        str: полный текст отчёта
+    """
+    result = await session.execute(
+        select(ReportBlob.data).where(ReportBlob.hash == report_hash_value)
+    )
+    return decompress_report(result.scalar_one())
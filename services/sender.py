@@ -0,0 +1,216 @@
+"""
+Очередь исходящих сообщений Telegram
+
+Все рассылки бота (результаты анализа, уведомления партнёру) идут через
+модульный sender: он соблюдает общий лимит Bot API (~30 сообщений/с) и лимит
+на чат, выполняет отправки в разные чаты параллельно, сохраняя порядок внутри
+чата, и выдерживает паузу из TelegramRetryAfter перед повтором. Обработчик
+ставит сообщение в очередь и получает Future, который можно не ждать.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import SendMessage, TelegramMethod
+
+from config import (
+    SENDER_GLOBAL_RATE,
+    SENDER_CHAT_RATE,
+    SENDER_CHAT_BURST,
+    SENDER_CONCURRENCY,
+    SENDER_MAX_RETRIES,
+)
+from services.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+# Корзины чатов, к которым не обращались дольше этого, удаляются
+_CHAT_BUCKET_IDLE_SECONDS = 300
+
+
+class TokenBucket:
+    """
+    Token bucket с резервированием
+
+    Токен забирается сразу, даже в долг: reserve() возвращает, сколько нужно
+    подождать, поэтому ожидающие получают токены в порядке обращения.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """Забрать токен и вернуть задержку (в секундах) перед его использованием"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def refund(self):
+        """Вернуть токен, взятый reserve(), если он не понадобился"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def pause(self, seconds: float):
+        """Запретить выдачу токенов на seconds секунд (RetryAfter)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle_since(self, now: float) -> float:
+        return now - max(self.updated, self.blocked_until)
+
+
+class OutboundSender:
+    """Очередь отправки с общим лимитом, лимитом на чат и повторами"""
+
+    def __init__(
+        self,
+        global_rate: float = SENDER_GLOBAL_RATE,
+        chat_rate: float = SENDER_CHAT_RATE,
+        chat_burst: float = SENDER_CHAT_BURST,
+        concurrency: int = SENDER_CONCURRENCY,
+        max_retries: int = SENDER_MAX_RETRIES
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.slots = asyncio.Semaphore(concurrency)
+
+        self._chat_buckets: dict[int | str, TokenBucket] = {}
+        # Последняя задача отправки в каждый чат — следующая ждёт её завершения
+        self._tails: dict[int | str, asyncio.Task] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._last_cleanup = time.monotonic()
+
+        self.metrics = {
+            "enqueued": 0,
+            "sent": 0,
+            "failed": 0,
+            "retry_after": 0,
+            "retried": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+        }
+
+    def set_global_rate(self, rate: float):
+        """Изменить общий лимит (supervisor делит его между воркерами)"""
+        self.global_bucket = TokenBucket(rate, rate)
+
+    def enqueue(self, bot: Bot, method: TelegramMethod) -> asyncio.Future:
+        """
+        Поставить вызов Bot API в очередь
+
+        Args:
+            bot: бот, от имени которого отправлять
+            method: метод Bot API с chat_id (SendMessage, SendDocument, ...)
+
+        Returns:
+            asyncio.Future: результат вызова; ошибка отправки логируется,
+                поэтому Future можно не ждать
+        """
+        chat_id = method.chat_id
+        task = asyncio.create_task(self._deliver(bot, method, self._tails.get(chat_id), time.monotonic()))
+        self._tails[chat_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._forget(chat_id, done))
+        self.metrics["enqueued"] += 1
+        return task
+
+    def send_message(self, bot: Bot, chat_id: int | str, text: str, **kwargs: Any) -> asyncio.Future:
+        """Поставить SendMessage в очередь (аргументы как у bot.send_message)"""
+        return self.enqueue(bot, SendMessage(chat_id=chat_id, text=text, **kwargs))
+
+    async def drain(self):
+        """Дождаться отправки всего, что уже в очереди (при остановке бота)"""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    def stats(self) -> dict:
+        """Метрики доставки и текущая длина очереди"""
+        sent = self.metrics["sent"]
+        return {
+            **self.metrics,
+            "pending": len(self._tasks),
+            "latency_avg": self.metrics["latency_total"] / sent if sent else 0.0,
+        }
+
+    @traced("sender.deliver", root=False)
+    async def _deliver(self, bot: Bot, method: TelegramMethod, previous: asyncio.Task | None, enqueued_at: float):
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        chat_bucket = self._chat_bucket(method.chat_id)
+        attempt = 0
+        while True:
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                async with self.slots:
+                    result = await bot(method)
+            except TelegramRetryAfter as e:
+                self.metrics["retry_after"] += 1
+                chat_bucket.pause(e.retry_after)
+                if attempt >= self.max_retries:
+                    self._record_failure(method, e)
+                    raise
+                logger.warning("Flood control для чата %s, повтор через %s с", method.chat_id, e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt >= self.max_retries:
+                    self._record_failure(method, e)
+                    raise
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                self._record_failure(method, e)
+                raise
+            else:
+                latency = time.monotonic() - enqueued_at
+                self.metrics["sent"] += 1
+                self.metrics["latency_total"] += latency
+                self.metrics["latency_max"] = max(self.metrics["latency_max"], latency)
+                return result
+
+            attempt += 1
+            self.metrics["retried"] += 1
+
+    def _record_failure(self, method: TelegramMethod, error: Exception):
+        self.metrics["failed"] += 1
+        logger.warning("Не удалось отправить %s в чат %s: %s", type(method).__name__, method.chat_id, error)
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _forget(self, chat_id: int | str, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+        # Ошибка уже залогирована; помечаем её полученной, чтобы asyncio не ругался
+        if not task.cancelled():
+            task.exception()
+
+        now = time.monotonic()
+        if now - self._last_cleanup > _CHAT_BUCKET_IDLE_SECONDS:
+            self._last_cleanup = now
+            for key in [key for key, bucket in self._chat_buckets.items()
+                        if key not in self._tails and bucket.idle_since(now) > _CHAT_BUCKET_IDLE_SECONDS]:
+                del self._chat_buckets[key]
+
+
+# Глобальная очередь отправки процесса
+sender = OutboundSender()
@@ -0,0 +1,316 @@
+"""
+Трассировка: апдейт → SQL → OpenAI → PDF → Bot API
+
+Лёгкая реализация спанов, совместимых с OpenTelemetry (trace/span ID того же
+формата, экспорт в OTLP/JSON), без зависимости от OpenTelemetry SDK. Текущий
+спан хранится в contextvars, поэтому контекст сам переходит в задачи,
+созданные через asyncio.create_task (очередь отправки, фоновые задачи), и
+в события SQLAlchemy.
+
+Чтобы трасса продолжилась в задаче, выполняемой позже или в другом процессе
+(очередь анализа), её контекст сохраняется через trace_parent() и
+восстанавливается через continue_trace().
+
+Решение о записи трассы принимается один раз в корневом спане
+(TRACE_SAMPLE_RATE); в невыбранных трассах все вложенные спаны — общий
+пустой объект, и накладные расходы сводятся к одному обращению к ContextVar.
+Готовые спаны копятся в памяти и сбрасываются фоновой задачей в файл
+JSONL (TRACE_EXPORTER=file) или в OTLP-коллектор по HTTP (TRACE_EXPORTER=otlp).
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Iterator
+
+import aiohttp
+
+from config import (
+    TRACE_EXPORTER,
+    TRACE_SAMPLE_RATE,
+    TRACE_FILE,
+    TRACE_OTLP_ENDPOINT,
+    TRACE_FLUSH_SECONDS,
+    TRACE_MAX_QUEUE,
+)
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "lovebot"
+
+# OTLP: SpanKind и StatusCode
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+class Span:
+    """Записываемый спан"""
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    sampled = True
+
+    def __init__(self, name: str, kind: int, trace_id: str, parent_id: str | None, attributes: dict):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        _exporter.add(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": _STATUS_ERROR, "message": self.error} if self.error else {"code": _STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Спан невыбранной трассы: ничего не записывает"""
+
+    sampled = False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def record_error(self, error: BaseException):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _RemoteParent:
+    """Родитель из сохранённого контекста (спан другой задачи или процесса); сам не пишется"""
+
+    __slots__ = ("trace_id", "span_id")
+
+    sampled = True
+
+    def __init__(self, trace_id: str, span_id: str):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+_current_span: ContextVar[Span | _NoopSpan | _RemoteParent | None] = ContextVar("current_span", default=None)
+
+
+def _otlp_attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def current_span() -> Span | _NoopSpan | None:
+    return _current_span.get()
+
+
+def trace_parent() -> tuple[str | None, str | None, bool | None]:
+    """
+    Контекст текущего спана для продолжения трассы в другой задаче или процессе
+
+    Returns:
+        tuple: (trace_id, span_id, sampled); sampled=None — трассы нет,
+            False — трасса не выбрана для записи
+    """
+    span = _current_span.get()
+    if span is None:
+        return None, None, None
+    if not span.sampled:
+        return None, None, False
+    return span.trace_id, span.span_id, True
+
+
+@contextmanager
+def continue_trace(trace_id: str | None, span_id: str | None, sampled: bool | None) -> Iterator[None]:
+    """
+    Продолжить трассу, сохранённую через trace_parent(): спаны блока станут её дочерними
+
+    Если трассы не было (sampled=None), корневой спан блока начнёт новую, как обычно.
+    """
+    if sampled is None:
+        yield
+        return
+    token = _current_span.set(_RemoteParent(trace_id, span_id) if sampled else NOOP_SPAN)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+
+
+def begin_span(name: str, kind: int = SPAN_KIND_INTERNAL, root: bool = True, **attributes: Any) -> Span | _NoopSpan:
+    """
+    Начать спан без смены текущего контекста (для пар событий вроде before/after SQL)
+
+    Спан нужно закончить вызовом span.end(). При root=False спан пишется только
+    внутри уже начатой трассы — так служебные запросы (getUpdates, SQL фоновых
+    задач) не создают отдельных трасс.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        if not root or TRACE_EXPORTER == "none" or random.random() >= TRACE_SAMPLE_RATE:
+            return NOOP_SPAN
+        return Span(name, kind, os.urandom(16).hex(), None, attributes)
+    if not parent.sampled:
+        return NOOP_SPAN
+    return Span(name, kind, parent.trace_id, parent.span_id, attributes)
+
+
+@contextmanager
+def start_span(
+    name: str,
+    kind: int = SPAN_KIND_INTERNAL,
+    root: bool = True,
+    **attributes: Any
+) -> Iterator[Span | _NoopSpan]:
+    """
+    Спан на время блока with; вложенные спаны (в т.ч. в созданных задачах) станут дочерними
+
+    Args:
+        name: имя операции, например openai.chat
+        kind: SPAN_KIND_*
+        root: можно ли начинать новую трассу, если текущей нет
+        **attributes: атрибуты спана
+    """
+    span = begin_span(name, kind, root, **attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+def traced(name: str, root: bool = True):
+    """Декоратор: обернуть функцию (обычную или корутину) в спан"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with start_span(name, root=root):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with start_span(name, root=root):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _SpanExporter:
+    """Буфер готовых спанов и их выгрузка в файл или OTLP-коллектор"""
+
+    def __init__(self, max_queue: int = TRACE_MAX_QUEUE):
+        self.max_queue = max_queue
+        self.buffer: list[Span] = []
+        self.exported = 0
+        self.dropped = 0
+
+    def add(self, span: Span):
+        if len(self.buffer) >= self.max_queue:
+            self.dropped += 1
+            return
+        self.buffer.append(span)
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        spans = [span.to_otlp() for span in batch]
+
+        if TRACE_EXPORTER == "file":
+            await asyncio.to_thread(self._write_file, spans)
+        elif TRACE_EXPORTER == "otlp":
+            await self._post_otlp(spans)
+        self.exported += len(spans)
+
+    def stats(self) -> dict:
+        return {"exported": self.exported, "dropped": self.dropped, "buffered": len(self.buffer)}
+
+    @staticmethod
+    def _write_file(spans: list[dict]):
+        # Одна запись на пачку: строки воркеров supervisor.py не перемешиваются
+        lines = "".join(json.dumps(span, ensure_ascii=False) + "\n" for span in spans)
+        with open(TRACE_FILE, "a", encoding="utf-8") as trace_file:
+            trace_file.write(lines)
+
+    @staticmethod
+    async def _post_otlp(spans: list[dict]):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+            }]
+        }
+        async with aiohttp.ClientSession() as http:
+            async with http.post(TRACE_OTLP_ENDPOINT, json=payload, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                response.raise_for_status()
+
+
+_exporter = _SpanExporter()
+
+
+def exporter_stats() -> dict:
+    """Счётчики экспорта (для /metrics)"""
+    return _exporter.stats()
+
+
+async def run_trace_exporter(interval: float = TRACE_FLUSH_SECONDS):
+    """Фоновая выгрузка спанов (запускается задачей из bot.py)"""
+    if TRACE_EXPORTER == "none":
+        return
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await _exporter.flush()
+            except Exception:
+                logger.exception("Не удалось выгрузить трассы")
+    finally:
+        # При остановке выгружаем остаток
+        await _exporter.flush()
@@ -2,7 +2,7 @@
 Вспомогательные функции
 """
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 
 def generate_join_link(session_id: int, role: str) -> str:
@@ -19,16 +19,32 @@ def generate_join_link(session_id: int, role: str) -> str:
     return f"/join_{session_id}_{role}"
 
 
+def session_expiry_cutoff(max_hours: int = 24) -> datetime:
+    """
+    Граница истечения: сессии, созданные раньше неё, считаются истёкшими
+
+    created_at заполняется БД через func.now(), то есть в UTC без таймзоны,
+    поэтому и граница считается в naive UTC.
+
+    Args:
+        max_hours: максимальное время жизни сессии в часах
+
+    Returns:
+        datetime: момент времени (naive UTC)
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return now - timedelta(hours=max_hours)
+
+
 def is_session_expired(created_at: datetime, max_hours: int = 24) -> bool:
     """
     Проверка, не истекла ли сессия
 
     Args:
-        created_at: время создания сессии
+        created_at: время создания сессии (naive UTC)
         max_hours: максимальное время жизни сессии в часах
 
     Returns:
         bool: True если сессия истекла
     """
-    expiry_time = created_at + timedelta(hours=max_hours)
-    return datetime.now() > expiry_time
+    return created_at < session_expiry_cutoff(max_hours)
@@ -0,0 +1,171 @@
+"""
+Приём апдейтов через webhook
+
+aiohttp-приложение проверяет секретный токен, кладёт апдейт в ограниченную
+очередь и сразу отвечает Telegram. Апдейты обрабатывает фиксированный пул
+воркеров. Если очередь заполнена, приложение отвечает 503, и Telegram
+повторит доставку позже (backpressure).
+
+Без WEBHOOK_SECRET приложение не запускается: иначе любой, кто может достучаться
+до порта, мог бы присылать поддельные апдейты.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import setup_application
+from aiohttp import web
+from pydantic import ValidationError
+
+from config import (
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_QUEUE_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateExecutor:
+    """Ограниченная очередь апдейтов и пул воркеров, передающих их в диспетчер"""
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        workers: int = WEBHOOK_WORKERS,
+        queue_size: int = WEBHOOK_QUEUE_SIZE
+    ):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.workers = workers
+        self.queue: asyncio.Queue[Update] = asyncio.Queue(maxsize=queue_size)
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Дождаться обработки уже принятых апдейтов и остановить воркеры"""
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, update: Update, timeout: float = WEBHOOK_QUEUE_TIMEOUT) -> bool:
+        """
+        Постановка апдейта в очередь
+
+        Args:
+            update: апдейт Telegram
+            timeout: сколько ждать места в заполненной очереди
+
+        Returns:
+            bool: False, если очередь так и не освободилась
+        """
+        try:
+            await asyncio.wait_for(self.queue.put(update), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+            except Exception:
+                logger.exception("Ошибка обработки апдейта %s", update.update_id)
+            finally:
+                self.queue.task_done()
+
+
+def build_webhook_app(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    executor: UpdateExecutor,
+    path: str = WEBHOOK_PATH,
+    secret: str = WEBHOOK_SECRET
+) -> web.Application:
+    """
+    aiohttp-приложение с эндпоинтом для апдейтов Telegram
+
+    Args:
+        dispatcher: диспетчер бота
+        bot: бот
+        executor: очередь апдейтов (UpdateExecutor или ShardRouter из supervisor.py)
+        path: путь эндпоинта
+        secret: секретный токен, заданный при setWebhook (обязателен)
+
+    Returns:
+        web.Application: приложение (startup/shutdown диспетчера подключены)
+
+    Raises:
+        ValueError: секретный токен не задан
+    """
+    if not secret:
+        raise ValueError("WEBHOOK_SECRET не задан — без него webhook принимает поддельные апдейты")
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except (json.JSONDecodeError, UnicodeDecodeError, ValidationError):
+            logger.warning("Некорректное тело запроса webhook отклонено")
+            return web.Response(status=400)
+        if not await executor.submit(update):
+            logger.warning("Очередь апдейтов заполнена, апдейт %s отклонён", update.update_id)
+            return web.Response(status=503)
+        return web.Response()
+
+    async def on_startup(app: web.Application):
+        await executor.start()
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL}{path}",
+            secret_token=secret,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+        )
+
+    async def on_shutdown(app: web.Application):
+        await executor.stop()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def serve_app(app: web.Application):
+    """Запуск aiohttp-приложения на WEBHOOK_HOST:WEBHOOK_PORT (работает до отмены задачи)"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info("Webhook слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot):
+    """Запуск webhook-сервера в текущем процессе"""
+    executor = UpdateExecutor(dispatcher, bot)
+    await serve_app(build_webhook_app(dispatcher, bot, executor))
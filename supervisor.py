@@ -0,0 +1,450 @@
+"""
+Многопроцессный запуск бота
+
+Супервизор принимает апдейты (webhook или polling, по BOT_MODE) и раздаёт их
+SUPERVISOR_WORKERS процессам-воркерам по хэшу Telegram ID пользователя. Все
+апдейты одного пользователя обрабатывает один воркер, поэтому порядок его
+апдейтов и локальный кэш FSM остаются согласованными, а генерация PDF
+распределяется по ядрам. БД и хранилище FSM у воркеров общие. AI-анализ
+воркеры только ставят в очередь analysis_jobs, а выполняет его пул воркеров
+анализа в супервизоре (новые задачи он находит опросом очереди).
+
+Сигналы: SIGHUP — поочерёдный перезапуск воркеров, SIGTERM/SIGINT — остановка
+с дообработкой уже принятых апдейтов.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import zlib
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import Update
+from aiohttp import web
+
+from bot import create_bot, create_dispatcher, start_background_tasks
+from config import (
+    BOT_MODE,
+    WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_TIMEOUT,
+    SUPERVISOR_WORKERS,
+    SUPERVISOR_QUEUE_SIZE,
+    SUPERVISOR_HEARTBEAT_SECONDS,
+    SUPERVISOR_HEARTBEAT_TIMEOUT,
+    SUPERVISOR_SHUTDOWN_TIMEOUT,
+    SENDER_GLOBAL_RATE,
+    METRICS_PORT,
+)
+from db.database import init_db
+from services.metrics import start_metrics_server
+from services.sender import sender
+from services.tracing import run_trace_exporter
+from services.webhook import build_webhook_app, serve_app
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать апдейт в очереди воркера, прежде чем проверить остальные дела
+_QUEUE_POLL_SECONDS = 1.0
+# Как часто писать в лог сводку о состоянии воркеров
+_HEALTH_LOG_INTERVAL_SECONDS = 60
+
+
+def sender_rate_share(workers: int = SUPERVISOR_WORKERS) -> float:
+    """
+    Доля общего лимита Bot API на один процесс
+
+    Сообщения отправляют и воркеры, и сам супервизор (результаты анализа,
+    рассылки, уведомления), поэтому лимит делится на workers + 1.
+
+    Args:
+        workers: число воркеров
+
+    Returns:
+        float: сообщений в секунду для sender одного процесса
+    """
+    return SENDER_GLOBAL_RATE / (workers + 1)
+
+
+def shard_for_update(update: Update, workers: int) -> int:
+    """
+    Номер воркера для апдейта
+
+    Args:
+        update: апдейт Telegram
+        workers: число воркеров
+
+    Returns:
+        int: номер воркера (по хэшу пользователя, иначе чата)
+    """
+    context = UserContextMiddleware.resolve_event_context(update)
+    key = context.user_id or context.chat_id or 0
+    return zlib.crc32(str(key).encode("ascii")) % workers
+
+
+# ---------------------------------------------------------------------------
+# Воркер
+# ---------------------------------------------------------------------------
+
+class _UserOrderedRunner:
+    """
+    Конкурентная обработка апдейтов с сохранением порядка для каждого пользователя
+
+    Апдейты разных пользователей обрабатываются параллельно (не больше
+    concurrency одновременно), апдейты одного пользователя — строго по очереди.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, concurrency: int):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.slots = asyncio.Semaphore(concurrency)
+        self.processed = 0
+        self.errors = 0
+        self._tails: dict[int, asyncio.Task] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def inflight(self) -> int:
+        return len(self._tasks)
+
+    async def submit(self, update: Update):
+        """Запуск обработки апдейта (ждёт свободного слота)"""
+        await self.slots.acquire()
+        context = UserContextMiddleware.resolve_event_context(update)
+        key = context.user_id or context.chat_id or 0
+
+        task = asyncio.create_task(self._process(update, self._tails.get(key)))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._release(key, done))
+
+    async def join(self):
+        """Дождаться окончания всех запущенных обработок"""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    async def _process(self, update: Update, previous: asyncio.Task | None):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+            self.processed += 1
+        except Exception:
+            self.errors += 1
+            logger.exception("Ошибка обработки апдейта %s", update.update_id)
+
+    def _release(self, key: int, task: asyncio.Task):
+        self.slots.release()
+        self._tasks.discard(task)
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+
+async def _send_heartbeats(index: int, health: multiprocessing.Queue, runner: _UserOrderedRunner):
+    while True:
+        health.put_nowait({
+            "worker": index,
+            "pid": os.getpid(),
+            "time": time.time(),
+            "processed": runner.processed,
+            "errors": runner.errors,
+            "inflight": runner.inflight,
+        })
+        await asyncio.sleep(SUPERVISOR_HEARTBEAT_SECONDS)
+
+
+async def _worker_loop(index: int, updates: multiprocessing.Queue, health: multiprocessing.Queue):
+    bot = create_bot()
+    dp = create_dispatcher()
+    runner = _UserOrderedRunner(dp, bot, WEBHOOK_WORKERS)
+    # Общий лимит Bot API делится между воркерами и супервизором
+    sender.set_global_rate(sender_rate_share())
+
+    # У каждого воркера свои метрики: порт METRICS_PORT + 1 + номер воркера
+    metrics_runner = await start_metrics_server(METRICS_PORT + 1 + index if METRICS_PORT else 0)
+
+    await dp.emit_startup(bot=bot)
+    heartbeat = asyncio.create_task(_send_heartbeats(index, health, runner))
+    trace_exporter = asyncio.create_task(run_trace_exporter())
+    logger.info("Воркер %d запущен (pid %d)", index, os.getpid())
+
+    try:
+        while True:
+            try:
+                data = await asyncio.to_thread(updates.get, True, _QUEUE_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if data is None:
+                break
+            await runner.submit(Update.model_validate(data, context={"bot": bot}))
+
+        await runner.join()
+        await sender.drain()
+    finally:
+        heartbeat.cancel()
+        trace_exporter.cancel()
+        await asyncio.gather(trace_exporter, return_exceptions=True)
+        await dp.emit_shutdown(bot=bot)
+        await dp.storage.close()
+        await bot.session.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        logger.info("Воркер %d остановлен", index)
+
+
+def worker_main(index: int, updates: multiprocessing.Queue, health: multiprocessing.Queue):
+    """Точка входа процесса-воркера"""
+    # Ctrl+C получает вся группа процессов; останавливает воркеры супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_loop(index, updates, health))
+
+
+# ---------------------------------------------------------------------------
+# Супервизор
+# ---------------------------------------------------------------------------
+
+class Supervisor:
+    """
+    Пул процессов-воркеров с очередью апдейтов у каждого
+
+    Реализует интерфейс очереди для services.webhook.build_webhook_app
+    (start/stop/submit), поэтому webhook-приложение работает с ним так же,
+    как с UpdateExecutor в однопроцессном режиме.
+    """
+
+    def __init__(self, workers: int = SUPERVISOR_WORKERS, queue_size: int = SUPERVISOR_QUEUE_SIZE):
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self.queues = [self.context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.health_queue = self.context.Queue()
+        self.processes: list[multiprocessing.Process | None] = [None] * workers
+        self.health: dict[int, dict] = {}
+        self.restarts = [0] * workers
+
+        # Одна постановка в очередь шарда за раз — сохраняет порядок апдейтов
+        self._shard_locks = [asyncio.Lock() for _ in range(workers)]
+        self._restarting: set[int] = set()
+        self._monitor: asyncio.Task | None = None
+
+    async def start(self):
+        for index in range(self.workers):
+            self._start_worker(index)
+        self._monitor = asyncio.create_task(self._monitor_workers())
+
+    async def stop(self):
+        """Остановка всех воркеров с дообработкой их очередей"""
+        if self._monitor:
+            self._monitor.cancel()
+            self._monitor = None
+        await asyncio.gather(*(self._stop_worker(index) for index in range(self.workers)))
+
+    async def restart(self):
+        """Поочерёдный перезапуск воркеров: остальные продолжают работу"""
+        for index in range(self.workers):
+            await self._restart_worker(index)
+        logger.info("Все воркеры перезапущены")
+
+    async def submit(self, update: Update, timeout: float | None = WEBHOOK_QUEUE_TIMEOUT) -> bool:
+        """
+        Передача апдейта воркеру его пользователя
+
+        Args:
+            update: апдейт Telegram
+            timeout: сколько ждать места в очереди воркера (None — без ограничения)
+
+        Returns:
+            bool: False, если очередь воркера так и не освободилась
+        """
+        index = shard_for_update(update, self.workers)
+        data = update.model_dump(mode="json", exclude_none=True, by_alias=True)
+
+        async with self._shard_locks[index]:
+            try:
+                self.queues[index].put_nowait(data)
+            except queue.Full:
+                try:
+                    await asyncio.to_thread(self.queues[index].put, data, True, timeout)
+                except queue.Full:
+                    return False
+        return True
+
+    def health_report(self) -> list[dict]:
+        """Состояние воркеров: pid, жив ли процесс, последний heartbeat и счётчики"""
+        now = time.time()
+        report = []
+        for index, process in enumerate(self.processes):
+            heartbeat = self.health.get(index, {})
+            report.append({
+                "worker": index,
+                "pid": process.pid if process else None,
+                "alive": bool(process and process.is_alive()),
+                "heartbeat_age": round(now - heartbeat["time"], 1) if heartbeat else None,
+                "processed": heartbeat.get("processed", 0),
+                "errors": heartbeat.get("errors", 0),
+                "inflight": heartbeat.get("inflight", 0),
+                "restarts": self.restarts[index],
+            })
+        return report
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """GET /health для webhook-режима"""
+        return web.json_response(self.health_report())
+
+    async def run_polling(self, bot: Bot, dispatcher: Dispatcher, polling_timeout: int = 30):
+        """Long polling в супервизоре: апдейты раздаются воркерам"""
+        allowed_updates = dispatcher.resolve_used_update_types()
+        await bot.delete_webhook()
+        offset = None
+        backoff = 1.0
+
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset,
+                    timeout=polling_timeout,
+                    allowed_updates=allowed_updates,
+                )
+            except Exception:
+                logger.exception("Ошибка получения апдейтов, повтор через %.0f с", backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
+                continue
+
+            backoff = 1.0
+            for update in updates:
+                await self.submit(update, timeout=None)
+                offset = update.update_id + 1
+
+    def _start_worker(self, index: int):
+        process = self.context.Process(
+            target=worker_main,
+            args=(index, self.queues[index], self.health_queue),
+            name=f"lovebot-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        self.health.pop(index, None)
+
+    async def _stop_worker(self, index: int):
+        process = self.processes[index]
+        if process is None:
+            return
+        try:
+            await asyncio.to_thread(self.queues[index].put, None, True, SUPERVISOR_SHUTDOWN_TIMEOUT)
+        except queue.Full:
+            pass
+        await asyncio.to_thread(process.join, SUPERVISOR_SHUTDOWN_TIMEOUT)
+        if process.is_alive():
+            logger.warning("Воркер %d не остановился за %.0f с, завершаю принудительно",
+                           index, SUPERVISOR_SHUTDOWN_TIMEOUT)
+            process.terminate()
+            await asyncio.to_thread(process.join)
+        self.processes[index] = None
+
+    async def _restart_worker(self, index: int):
+        # Новый воркер стартует только после остановки старого: порядок апдейтов
+        # пользователя не нарушается, а накопившаяся очередь переходит к новому
+        self._restarting.add(index)
+        try:
+            await self._stop_worker(index)
+            self._start_worker(index)
+            self.restarts[index] += 1
+        finally:
+            self._restarting.discard(index)
+
+    def _drain_heartbeats(self):
+        while True:
+            try:
+                heartbeat = self.health_queue.get_nowait()
+            except queue.Empty:
+                return
+            process = self.processes[heartbeat["worker"]]
+            # Опоздавший heartbeat уже заменённого процесса не учитываем
+            if process is not None and process.pid == heartbeat["pid"]:
+                self.health[heartbeat["worker"]] = heartbeat
+
+    async def _monitor_workers(self):
+        """Приём heartbeat'ов и перезапуск упавших или зависших воркеров"""
+        started_at = time.time()
+        last_log = time.time()
+
+        while True:
+            await asyncio.sleep(SUPERVISOR_HEARTBEAT_SECONDS)
+            self._drain_heartbeats()
+            now = time.time()
+
+            for index, process in enumerate(self.processes):
+                if index in self._restarting or process is None:
+                    continue
+                heartbeat = self.health.get(index)
+                last_seen = heartbeat["time"] if heartbeat else started_at
+
+                if not process.is_alive():
+                    logger.error("Воркер %d завершился (код %s), перезапуск", index, process.exitcode)
+                elif now - last_seen > SUPERVISOR_HEARTBEAT_TIMEOUT:
+                    logger.error("Воркер %d не отвечает %.0f с, перезапуск", index, now - last_seen)
+                    process.kill()
+                else:
+                    continue
+                await asyncio.to_thread(process.join)
+                self._start_worker(index)
+                self.restarts[index] += 1
+                started_at = now
+
+            if now - last_log >= _HEALTH_LOG_INTERVAL_SECONDS:
+                logger.info("Состояние воркеров: %s", self.health_report())
+                last_log = now
+
+
+async def main():
+    """Запуск супервизора с SUPERVISOR_WORKERS воркерами"""
+    logger.info("Инициализация базы данных...")
+    await init_db()
+    logger.info("База данных инициализирована ✓")
+
+    bot = create_bot()
+    dp = create_dispatcher()
+    supervisor = Supervisor()
+    # Супервизор тоже отправляет сообщения — ему своя доля общего лимита
+    sender.set_global_rate(sender_rate_share(supervisor.workers))
+
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(supervisor.restart()))
+    loop.add_signal_handler(signal.SIGTERM, main_task.cancel)
+
+    # Очистка, архивация и рассылки выполняются один раз — в супервизоре, а не в каждом воркере
+    background_tasks = start_background_tasks(bot)
+    metrics_runner = await start_metrics_server()
+    logger.info("Супервизор запущен: воркеров %d, режим %s ✓", supervisor.workers, BOT_MODE)
+
+    try:
+        if BOT_MODE == "webhook":
+            app = build_webhook_app(dp, bot, supervisor)
+            app.router.add_get("/health", supervisor.handle_health)
+            await serve_app(app)
+        else:
+            await supervisor.start()
+            try:
+                await supervisor.run_polling(bot, dp)
+            finally:
+                await supervisor.stop()
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await dp.storage.close()
+        await bot.session.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logger.info("Супервизор остановлен")
@@ -0,0 +1,52 @@
+"""
+Общая настройка тестов
+
+config.py читает окружение при импорте, поэтому временная база и токен
+задаются здесь, до импорта модулей бота. Каждый тест работает в своём
+цикле событий: run_db инициализирует схему, а в конце закрывает пул
+соединений (соединения aiosqlite привязаны к циклу, в котором созданы).
+"""
+
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+_TMP_DIR = tempfile.mkdtemp(prefix="lovebot-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_TMP_DIR}/test.db"
+os.environ["BOT_TOKEN"] = "123456:test-token"
+os.environ["OPENAI_API_KEY"] = "test-key"
+os.environ["FSM_STORAGE"] = "memory"
+os.environ["TRACE_EXPORTER"] = "none"
+os.environ["ARCHIVE_DIR"] = os.path.join(_TMP_DIR, "archive")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Telegram ID не пересекаются между тестами: база общая на весь прогон
+_user_ids = itertools.count(1_000_000)
+
+
+@pytest.fixture
+def new_user_id():
+    """Генератор уникальных Telegram ID"""
+    return lambda: next(_user_ids)
+
+
+@pytest.fixture
+def run_db():
+    """Запуск async-функции теста в новом цикле событий с готовой схемой БД"""
+    from db.database import engine, init_db
+
+    def run(test_fn):
+        async def main():
+            await init_db()
+            try:
+                return await test_fn()
+            finally:
+                await engine.dispose()
+        return asyncio.run(main())
+
+    return run
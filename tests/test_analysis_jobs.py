@@ -0,0 +1,150 @@
+"""
+Очередь анализа: после последней неудачной попытки сессия не остаётся в analyzing,
+а задача выполняется в трассе обработчика, поставившего её в очередь
+"""
+
+import asyncio
+import contextlib
+from unittest.mock import MagicMock
+
+from sqlalchemy import select
+
+from services.answer_codec import encode_answers
+
+
+async def enqueue_job(partner1: int, partner2: int) -> int:
+    """Сессия в статусе analyzing с задачей, готовой к выполнению"""
+    from db.database import async_session_maker
+    from db.models import Session as DBSession, SessionStatus
+    from services.analysis_jobs import attach_placeholder, enqueue_analysis
+
+    async with async_session_maker() as session:
+        db_session = DBSession(
+            status=SessionStatus.ANALYZING, partner1_user_id=partner1, partner2_user_id=partner2
+        )
+        session.add(db_session)
+        await session.flush()
+        await enqueue_analysis(
+            session, db_session.id,
+            partner1, encode_answers(["A", "B", "C", "D", "E"]),
+            partner2, encode_answers(["A", "B", "C", "A", "A"]),
+            chat_id=partner2,
+        )
+        await session.commit()
+        session_id = db_session.id
+    await attach_placeholder(session_id, message_id=None)
+    return session_id
+
+
+async def run_last_attempt(monkeypatch) -> MagicMock:
+    """Одна попытка пула с max_attempts=1, в которой анализ падает"""
+    import services.analysis_jobs as analysis_jobs
+
+    async def broken_analyze(*args, **kwargs):
+        raise RuntimeError("analysis crashed")
+
+    send_message = MagicMock()
+    monkeypatch.setattr(analysis_jobs, "analyze", broken_analyze)
+    monkeypatch.setattr(analysis_jobs.sender, "send_message", send_message)
+
+    pool = analysis_jobs.AnalysisWorkerPool(workers=1, max_attempts=1)
+    job = await pool._claim()
+    await pool._process(MagicMock(), job)
+    return send_message
+
+
+def test_last_failed_attempt_delivers_basic_report(run_db, new_user_id, monkeypatch):
+    from db.database import async_session_maker
+    from db.models import AnalysisJob, Result, Session as DBSession, SessionStatus
+
+    partner1, partner2 = new_user_id(), new_user_id()
+
+    async def scenario():
+        session_id = await enqueue_job(partner1, partner2)
+        send_message = await run_last_attempt(monkeypatch)
+
+        async with async_session_maker() as session:
+            db_session = await session.get(DBSession, session_id)
+            result = (await session.execute(
+                select(Result).where(Result.session_id == session_id)
+            )).scalar_one()
+            job = (await session.execute(
+                select(AnalysisJob).where(AnalysisJob.session_id == session_id)
+            )).scalar_one_or_none()
+        assert db_session.status == SessionStatus.COMPLETED
+        # Базовый отчёт перегенерирует services.regenerator
+        assert result.is_provisional
+        assert job is None
+        assert {call.args[1] for call in send_message.call_args_list} == {partner1, partner2}
+
+    run_db(scenario)
+
+
+def test_failed_basic_report_notifies_partners(run_db, new_user_id, monkeypatch):
+    import services.analysis_jobs as analysis_jobs
+    from db.database import async_session_maker
+    from db.models import AnalysisJob, JobStatus
+
+    partner1, partner2 = new_user_id(), new_user_id()
+
+    async def broken_store_report(*args, **kwargs):
+        raise RuntimeError("database is gone")
+
+    async def scenario():
+        session_id = await enqueue_job(partner1, partner2)
+        monkeypatch.setattr(analysis_jobs, "store_report", broken_store_report)
+        send_message = await run_last_attempt(monkeypatch)
+
+        async with async_session_maker() as session:
+            job = (await session.execute(
+                select(AnalysisJob).where(AnalysisJob.session_id == session_id)
+            )).scalar_one()
+        assert job.status == JobStatus.FAILED
+        assert "analysis crashed" in job.last_error
+        sent = {(call.args[1], call.args[2]) for call in send_message.call_args_list}
+        assert sent == {
+            (partner1, analysis_jobs.ANALYSIS_FAILED_TEXT),
+            (partner2, analysis_jobs.ANALYSIS_FAILED_TEXT),
+        }
+
+    run_db(scenario)
+
+
+def test_worker_continues_enqueuing_trace(run_db, new_user_id, monkeypatch):
+    import services.analysis_jobs as analysis_jobs
+    from services.tracing import SPAN_KIND_SERVER, Span, _current_span, current_span
+
+    partner1, partner2 = new_user_id(), new_user_id()
+    job_spans = []
+    done = asyncio.Event()
+
+    async def recording_run_analysis(bot, job):
+        job_spans.append(current_span())
+        done.set()
+
+    monkeypatch.setattr(analysis_jobs, "run_analysis", recording_run_analysis)
+
+    async def scenario():
+        # Апдейт из выбранной трассы ставит задачу в очередь
+        update_span = Span("telegram.update", SPAN_KIND_SERVER, "ab" * 16, None, {})
+        token = _current_span.set(update_span)
+        try:
+            await enqueue_job(partner1, partner2)
+        finally:
+            _current_span.reset(token)
+
+        pool = analysis_jobs.AnalysisWorkerPool(workers=1, poll_seconds=0.05)
+        worker = asyncio.create_task(pool._worker(MagicMock()))
+        try:
+            await asyncio.wait_for(done.wait(), 5)
+        finally:
+            worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await worker
+
+        [job_span] = job_spans
+        assert job_span.name == "analysis.job"
+        assert job_span.trace_id == update_span.trace_id
+        assert job_span.parent_id == update_span.span_id
+
+    run_db(scenario)
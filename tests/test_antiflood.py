@@ -0,0 +1,80 @@
+"""
+Кнопки теста через антифлуд: ответ на следующий вопрос в ту же секунду проходит,
+мгновенный повтор той же кнопки отбрасывается, а кнопка прошлого вопроса не засчитывается
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+
+def fake_callback(user_id: int, data: str) -> AsyncMock:
+    callback = AsyncMock()
+    callback.data = data
+    callback.from_user.id = user_id
+    callback.message.chat.id = user_id
+    callback.message.message_id = 1
+    # Сообщение отредактировано в ту же секунду: edit_date не меняется
+    callback.message.edit_date = 1_700_000_000
+    callback.message.answer.return_value = MagicMock(message_id=1)
+    return callback
+
+
+class QuizTapper:
+    """Нажатия кнопок теста одного пользователя через AntiFloodMiddleware и process_answer_callback"""
+
+    def __init__(self, user_id: int):
+        from middlewares.antiflood import AntiFloodMiddleware
+
+        self.user_id = user_id
+        self.state = FSMContext(MemoryStorage(), StorageKey(bot_id=1, chat_id=user_id, user_id=user_id))
+        self.antiflood = AntiFloodMiddleware(rate=1000, burst=1000)
+
+    async def tap(self, question: int, choice: str):
+        from handlers.test import build_answer_keyboard, process_answer_callback
+
+        button_data = f"answer_{question}_{choice}"
+        keyboard = build_answer_keyboard(question=question)
+        assert button_data in [row[0].callback_data for row in keyboard.inline_keyboard]
+
+        async def handler(event, data):
+            await process_answer_callback(event.callback_query, self.state)
+
+        event = MagicMock(callback_query=fake_callback(self.user_id, button_data))
+        await self.antiflood(handler, event, {"event_from_user": MagicMock(id=self.user_id)})
+
+
+def test_next_question_in_same_second_passes_and_stale_index_is_ignored(new_user_id):
+    tapper = QuizTapper(new_user_id())
+
+    async def scenario():
+        await tapper.state.update_data(current_question=0, answers=[])
+        await tapper.tap(0, "A")
+        await tapper.tap(1, "B")
+        # Кнопка первого вопроса после окна антифлуда: дублем она уже не считается,
+        # и её отбрасывает обработчик по номеру вопроса
+        tapper.antiflood._recent_callbacks.clear()
+        await tapper.tap(0, "C")
+        await tapper.tap(2, "D")
+        return await tapper.state.get_data()
+
+    data = asyncio.run(scenario())
+    assert data == {"current_question": 3, "answers": ["A", "B", "D"]}
+    assert tapper.antiflood.counters["dropped_duplicate"] == 0
+
+
+def test_immediate_repeat_tap_is_dropped_as_duplicate(new_user_id):
+    tapper = QuizTapper(new_user_id())
+
+    async def scenario():
+        await tapper.state.update_data(current_question=0, answers=[])
+        await tapper.tap(0, "A")
+        await tapper.tap(0, "A")
+        return await tapper.state.get_data()
+
+    data = asyncio.run(scenario())
+    assert data == {"current_question": 1, "answers": ["A"]}
+    assert tapper.antiflood.counters["dropped_duplicate"] == 1
@@ -0,0 +1,101 @@
+"""
+Рассылка мини-тестов: подписчика забирает один планировщик, а ошибка
+в тексте сообщения не отключает платную подписку
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import SendMessage
+from sqlalchemy import select, update
+
+# Параллельных планировщиков и проходов: гонка проявляется не в каждом проходе
+_SCHEDULERS = 4
+_ROUNDS = 10
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+async def add_due_subscribers(user_ids: list[int]):
+    from db.database import async_session_maker
+    from db.models import Subscription
+
+    async with async_session_maker() as session:
+        for user_id in user_ids:
+            session.add(Subscription(user_id=user_id, is_active=True, next_due_at=_utcnow() - timedelta(minutes=1)))
+        await session.commit()
+
+
+def test_concurrent_schedulers_claim_each_subscriber_once(run_db, new_user_id):
+    from db.database import async_session_maker
+    from db.models import Subscription
+    from services.campaigns import _claim_due_subscribers
+
+    user_ids = [new_user_id() for _ in range(20)]
+
+    async def scenario():
+        await add_due_subscribers(user_ids)
+        for round_number in range(1, _ROUNDS + 1):
+            claimed = await asyncio.gather(
+                *(_claim_due_subscribers(batch_size=10_000) for _ in range(_SCHEDULERS))
+            )
+
+            ours = [user_id for deliveries in claimed for _, user_id, _ in deliveries if user_id in user_ids]
+            assert sorted(ours) == sorted(user_ids)
+
+            async with async_session_maker() as session:
+                tests_sent = (await session.execute(
+                    select(Subscription.tests_sent).where(Subscription.user_id.in_(user_ids))
+                )).scalars().all()
+                assert set(tests_sent) == {round_number}
+                # Следующая неделя наступает сразу
+                await session.execute(
+                    update(Subscription)
+                    .where(Subscription.user_id.in_(user_ids))
+                    .values(next_due_at=_utcnow() - timedelta(minutes=1))
+                )
+                await session.commit()
+
+    run_db(scenario)
+
+
+def test_only_unreachable_users_lose_subscription(run_db, new_user_id, monkeypatch):
+    import services.campaigns as campaigns
+    from db.database import async_session_maker
+    from db.models import CampaignDelivery, DeliveryStatus, Subscription
+
+    broken_text, chat_gone, blocked = new_user_id(), new_user_id(), new_user_id()
+    method = SendMessage(chat_id=1, text="мини-тест")
+    errors = {
+        broken_text: TelegramBadRequest(method, "Bad Request: can't parse entities"),
+        chat_gone: TelegramBadRequest(method, "Bad Request: chat not found"),
+        blocked: TelegramForbiddenError(method, "Forbidden: bot was blocked by the user"),
+    }
+
+    def send_message(bot, chat_id, text, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        future.set_exception(errors[chat_id])
+        return future
+
+    monkeypatch.setattr(campaigns.campaign_sender, "send_message", send_message)
+
+    async def scenario():
+        await add_due_subscribers(list(errors))
+        deliveries = [d for d in await campaigns._claim_due_subscribers(batch_size=10_000) if d[1] in errors]
+        assert len(deliveries) == 3
+        assert await campaigns._send_deliveries(None, deliveries) == 0
+
+        async with async_session_maker() as session:
+            active = dict((await session.execute(
+                select(Subscription.user_id, Subscription.is_active).where(Subscription.user_id.in_(errors))
+            )).all())
+            statuses = (await session.execute(
+                select(CampaignDelivery.status).where(CampaignDelivery.user_id.in_(errors))
+            )).scalars().all()
+        assert active == {broken_text: True, chat_gone: False, blocked: False}
+        assert statuses == [DeliveryStatus.FAILED] * 3
+
+    run_db(scenario)
@@ -0,0 +1,74 @@
+"""
+Анализ сессии запускается ровно один раз, даже если оба партнёра завершают тест одновременно
+"""
+
+import asyncio
+import random
+from unittest.mock import AsyncMock, MagicMock
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import func, select
+
+ROUNDS = 30
+ANSWERS = ["A", "B", "C", "D", "E"]
+
+
+def fake_message(user_id: int) -> AsyncMock:
+    async def answer(*args, **kwargs):
+        # Ответ Telegram занимает время — второй партнёр успевает дойти до проверки ответов
+        await asyncio.sleep(random.uniform(0, 0.005))
+        return MagicMock(message_id=1)
+
+    message = AsyncMock()
+    message.from_user.id = user_id
+    message.chat.id = user_id
+    message.answer.side_effect = answer
+    return message
+
+
+def test_parallel_finish_enqueues_one_job(run_db, new_user_id):
+    from db.database import async_session_maker
+    from db.models import AnalysisJob, Session as DBSession, SessionStatus
+    from handlers.test import finish_test
+
+    storage = MemoryStorage()
+
+    async def finish(session_id: int, user_id: int) -> AsyncMock:
+        message = fake_message(user_id)
+        state = FSMContext(storage, StorageKey(bot_id=1, chat_id=user_id, user_id=user_id))
+        await finish_test(message, state, ANSWERS, user_id=user_id, session_id=session_id)
+        return message
+
+    async def scenario():
+        for _ in range(ROUNDS):
+            partner1, partner2 = new_user_id(), new_user_id()
+            async with async_session_maker() as session:
+                db_session = DBSession(
+                    status=SessionStatus.IN_PROGRESS, partner1_user_id=partner1, partner2_user_id=partner2
+                )
+                session.add(db_session)
+                await session.commit()
+                session_id = db_session.id
+
+            messages = await asyncio.gather(finish(session_id, partner1), finish(session_id, partner2))
+
+            async with async_session_maker() as session:
+                jobs = (await session.execute(
+                    select(func.count()).select_from(AnalysisJob).where(AnalysisJob.session_id == session_id)
+                )).scalar_one()
+                status = (await session.execute(
+                    select(DBSession.status).where(DBSession.id == session_id)
+                )).scalar_one()
+            assert jobs == 1
+            assert status == SessionStatus.ANALYZING
+
+            # Сообщение «Анализирую...» получает только тот, кто захватил сессию
+            analyzing = [
+                call for message in messages for call in message.answer.await_args_list
+                if "Анализирую" in call.args[0]
+            ]
+            assert len(analyzing) == 1
+
+    run_db(scenario)
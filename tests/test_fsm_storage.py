@@ -0,0 +1,50 @@
+"""
+Записи FSM не теряются, если бот останавливается посреди фонового сброса
+"""
+
+import asyncio
+import contextlib
+
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import select
+
+
+def test_close_during_flush_keeps_batch(run_db, new_user_id):
+    from db.database import async_session_maker
+    from db.fsm_storage import SQLStorage
+    from db.models import FSMRecord
+
+    user_id = new_user_id()
+    flush_started = asyncio.Event()
+    hang_next = False
+
+    @contextlib.asynccontextmanager
+    async def slow_session_maker():
+        # Фоновый сброс «зависает» в БД, пока его не отменит close()
+        nonlocal hang_next
+        if hang_next:
+            hang_next = False
+            flush_started.set()
+            await asyncio.Event().wait()
+        async with async_session_maker() as session:
+            yield session
+
+    async def scenario():
+        storage = SQLStorage(session_maker=slow_session_maker, flush_interval=0)
+        key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+        await storage.set_data(key, {"current_question": 3, "answers": ["A", "B", "C"]})
+        # Фоновый сброс ещё не начался: set_data только поставила задачу
+        nonlocal hang_next
+        hang_next = True
+        await asyncio.wait_for(flush_started.wait(), 1)
+
+        await storage.close()
+
+        async with async_session_maker() as session:
+            data = (await session.execute(
+                select(FSMRecord.data).where(FSMRecord.key == storage.key_builder.build(key))
+            )).scalar_one_or_none()
+        assert data is not None
+        assert '"current_question": 3' in data
+
+    run_db(scenario)
@@ -0,0 +1,44 @@
+"""
+К сессии по одной ссылке присоединяется ровно один второй партнёр, даже при одновременных переходах
+"""
+
+import asyncio
+
+ROUNDS = 20
+JOINERS = 8
+
+
+def test_parallel_joins_claim_partner2_slot_once(run_db, new_user_id):
+    from db.database import async_session_maker
+    from db.models import Session as DBSession, SessionStatus
+    from db.repository import claim_partner2_slot
+
+    async def join(session_id: int, user_id: int) -> int | None:
+        async with async_session_maker() as session:
+            partner1 = await claim_partner2_slot(session, session_id, user_id, SessionStatus.PENDING)
+            await session.commit()
+            return partner1
+
+    async def scenario():
+        for _ in range(ROUNDS):
+            creator = new_user_id()
+            async with async_session_maker() as session:
+                db_session = DBSession(status=SessionStatus.PENDING, partner1_user_id=creator)
+                session.add(db_session)
+                await session.commit()
+                session_id = db_session.id
+
+            joiners = [new_user_id() for _ in range(JOINERS)]
+            claimed = await asyncio.gather(*(join(session_id, user_id) for user_id in joiners))
+
+            winners = [user_id for user_id, partner1 in zip(joiners, claimed) if partner1 is not None]
+            assert len(winners) == 1
+            assert claimed[joiners.index(winners[0])] == creator
+
+            # Проигравшие не перезаписали второго партнёра
+            async with async_session_maker() as session:
+                db_session = await session.get(DBSession, session_id)
+            assert db_session.partner2_user_id == winners[0]
+            assert db_session.status == SessionStatus.IN_PROGRESS
+
+    run_db(scenario)
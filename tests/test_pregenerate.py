@@ -0,0 +1,145 @@
+"""
+pregenerate.py против локального фейкового Batch API: отчёты попадают в кэш,
+а после падения повторный запуск дожидается уже отправленных пачек
+"""
+
+import json
+
+import pytest
+from aiohttp import web
+from openai import AsyncOpenAI, InternalServerError
+from sqlalchemy import func, select
+
+
+class FakeBatchAPI:
+    """files.create / batches.create / batches.retrieve / files.content в памяти"""
+
+    def __init__(self):
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict] = {}
+        self.created_batches = 0
+        self.fail_next_retrieve = False
+
+        self.app = web.Application()
+        self.app.router.add_post("/v1/files", self.create_file)
+        self.app.router.add_get("/v1/files/{file_id}/content", self.file_content)
+        self.app.router.add_post("/v1/batches", self.create_batch)
+        self.app.router.add_get("/v1/batches/{batch_id}", self.retrieve_batch)
+
+    async def create_file(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        file_id = f"file-{len(self.files)}"
+        self.files[file_id] = form["file"].file.read()
+        return web.json_response({
+            "id": file_id, "object": "file", "bytes": len(self.files[file_id]), "created_at": 0,
+            "filename": "pregenerate.jsonl", "purpose": "batch", "status": "processed",
+        })
+
+    async def file_content(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.files[request.match_info["file_id"]])
+
+    async def create_batch(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.created_batches += 1
+        batch_id = f"batch-{self.created_batches}"
+        self.batches[batch_id] = {"input_file_id": body["input_file_id"], "polls": 0}
+        return web.json_response(self._batch(batch_id, "validating"))
+
+    async def retrieve_batch(self, request: web.Request) -> web.Response:
+        if self.fail_next_retrieve:
+            self.fail_next_retrieve = False
+            return web.json_response({"error": {"message": "boom"}}, status=500)
+        batch_id = request.match_info["batch_id"]
+        batch = self.batches[batch_id]
+        batch["polls"] += 1
+        # Первая проверка — пачка ещё выполняется
+        if batch["polls"] == 1:
+            return web.json_response(self._batch(batch_id, "in_progress"))
+        output_id = f"{batch_id}-output"
+        if output_id not in self.files:
+            self.files[output_id] = self._complete(self.files[batch["input_file_id"]])
+        return web.json_response(self._batch(batch_id, "completed", output_file_id=output_id))
+
+    def _batch(self, batch_id: str, status: str, output_file_id: str | None = None) -> dict:
+        return {
+            "id": batch_id, "object": "batch", "endpoint": "/v1/chat/completions",
+            "input_file_id": self.batches[batch_id]["input_file_id"], "completion_window": "24h",
+            "status": status, "created_at": 0, "output_file_id": output_file_id,
+        }
+
+    @staticmethod
+    def _complete(input_jsonl: bytes) -> bytes:
+        lines = []
+        for line in input_jsonl.decode("utf-8").splitlines():
+            request = json.loads(line)
+            lines.append(json.dumps({
+                "id": f"response-{request['custom_id']}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "body": {"choices": [{"message": {"content": f"Отчёт {request['custom_id']}"}}]},
+                },
+                "error": None,
+            }, ensure_ascii=False))
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def test_question_count_matches_questions():
+    from handlers.test import QUESTIONS
+    from services.answer_codec import QUESTION_COUNT
+
+    assert len(QUESTIONS) == QUESTION_COUNT
+
+
+def test_pregenerate_resumes_after_crash(run_db, tmp_path, monkeypatch):
+    import pregenerate
+    from db.database import async_session_maker
+    from db.models import ReportCacheEntry
+    from services.analyzer import PROMPT_VERSION
+    from services.llm_client import llm
+
+    fake = FakeBatchAPI()
+    state_path = str(tmp_path / "state.json")
+
+    async def run_pregenerate() -> int:
+        # Все пять «чистых» профилей и их пары: 15 запросов в 2 пачках
+        return await pregenerate.pregenerate(
+            "space", limit=15, min_dominant=5, batch_size=8, poll_seconds=0, state_path=state_path
+        )
+
+    async def scenario():
+        runner = web.AppRunner(fake.app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        openai = AsyncOpenAI(api_key="test-key", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0)
+        monkeypatch.setattr(llm, "openai", openai)
+        try:
+            # Падение после отправки пачек: состояние остаётся на диске
+            fake.fail_next_retrieve = True
+            with pytest.raises(InternalServerError):
+                await run_pregenerate()
+            with open(state_path, encoding="utf-8") as state_file:
+                assert len(json.load(state_file)["batches"]) == 2
+
+            stored = await run_pregenerate()
+            assert stored == 15
+            # Повторный запуск не отправил пачки заново
+            assert fake.created_batches == 2
+
+            async with async_session_maker() as session:
+                cached = (await session.execute(
+                    select(func.count()).select_from(ReportCacheEntry)
+                    .where(ReportCacheEntry.prompt_version == PROMPT_VERSION)
+                )).scalar_one()
+            assert cached == 15
+
+            # Всё уже в кэше: третий запуск ничего не отправляет
+            assert await run_pregenerate() == 0
+            assert fake.created_batches == 2
+        finally:
+            await openai.close()
+            await runner.cleanup()
+
+    run_db(scenario)
@@ -0,0 +1,144 @@
+"""
+Каждый обработчик чтения делает ровно один запрос к БД (db/repository.py)
+"""
+
+import contextlib
+from unittest.mock import AsyncMock
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import event
+
+from config import ADMIN_IDS
+
+
+@contextlib.contextmanager
+def count_queries():
+    """Список SQL-запросов, выполненных внутри блока"""
+    from db.database import engine
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+async def create_session(status, partner1_user_id, partner2_user_id=None, report=None) -> int:
+    """Сессия (и результат с отчётом, если задан report); возвращает ID сессии"""
+    from db.database import async_session_maker
+    from db.models import Session as DBSession, Result
+    from services.report_store import store_report
+
+    async with async_session_maker() as session:
+        db_session = DBSession(status=status, partner1_user_id=partner1_user_id, partner2_user_id=partner2_user_id)
+        session.add(db_session)
+        await session.flush()
+        if report is not None:
+            blob = await store_report(session, report)
+            session.add(Result(session_id=db_session.id, compatibility_score=77, report_hash=blob.hash))
+        await session.commit()
+        return db_session.id
+
+
+def fake_message(user_id: int) -> AsyncMock:
+    message = AsyncMock()
+    message.from_user.id = user_id
+    message.chat.id = user_id
+    return message
+
+
+def fake_callback(user_id: int, data: str) -> AsyncMock:
+    callback = AsyncMock()
+    callback.data = data
+    callback.from_user.id = user_id
+    callback.bot.get_chat.side_effect = RuntimeError("нет сети в тестах")
+    return callback
+
+
+def fake_pdf(tmp_path):
+    def generate_pdf_report(**kwargs):
+        path = tmp_path / "report.pdf"
+        path.write_bytes(b"%PDF-1.4\n")
+        return str(path)
+    return generate_pdf_report
+
+
+def test_start_test_logic_single_query(run_db, new_user_id):
+    from db.models import SessionStatus
+    from handlers.test import start_test_logic
+
+    user_id = new_user_id()
+
+    async def scenario():
+        await create_session(SessionStatus.IN_PROGRESS, user_id, new_user_id())
+        message = fake_message(user_id)
+        state = FSMContext(MemoryStorage(), StorageKey(bot_id=1, chat_id=user_id, user_id=user_id))
+        with count_queries() as statements:
+            await start_test_logic(message, user_id, state)
+        assert "Тест на совместимость" in message.answer.await_args.args[0]
+        return statements
+
+    statements = run_db(scenario)
+    assert len(statements) == 1, statements
+
+
+def test_show_results_single_query(run_db, new_user_id):
+    from db.models import SessionStatus
+    from handlers.results import show_results
+
+    user_id = new_user_id()
+
+    async def scenario():
+        await create_session(SessionStatus.COMPLETED, user_id, new_user_id(), report="Отчёт " * 200)
+        message = fake_message(user_id)
+        with count_queries() as statements:
+            await show_results(message)
+        assert "77%" in message.answer.await_args.args[0]
+        return statements
+
+    statements = run_db(scenario)
+    assert len(statements) == 1, statements
+
+
+def test_process_payment_single_query(run_db, new_user_id, monkeypatch, tmp_path):
+    import handlers.results
+    from db.models import SessionStatus
+
+    monkeypatch.setattr(handlers.results, "generate_pdf_report", fake_pdf(tmp_path))
+    user_id = new_user_id()
+
+    async def scenario():
+        session_id = await create_session(SessionStatus.COMPLETED, user_id, new_user_id(), report="Полный отчёт")
+        callback = fake_callback(user_id, f"buy_{session_id}")
+        with count_queries() as statements:
+            await handlers.results.process_payment(callback)
+        callback.message.answer_document.assert_awaited_once()
+        return statements
+
+    statements = run_db(scenario)
+    assert len(statements) == 1, statements
+
+
+def test_pdf_generation_single_query(run_db, new_user_id, monkeypatch, tmp_path):
+    import handlers.results
+    from db.models import SessionStatus
+
+    monkeypatch.setattr(handlers.results, "generate_pdf_report", fake_pdf(tmp_path))
+
+    async def scenario():
+        session_id = await create_session(SessionStatus.COMPLETED, new_user_id(), new_user_id(), report="Полный отчёт")
+        callback = fake_callback(ADMIN_IDS[0], f"test_pdf_{session_id}")
+        with count_queries() as statements:
+            await handlers.results.test_pdf_generation(callback)
+        callback.message.answer_document.assert_awaited_once()
+        return statements
+
+    statements = run_db(scenario)
+    assert len(statements) == 1, statements
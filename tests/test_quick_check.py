@@ -0,0 +1,73 @@
+"""
+Быструю проверку проходит только второй партнёр, создатель ссылки её не видит
+"""
+
+from unittest.mock import AsyncMock, MagicMock
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import select
+
+from services.answer_codec import encode_answers
+
+
+async def create_quick_check(creator: int, friend: int) -> int:
+    """Быстрая проверка, к которой уже присоединился второй партнёр"""
+    from db.database import async_session_maker
+    from db.models import Session as DBSession, SessionStatus, UserProfile
+
+    async with async_session_maker() as session:
+        session.add(UserProfile(user_id=creator, answers_packed=encode_answers(["A"] * 5)))
+        db_session = DBSession(
+            status=SessionStatus.IN_PROGRESS,
+            partner1_user_id=creator,
+            partner2_user_id=friend,
+            is_quick_check=True,
+        )
+        session.add(db_session)
+        await session.commit()
+        return db_session.id
+
+
+def test_creator_has_no_active_quiz_in_own_quick_check(run_db, new_user_id):
+    from db.database import async_session_maker
+    from db.repository import get_active_session_with_answer
+
+    creator, friend = new_user_id(), new_user_id()
+
+    async def scenario():
+        session_id = await create_quick_check(creator, friend)
+        async with async_session_maker() as session:
+            creator_session, _ = await get_active_session_with_answer(session, creator)
+            friend_session, _ = await get_active_session_with_answer(session, friend)
+        assert creator_session is None
+        assert friend_session.id == session_id
+
+    run_db(scenario)
+
+
+def test_quick_check_analysis_uses_partner2_answers(run_db, new_user_id):
+    from db.database import async_session_maker
+    from db.models import AnalysisJob
+    from handlers.test import finish_test
+
+    creator, friend = new_user_id(), new_user_id()
+    friend_answers = ["B", "C", "D", "E", "A"]
+
+    async def scenario():
+        session_id = await create_quick_check(creator, friend)
+        message = AsyncMock()
+        message.chat.id = friend
+        message.answer.return_value = MagicMock(message_id=1)
+        state = FSMContext(MemoryStorage(), StorageKey(bot_id=1, chat_id=friend, user_id=friend))
+        await finish_test(message, state, friend_answers, user_id=friend, session_id=session_id)
+
+        async with async_session_maker() as session:
+            job = (await session.execute(
+                select(AnalysisJob).where(AnalysisJob.session_id == session_id)
+            )).scalar_one()
+        assert (job.user1_id, job.user2_id) == (creator, friend)
+        assert job.answers2_packed == encode_answers(friend_answers)
+
+    run_db(scenario)
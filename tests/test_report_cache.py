@@ -0,0 +1,36 @@
+"""
+Проигравший гонку put не кладёт в память вариант, которого нет в report_cache
+"""
+
+from sqlalchemy import select
+
+
+def test_conflicting_put_reloads_variants_from_db(run_db):
+    from db.database import async_session_maker
+    from db.models import ReportCacheEntry
+    from services.report_cache import ReportCache
+
+    prompt_version, low, high = "test-race", 1, 2
+    key = (prompt_version, low, high)
+    # Два процесса с одним и тем же пустым снимком пары
+    first, second = ReportCache(variants=2), ReportCache(variants=2)
+
+    async def scenario():
+        for cache in (first, second):
+            cache._remember(key, [])
+        await first.put(prompt_version, low, high, "Отчёт первого процесса")
+        await second.put(prompt_version, low, high, "Отчёт второго процесса")
+
+        async with async_session_maker() as session:
+            variants = (await session.execute(
+                select(ReportCacheEntry.variant).where(ReportCacheEntry.prompt_version == prompt_version)
+            )).scalars().all()
+        assert variants == [0]
+        assert first._lru[key] == ["Отчёт первого процесса"]
+        assert second._lru[key] == ["Отчёт первого процесса"]
+
+        # Следующий put второго процесса уже пишет вариант 1
+        await second.put(prompt_version, low, high, "Ещё один отчёт")
+        assert second._lru[key] == ["Отчёт первого процесса", "Ещё один отчёт"]
+
+    run_db(scenario)
@@ -0,0 +1,72 @@
+"""
+Повторное нажатие последней подписанной кнопки теста не ломает обработчик
+"""
+
+from unittest.mock import AsyncMock, MagicMock
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import func, select
+
+from services.answer_codec import encode_answers
+from services.quiz_callback import encode_quiz_callback
+
+
+def fake_callback(user_id: int, data: str) -> AsyncMock:
+    callback = AsyncMock()
+    callback.data = data
+    callback.from_user.id = user_id
+    callback.message.chat.id = user_id
+    callback.message.answer.return_value = MagicMock(message_id=1)
+    return callback
+
+
+def sent_texts(callback: AsyncMock) -> list[str]:
+    return [call.args[0] for call in callback.message.answer.await_args_list]
+
+
+def test_repeated_last_tap_reports_already_answered(run_db, new_user_id):
+    from db.database import async_session_maker
+    from db.models import Answer, Session as DBSession, SessionStatus
+    from handlers.test import ALREADY_ANSWERED_TEXT, process_stateless_answer_callback
+
+    partner1, partner2 = new_user_id(), new_user_id()
+    storage = MemoryStorage()
+
+    async def tap(session_id: int) -> AsyncMock:
+        data = encode_quiz_callback(session_id, encode_answers(["A", "B", "C", "D", "E"]), partner1)
+        callback = fake_callback(partner1, data)
+        state = FSMContext(storage, StorageKey(bot_id=1, chat_id=partner1, user_id=partner1))
+        await process_stateless_answer_callback(callback, state)
+        return callback
+
+    async def scenario():
+        async with async_session_maker() as session:
+            db_session = DBSession(
+                status=SessionStatus.IN_PROGRESS, partner1_user_id=partner1, partner2_user_id=partner2
+            )
+            session.add(db_session)
+            await session.commit()
+            session_id = db_session.id
+
+        first = await tap(session_id)
+        second = await tap(session_id)
+
+        assert ALREADY_ANSWERED_TEXT not in sent_texts(first)
+        assert ALREADY_ANSWERED_TEXT in sent_texts(second)
+        async with async_session_maker() as session:
+            answers = (await session.execute(
+                select(func.count()).select_from(Answer).where(Answer.session_id == session_id)
+            )).scalar_one()
+        assert answers == 1
+
+        # Кнопка из старого сообщения после завершения сессии
+        async with async_session_maker() as session:
+            db_session = await session.get(DBSession, session_id)
+            db_session.status = SessionStatus.COMPLETED
+            await session.commit()
+        stale = await tap(session_id)
+        assert ALREADY_ANSWERED_TEXT in sent_texts(stale)
+
+    run_db(scenario)
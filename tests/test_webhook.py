@@ -0,0 +1,65 @@
+"""
+Webhook отклоняет запросы без секрета и некорректные тела, а без WEBHOOK_SECRET не запускается
+"""
+
+import asyncio
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiohttp.test_utils import TestClient, TestServer
+
+from services.webhook import SECRET_HEADER, build_webhook_app
+
+_SECRET = "test-secret"
+
+
+class RecordingExecutor:
+    """Очередь-заглушка: запоминает принятые апдейты"""
+
+    def __init__(self):
+        self.updates = []
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def submit(self, update) -> bool:
+        self.updates.append(update)
+        return True
+
+
+def make_bot() -> Bot:
+    bot = Bot("123456:test-token")
+
+    async def set_webhook(*args, **kwargs):
+        return True
+
+    bot.set_webhook = set_webhook
+    return bot
+
+
+def test_webhook_requires_secret():
+    with pytest.raises(ValueError):
+        build_webhook_app(Dispatcher(), make_bot(), RecordingExecutor(), secret="")
+
+
+def test_webhook_rejects_forged_and_malformed_requests():
+    executor = RecordingExecutor()
+
+    async def scenario():
+        bot = make_bot()
+        app = build_webhook_app(Dispatcher(), bot, executor, path="/webhook", secret=_SECRET)
+        async with TestClient(TestServer(app)) as client:
+            update = {"update_id": 1}
+            forged = await client.post("/webhook", json=update)
+            wrong = await client.post("/webhook", json=update, headers={SECRET_HEADER: "guess"})
+            not_json = await client.post("/webhook", data=b"{not json", headers={SECRET_HEADER: _SECRET})
+            not_update = await client.post("/webhook", json={"foo": 1}, headers={SECRET_HEADER: _SECRET})
+            accepted = await client.post("/webhook", json=update, headers={SECRET_HEADER: _SECRET})
+        await bot.session.close()
+        return [response.status for response in (forged, wrong, not_json, not_update, accepted)]
+
+    assert asyncio.run(scenario()) == [401, 401, 400, 400, 200]
+    assert [update.update_id for update in executor.updates] == [1]